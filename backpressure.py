@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import threading
+import time
+
+# 过载保护
+# 服务器每秒检查一次接收积压（写入队列长度 + 正在处理的帧数）和帧处理延迟（从收完负载到保存完成，asyncio 模式包含线程池排队时间），
+# 超过水位线时提高过载级别，低于水位线的一半时每次检查降一级，避免在水位线附近来回切换
+# 每个级别对客户端的要求见 LEVEL_ACTIONS：延长截屏间隔、降低编码档位、暂停离线缓存补传；最高级别时服务器还会放慢读取
+# 标记为重要的客户端比其他客户端晚 IMPORTANT_LAG 级受到限制
+QUEUE_WATERMARKS = (1000, 5000, 20000)  # 进入 1、2、3 级的积压帧数
+LATENCY_WATERMARKS = (0.5, 2.0, 5.0)  # 进入 1、2、3 级的帧处理延迟，单位为秒
+RECOVERY_RATIO = 0.5  # 降级时使用的水位线比例
+CHECK_INTERVAL = 1.0  # 检查间隔，单位为秒
+# 每个级别的 (截屏间隔倍数, 最低编码档位)，编码档位见 encoding.LEVELS；1 级起客户端暂停补传
+LEVEL_ACTIONS = [(1.0, 0), (2.0, 0), (3.0, 3), (4.0, 5)]
+MAX_LEVEL = len(LEVEL_ACTIONS) - 1
+IMPORTANT_LAG = 2  # 重要客户端的级别 = 服务器级别 - IMPORTANT_LAG
+SHED_DELAY = 1.0  # 最高级别时每读取一帧前等待的时间，单位为秒，依靠 TCP 流量控制让客户端放慢发送
+
+# 超过了几条水位线
+def crossed(value, watermarks, ratio=1.0):
+    return sum(1 for watermark in watermarks if value > watermark * ratio)
+
+class Backpressure:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.level = 0
+        self.floor = 0  # 外部要求的最低级别，无界面模式下由主进程按写入队列下发给工作进程
+        self.tokens = itertools.count()
+        self.inflight = {}  # 正在处理的帧 -> 开始时刻
+        self.total = 0.0  # 本次检查间隔内处理完的帧的总延迟和帧数
+        self.count = 0
+        self.latency = 0.0
+
+    # 一帧开始排队处理，返回交给 end 的标记
+    def begin(self):
+        token = next(self.tokens)
+        with self.lock:
+            self.inflight[token] = time.monotonic()
+        return token
+
+    def end(self, token):
+        with self.lock:
+            started = self.inflight.pop(token, None)
+            if started is not None:
+                self.total += time.monotonic() - started
+                self.count += 1
+
+    def inflight_count(self):
+        with self.lock:
+            return len(self.inflight)
+
+    # 按积压帧数重新计算级别，级别变化时返回 True；backlog 为写入队列等其他积压，正在处理的帧数自动加上
+    # 延迟取本间隔内处理完的帧的平均延迟和最早一帧已经等待的时间中较大的一个，磁盘卡住时也能发现
+    def update(self, backlog=0):
+        now = time.monotonic()
+        with self.lock:
+            depth = backlog + len(self.inflight)
+            oldest = now - min(self.inflight.values()) if self.inflight else 0.0
+            average = self.total / self.count if self.count else 0.0
+            self.total, self.count = 0.0, 0
+            self.latency = max(average, oldest)
+            up = max(crossed(depth, QUEUE_WATERMARKS), crossed(self.latency, LATENCY_WATERMARKS))
+            down = max(crossed(depth, QUEUE_WATERMARKS, RECOVERY_RATIO),
+                       crossed(self.latency, LATENCY_WATERMARKS, RECOVERY_RATIO))
+            if up >= self.level:
+                level = up
+            else:
+                level = max(min(self.level, down), self.level - 1)
+            level = max(level, self.floor)
+            changed = level != self.level
+            self.level = level
+            return changed
+
+    # 一个客户端适用的级别
+    def level_for(self, important):
+        return max(self.level - IMPORTANT_LAG, 0) if important else self.level
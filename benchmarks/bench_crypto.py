@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# 截图负载加密基准：对比明文发送、分块流式 AES-GCM，以及整块 AES-CBC + base64（控制消息的加密方式）
+# 发送和接收在同一进程的两个线程中运行，CPU 时间为整个进程的用户态 + 内核态时间
+# 用法：python benchmarks/bench_crypto.py [--size-mb 4] [--frames 20]
+
+import os
+import sys
+import time
+import base64
+import socket
+import hashlib
+import argparse
+import threading
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad, unpad
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import protocol
+import stream_cipher
+
+MODES = ['plain', 'gcm_stream', 'cbc_base64']
+CBC_KEY = b'1234567890123456'
+
+def send_cbc(sock, payload):
+    cipher = AES.new(CBC_KEY, AES.MODE_CBC)
+    data = base64.b64encode(cipher.iv) + b':' + base64.b64encode(cipher.encrypt(pad(payload, AES.block_size)))
+    protocol.send_frame(sock, protocol.FRAME, data)
+
+def recv_cbc(sock, hasher):
+    msg_type, flags, length, client_id, seq = protocol.recv_header(sock)
+    iv, ct = bytes(protocol.recv_payload(sock, length)).split(b':')
+    data = unpad(AES.new(CBC_KEY, AES.MODE_CBC, base64.b64decode(iv)).decrypt(base64.b64decode(ct)), AES.block_size)
+    hasher.update(data)
+    return length
+
+def run_mode(mode, size, frames):
+    payload = os.urandom(size)
+    expected = hashlib.sha256(payload).hexdigest()
+    cipher = stream_cipher.StreamCipher(stream_cipher.new_session_key())
+    server, client = socket.socketpair()
+    wire = [0]  # 接收到的负载字节数
+
+    def sender():
+        for seq in range(1, frames + 1):
+            if mode == 'plain':
+                protocol.send_frame(client, protocol.FRAME, payload, seq=seq)
+            elif mode == 'gcm_stream':
+                cipher.send_frame(client, protocol.FRAME, payload, seq=seq)
+            else:
+                send_cbc(client, payload)
+
+    cpu_start = os.times()
+    start = time.perf_counter()
+    thread = threading.Thread(target=sender, daemon=True)
+    thread.start()
+    for _ in range(frames):
+        hasher = hashlib.sha256()
+        if mode == 'cbc_base64':
+            wire[0] += recv_cbc(server, hasher)
+        else:
+            msg_type, flags, length, client_id, seq = protocol.recv_header(server)
+            if flags & protocol.FLAG_ENCRYPTED:
+                cipher.recv_payload(server, msg_type, flags, length, client_id, seq, hasher)
+            else:
+                protocol.recv_payload(server, length, hasher)
+            wire[0] += length
+        assert hasher.hexdigest() == expected, 'hash mismatch'
+    thread.join()
+    elapsed = time.perf_counter() - start
+    cpu_end = os.times()
+    cpu = (cpu_end.user - cpu_start.user) + (cpu_end.system - cpu_start.system)
+    server.close()
+    client.close()
+    total_mb = size * frames / 1024 / 1024
+    return {
+        'mode': mode,
+        'mb_per_s': total_mb / elapsed,
+        'cpu_ms_per_mb': cpu * 1000 / total_mb,
+        'wire_overhead': wire[0] / (size * frames) - 1,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='截图负载加密基准')
+    parser.add_argument('--size-mb', type=float, default=4, help='单帧大小(MB)')
+    parser.add_argument('--frames', type=int, default=20, help='每种模式发送的帧数')
+    args = parser.parse_args()
+    size = int(args.size_mb * 1024 * 1024)
+
+    print(f"{'mode':<12} {'MB/s':>10} {'CPU ms/MB':>10} {'wire +%':>8}")
+    for mode in MODES:
+        result = run_mode(mode, size, args.frames)
+        print(f"{mode:<12} {result['mb_per_s']:>10.1f} {result['cpu_ms_per_mb']:>10.2f} "
+              f"{result['wire_overhead'] * 100:>8.2f}")
+
+if __name__ == '__main__':
+    main()
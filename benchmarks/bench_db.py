@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+# 截图记录写入基准：对比多线程共用一个连接、每条记录单独提交，与单线程批量写入器 + WAL
+# 用法：python benchmarks/bench_db.py [--clients 100 1000] [--inserts 20]
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS screenshots (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        client_mac TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        image_path TEXT,
+        ip_address TEXT,
+        image_hash TEXT
+    )
+'''
+INSERT = 'INSERT INTO screenshots (client_mac, image_path, ip_address, image_hash) VALUES (?, ?, ?, ?)'
+
+def row(client, i):
+    return (f'00:00:00:00:{client >> 8:02x}:{client & 0xff:02x}', f'screenshots/{client}-{i}.jpg',
+            f'10.0.{client >> 8}.{client & 0xff}', f'{client:032x}{i:032x}')
+
+# 旧方式：所有线程共用一个连接，每条记录 execute + commit
+def run_shared(path, clients, inserts):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute(SCHEMA)
+    conn.commit()
+    errors = []
+
+    def worker(client):
+        for i in range(inserts):
+            try:
+                cursor = conn.cursor()
+                cursor.execute(INSERT, row(client, i))
+                conn.commit()
+            except Exception as e:  # 多线程共用连接时可能出现 database is locked 甚至 SystemError
+                errors.append(e)
+
+    elapsed = run_threads(worker, clients)
+    conn.close()
+    return elapsed, len(errors)
+
+# 新方式：所有线程把写操作交给批量写入器
+def run_batched(path, clients, inserts):
+    conn = database.connect(path)
+    conn.execute(SCHEMA)
+    writer = database.DBWriter(conn)
+    writer.start()
+
+    def insert(cursor, values):
+        cursor.execute(INSERT, values)
+
+    def worker(client):
+        for i in range(inserts):
+            writer.submit(insert, row(client, i))
+
+    start = time.perf_counter()
+    run_threads(worker, clients)
+    writer.flush()
+    elapsed = time.perf_counter() - start
+    writer.stop()
+    writer.join()
+    conn.close()
+    return elapsed, 0
+
+def run_threads(worker, clients):
+    threads = [threading.Thread(target=worker, args=(client,)) for client in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='截图记录写入基准')
+    parser.add_argument('--clients', type=int, nargs='+', default=[100, 1000], help='模拟的客户端数量')
+    parser.add_argument('--inserts', type=int, default=20, help='每个客户端插入的记录数')
+    args = parser.parse_args()
+
+    print(f"{'clients':>8} {'mode':<8} {'inserts/s':>12} {'errors':>8}")
+    for clients in args.clients:
+        for mode, func in (('shared', run_shared), ('batched', run_batched)):
+            with tempfile.TemporaryDirectory() as tmp:
+                elapsed, errors = func(os.path.join(tmp, 'bench.db'), clients, args.inserts)
+            rate = clients * args.inserts / elapsed
+            print(f"{clients:>8} {mode:<8} {rate:>12.0f} {errors:>8}")
+
+if __name__ == '__main__':
+    main()
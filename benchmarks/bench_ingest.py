@@ -0,0 +1,606 @@
+# -*- coding: utf-8 -*-
+
+# 端到端接收基准：模拟 N 个客户端，用与 Client 相同的 REGISTER/LOGIN 握手和二进制帧协议向本地服务器上传合成截图
+# 统计每秒帧数、单帧确认延迟分位数、服务器进程的 CPU/RSS、数据库写入速率和磁盘写入速率，结果保存为 JSON，用于比较版本间的回归
+# 模拟客户端可以用线程、asyncio 或多个进程驱动；服务器默认在临时目录的子进程中运行，也可以用 --server 连接已运行的服务器
+# 用法：python benchmarks/bench_ingest.py [--clients 100] [--duration 30] [--interval 1] [--concurrency thread]
+#       python benchmarks/bench_ingest.py --server 127.0.0.1:5000 --server-pid 1234 --db screenshots.db
+#       python benchmarks/bench_ingest.py --compare old.json new.json
+
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import signal
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import protocol
+import capture
+import delta
+import database
+import partitions
+import stream_cipher
+from client import aes_encrypt, aes_decrypt, ENCRYPT_PAYLOAD
+
+try:
+    import psutil
+except ImportError:
+    psutil = None  # 没有 psutil 时不统计服务器的 CPU/RSS/磁盘写入
+
+CONCURRENCY = ['thread', 'asyncio', 'process']
+PASSWORD = 'bench'
+CONNECT_TIMEOUT = 10  # 连接和握手的超时时间，单位为秒
+ACK_TIMEOUT = 30  # 等待确认的超时时间，超时视为该客户端失败
+SAMPLE_INTERVAL = 0.5  # 采样服务器 RSS 的间隔，单位为秒
+SETTLE_TIME = 2.0  # 停止发送后等待写入线程提交的时间，单位为秒
+RESULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+# 比较两次结果时列出的指标：(路径, 是否越大越好)
+COMPARE_KEYS = [
+    ('frames_per_s', True),
+    ('mb_per_s', True),
+    ('latency_ms.p50', False),
+    ('latency_ms.p99', False),
+    ('server.cpu_percent', False),
+    ('server.rss_mb_peak', False),
+    ('server.disk_write_mb_per_s', False),
+    ('db.rows_per_s', True),
+]
+
+# 生成合成截图池：第一帧为关键帧，差分模式下之后为相对前一帧的差分帧，模拟客户端循环发送
+def make_pool(args):
+    backend = capture.SyntheticBackend(size=(args.width, args.height), change_rate=args.change_rate)
+    encoder = delta.DeltaEncoder(quality=args.quality, keyframe_interval=args.pool)
+    pool = []
+    for i in range(args.pool):
+        image = backend.capture()
+        if args.delta:
+            encoded = encoder.encode(image)
+            if encoded is not None:
+                pool.append(encoded)
+        elif i == 0 or args.change_rate > 0:
+            pool.append((False, delta.encode_image(image, args.quality, 'jpeg')))
+    return pool
+
+def client_mac(index):
+    return f'02:be:00:{index >> 16 & 0xff:02x}:{index >> 8 & 0xff:02x}:{index & 0xff:02x}'
+
+# 测试结束后由各个驱动汇总的单个客户端结果
+def empty_summary():
+    return {'frames': 0, 'bytes': 0, 'errors': 0, 'latencies': []}
+
+# 把一次 sendall 的数据收集到列表中，用于生成加密帧的字节串
+class FrameBuffer:
+    def __init__(self):
+        self.parts = []
+
+    def sendall(self, data):
+        self.parts.append(bytes(data))
+
+# 单个模拟客户端的协议状态，线程和 asyncio 两种驱动共用
+class VirtualClient:
+    def __init__(self, index, pool, args):
+        self.index = index
+        self.pool = pool
+        self.meta = f'codec=jpeg quality={args.quality} scale=1 gray=0'
+        self.encrypt = args.encrypt
+        self.unique = args.unique
+        self.username = f'bench{index}'
+        self.mac_address = client_mac(index)
+        self.ip_address = f'10.{index >> 16 & 0xff}.{index >> 8 & 0xff}.{index & 0xff}'
+        self.client_id = protocol.mac_to_client_id(self.mac_address)
+        self.logged_in = False
+        self.session_cipher = None
+        self.protocol_version = 0
+        self.position = 0  # 下一帧在截图池中的位置
+        self.seq = 0
+        self.summary = empty_summary()
+
+    def register_message(self):
+        return aes_encrypt(f'REGISTER {self.username} {PASSWORD} {self.mac_address} {self.ip_address}'.encode())
+
+    def login_message(self):
+        return aes_encrypt(f'LOGIN {self.username} {PASSWORD} {protocol.PROTOCOL_VERSION}'.encode())
+
+    # 服务器在读取第一帧之前依次发送 LOGGEDIN、频率、协议版本和会话密钥，收齐后才能开始发送二进制帧
+    def handshake_done(self):
+        return self.logged_in and self.session_cipher is not None
+
+    def handle_control(self, text):
+        if text == 'LOGGEDIN':
+            self.logged_in = True
+        elif text == 'LOGINFAILED':
+            raise ConnectionError(f'Login failed for {self.username}')
+        elif text.startswith('PROTOCOL'):
+            self.protocol_version = min(int(text.split()[1]), protocol.PROTOCOL_VERSION)
+        elif text.startswith('SESSION_KEY'):
+            self.session_cipher = stream_cipher.StreamCipher(base64.b64decode(text.split()[1]))
+        elif text == 'KEYFRAME':
+            self.position = 0  # 服务器缺少参考帧，从关键帧重新开始
+
+    def handle_legacy(self, data):
+        messages = protocol.split_legacy(data)
+        if not messages:
+            raise ConnectionError('Connection closed by server')
+        for message in messages:
+            self.handle_control(aes_decrypt(message).decode())
+
+    # 生成下一帧，返回 (帧序号, 帧字节串, 图像字节数)
+    # 关键帧末尾附加客户端编号和帧序号，JPEG 解码时忽略，避免服务器按内容去重后跳过磁盘写入
+    def next_frame(self):
+        is_delta, data = self.pool[self.position]
+        self.position = (self.position + 1) % len(self.pool)
+        self.seq += 1
+        if self.unique and not is_delta:
+            data = data + f'bench{self.index}:{self.seq}'.encode()
+        flags = protocol.FLAG_ACK_REQUEST | protocol.FLAG_META
+        if is_delta:
+            flags |= protocol.FLAG_DELTA
+        payload = protocol.pack_meta(self.meta) + data
+        if self.protocol_version >= 4:
+            flags |= protocol.FLAG_TIMESTAMP
+            payload = protocol.pack_timestamp(time.time()) + payload
+        if self.encrypt and self.protocol_version >= 3:
+            buffer = FrameBuffer()
+            self.session_cipher.send_frame(buffer, protocol.FRAME, payload, self.client_id, self.seq, flags)
+            frame = b''.join(buffer.parts)
+        else:
+            frame = protocol.pack_frame(protocol.FRAME, payload, self.client_id, self.seq, flags)
+        return self.seq, frame, len(data)
+
+    # 处理服务器发来的一个二进制帧，返回是否确认了 seq
+    def handle_frame(self, msg_type, ack_seq, payload, seq):
+        if msg_type == protocol.CONTROL:
+            self.handle_control(aes_decrypt(payload).decode())
+        return msg_type == protocol.ACK and ack_seq >= seq
+
+    def record(self, sent_at, size):
+        self.summary['frames'] += 1
+        self.summary['bytes'] += size
+        self.summary['latencies'].append((time.perf_counter() - sent_at) * 1000)
+
+    # 阻塞方式注册并登录，返回已登录的连接
+    def connect(self, host, port):
+        sock = socket.create_connection((host, port), CONNECT_TIMEOUT)
+        sock.sendall(self.register_message())
+        sock.recv(1024)  # 用户已存在时注册失败，直接登录
+        sock.close()
+        sock = socket.create_connection((host, port), CONNECT_TIMEOUT)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.sendall(self.login_message())
+        while not self.handshake_done():
+            self.handle_legacy(sock.recv(4096))
+        sock.settimeout(ACK_TIMEOUT)
+        return sock
+
+    # 阻塞方式按固定间隔发送，每帧等待确认后再计时下一帧
+    def run(self, sock, duration, interval, offset):
+        start = time.monotonic()
+        deadline = start + duration
+        next_time = start + offset
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if next_time > now:
+                time.sleep(min(next_time, deadline) - now)
+                continue
+            seq, frame, size = self.next_frame()
+            sent_at = time.perf_counter()
+            sock.sendall(frame)
+            while not self.handle_frame(*self.recv_frame(sock), seq):
+                pass
+            self.record(sent_at, size)
+            next_time = max(next_time + interval, time.monotonic() - interval)
+
+    def recv_frame(self, sock):
+        msg_type, flags, client_id, ack_seq, payload = protocol.recv_frame(sock)
+        return msg_type, ack_seq, payload
+
+    # asyncio 方式注册并登录
+    async def connect_async(self, host, port):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), CONNECT_TIMEOUT)
+        writer.write(self.register_message())
+        await asyncio.wait_for(reader.read(1024), CONNECT_TIMEOUT)
+        writer.close()
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), CONNECT_TIMEOUT)
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        writer.write(self.login_message())
+        while not self.handshake_done():
+            self.handle_legacy(await asyncio.wait_for(reader.read(4096), CONNECT_TIMEOUT))
+        return reader, writer
+
+    async def run_async(self, reader, writer, duration, interval, offset):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + duration
+        next_time = start + offset
+        while True:
+            now = loop.time()
+            if now >= deadline:
+                break
+            if next_time > now:
+                await asyncio.sleep(min(next_time, deadline) - now)
+                continue
+            seq, frame, size = self.next_frame()
+            sent_at = time.perf_counter()
+            writer.write(frame)
+            await writer.drain()
+            while True:
+                header = await asyncio.wait_for(reader.readexactly(protocol.HEADER_SIZE), ACK_TIMEOUT)
+                msg_type, flags, length, client_id, ack_seq = protocol.unpack_header(header)
+                payload = await reader.readexactly(length) if length else b''
+                if self.handle_frame(msg_type, ack_seq, payload, seq):
+                    break
+            self.record(sent_at, size)
+            next_time = max(next_time + interval, loop.time() - interval)
+        writer.close()
+
+# 线程驱动：每个模拟客户端一个线程，全部登录后调用 ready()，等待 start 后同时开始发送
+def run_thread_clients(indexes, args, host, port, ready, start):
+    pool = make_pool(args)
+    clients = [VirtualClient(index, pool, args) for index in indexes]
+    logged_in = threading.Barrier(len(clients) + 1)
+    offsets = np.random.RandomState(indexes[0] if indexes else 0).uniform(0, args.interval, len(clients))
+
+    def worker(client, offset):
+        sock = None
+        try:
+            sock = client.connect(host, port)
+        except Exception as e:
+            print(f'Client {client.index} failed to log in: {e}')
+            client.summary['errors'] += 1
+        logged_in.wait()
+        start.wait()
+        if sock is None:
+            return
+        try:
+            client.run(sock, args.duration, args.interval, offset)
+        except Exception as e:
+            print(f'Client {client.index} failed: {e}')
+            client.summary['errors'] += 1
+        finally:
+            sock.close()
+
+    threads = [threading.Thread(target=worker, args=(client, offset), daemon=True)
+               for client, offset in zip(clients, offsets)]
+    for thread in threads:
+        thread.start()
+    logged_in.wait()
+    ready()
+    start.wait()
+    for thread in threads:
+        thread.join()
+    return [client.summary for client in clients]
+
+# asyncio 驱动：所有模拟客户端在一个事件循环中运行
+def run_async_clients(indexes, args, host, port, ready):
+    pool = make_pool(args)
+    clients = [VirtualClient(index, pool, args) for index in indexes]
+    offsets = np.random.RandomState(0).uniform(0, args.interval, len(clients))
+
+    async def connect(client):
+        try:
+            return await client.connect_async(host, port)
+        except Exception as e:
+            print(f'Client {client.index} failed to log in: {e}')
+            client.summary['errors'] += 1
+
+    async def run(client, connection, offset):
+        if connection is None:
+            return
+        try:
+            await client.run_async(*connection, args.duration, args.interval, offset)
+        except Exception as e:
+            print(f'Client {client.index} failed: {e}')
+            client.summary['errors'] += 1
+
+    async def main():
+        connections = await asyncio.gather(*(connect(client) for client in clients))
+        ready()
+        await asyncio.gather(*(run(client, connection, offset)
+                               for client, connection, offset in zip(clients, connections, offsets)))
+
+    asyncio.run(main())
+    return [client.summary for client in clients]
+
+# 进程驱动的子进程：用线程模拟分到的客户端，登录完成后通知主进程，结果通过队列返回
+def process_worker(indexes, args, host, port, events, start):
+    summaries = run_thread_clients(indexes, args, host, port, lambda: events.put('ready'), start)
+    events.put(summaries)
+
+def run_process_clients(args, host, port, ready):
+    context = multiprocessing.get_context('spawn')
+    events = context.Queue()
+    start = context.Event()
+    groups = [list(range(i, args.clients, args.processes)) for i in range(args.processes)]
+    workers = [context.Process(target=process_worker, args=(group, args, host, port, events, start), daemon=True)
+               for group in groups if group]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        events.get()
+    ready()
+    start.set()
+    summaries = []
+    for _ in workers:
+        summaries.extend(events.get())
+    for worker in workers:
+        worker.join()
+    return summaries
+
+# 服务器进程（含子进程）的资源占用
+class ServerMonitor:
+    def __init__(self, pid):
+        self.process = psutil.Process(pid) if psutil is not None and pid else None
+        self.rss_peak = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    # 返回 (CPU 秒数, RSS 字节数, 磁盘写入字节数)，取不到的项为 None
+    def snapshot(self):
+        cpu = rss = written = 0
+        try:
+            processes = [self.process] + self.process.children(recursive=True)
+        except psutil.Error:
+            return None, None, None
+        for process in processes:
+            try:
+                times = process.cpu_times()
+                cpu += times.user + times.system
+                rss += process.memory_info().rss
+                io = process.io_counters() if hasattr(process, 'io_counters') else None
+                written = written + io.write_bytes if io is not None and written is not None else None
+            except psutil.Error:
+                continue
+        return cpu, rss, written
+
+    def sample(self):
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            rss = self.snapshot()[1]
+            if rss:
+                self.rss_peak = max(self.rss_peak, rss)
+
+    def begin(self):
+        if self.process is None:
+            return
+        self.start_time = time.perf_counter()
+        self.start_snapshot = self.snapshot()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def end(self):
+        if self.process is None:
+            return {'cpu_percent': None, 'rss_mb_peak': None, 'rss_mb_end': None, 'disk_write_mb_per_s': None}
+        self.stopped.set()
+        self.thread.join()
+        elapsed = time.perf_counter() - self.start_time
+        cpu, rss, written = self.snapshot()
+        cpu0, _, written0 = self.start_snapshot
+        self.rss_peak = max(self.rss_peak, rss or 0)
+        return {
+            'cpu_percent': (cpu - cpu0) / elapsed * 100 if cpu is not None else None,
+            'rss_mb_peak': self.rss_peak / 1024 / 1024,
+            'rss_mb_end': rss / 1024 / 1024 if rss is not None else None,
+            'disk_write_mb_per_s': ((written - written0) / elapsed / 1024 / 1024
+                                    if written is not None and written0 is not None else None),
+        }
+
+# 主库旧表和所有分区中的截图记录数
+def count_rows(db_path):
+    if not db_path or not os.path.exists(db_path):
+        return None
+    total = 0
+    for path in [db_path] + [path for _, path in partitions.list_partitions(db_path)]:
+        conn = database.connect_readonly(path)
+        try:
+            total += conn.execute('SELECT COUNT(*) FROM screenshots').fetchone()[0]
+        except Exception:
+            pass
+        finally:
+            conn.close()
+    return total
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+# 在工作目录中启动服务器子进程，等待端口可以连接
+def launch_server(args, workdir):
+    port = free_port()
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', '--port', str(port),
+                                '--server-mode', args.server_mode, '--storage', args.storage],
+                               cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + CONNECT_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Server exited with code {process.returncode}, see {log.name}')
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('Server did not start listening')
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(CONNECT_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+# 子进程内部使用：在当前目录运行服务器，收到 SIGTERM 时正常停止以提交写入队列
+def serve(args):
+    import server
+    srv = server.Server(mode=args.server_mode, storage=args.storage)
+    srv.server_ip = '127.0.0.1'
+    srv.server_port = args.port
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        srv.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        srv.stop()
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(__file__),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def percentiles(latencies):
+    if not latencies:
+        return {'p50': None, 'p90': None, 'p99': None, 'max': None, 'mean': None}
+    values = np.asarray(latencies)
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {'p50': p50, 'p90': p90, 'p99': p99, 'max': float(values.max()), 'mean': float(values.mean())}
+
+# 运行一次基准，返回结果字典
+def run_benchmark(args):
+    workdir = None
+    process = None
+    if args.server:
+        host, port = args.server.rsplit(':', 1)
+        port = int(port)
+        server_pid, db_path = args.server_pid, args.db
+    else:
+        workdir = tempfile.TemporaryDirectory(prefix='bench_ingest_')
+        process, port = launch_server(args, workdir.name)
+        host, server_pid, db_path = '127.0.0.1', process.pid, os.path.join(workdir.name, database.DB_PATH)
+
+    monitor = ServerMonitor(server_pid)
+    baseline = {}
+
+    def ready():
+        baseline['rows'] = count_rows(db_path)
+        baseline['time'] = time.perf_counter()
+        monitor.begin()
+        print(f'{args.clients} clients logged in, sending for {args.duration}s')
+
+    try:
+        if args.concurrency == 'thread':
+            start = threading.Event()
+            summaries = run_thread_clients(list(range(args.clients)), args, host, port,
+                                           lambda: (ready(), start.set()), start)
+        elif args.concurrency == 'asyncio':
+            summaries = run_async_clients(list(range(args.clients)), args, host, port, ready)
+        else:
+            summaries = run_process_clients(args, host, port, ready)
+        elapsed = time.perf_counter() - baseline['time']
+        server_stats = monitor.end()
+        time.sleep(SETTLE_TIME)
+        rows = count_rows(db_path)
+    finally:
+        if process is not None:
+            stop_server(process)
+        if workdir is not None:
+            workdir.cleanup()
+
+    frames = sum(summary['frames'] for summary in summaries)
+    total_bytes = sum(summary['bytes'] for summary in summaries)
+    latencies = [latency for summary in summaries for latency in summary['latencies']]
+    inserted = rows - baseline['rows'] if rows is not None and baseline['rows'] is not None else None
+    return {
+        'version': {'git': git_revision(), 'protocol': protocol.PROTOCOL_VERSION},
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime()),
+        'config': {key: getattr(args, key) for key in ('clients', 'concurrency', 'processes', 'duration', 'interval',
+                                                         'width', 'height', 'quality', 'change_rate', 'delta',
+                                                         'unique', 'encrypt', 'server_mode', 'storage', 'server')},
+        'elapsed_s': elapsed,
+        'clients_failed': sum(1 for summary in summaries if summary['errors']),
+        'frames': frames,
+        'frames_per_s': frames / elapsed,
+        'mb_per_s': total_bytes / elapsed / 1024 / 1024,
+        'latency_ms': percentiles(latencies),
+        'server': server_stats,
+        'db': {'rows': inserted, 'rows_per_s': inserted / elapsed if inserted is not None else None},
+    }
+
+def lookup(result, path):
+    for key in path.split('.'):
+        result = result.get(key) if isinstance(result, dict) else None
+    return result
+
+def format_value(value):
+    return f'{value:.1f}' if isinstance(value, (int, float)) else 'n/a'
+
+def print_result(result):
+    for path, _ in COMPARE_KEYS:
+        print(f'{path:<28} {format_value(lookup(result, path)):>10}')
+    print(f"{'clients_failed':<28} {result['clients_failed']:>10}")
+
+# 比较两次结果，变差超过 5% 的指标标记为 REGRESSION
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'metric':<28} {'old':>10} {'new':>10} {'change':>8}")
+    for path, higher_is_better in COMPARE_KEYS:
+        a, b = lookup(old, path), lookup(new, path)
+        change = (b - a) / a * 100 if isinstance(a, (int, float)) and isinstance(b, (int, float)) and a else None
+        flag = ''
+        if change is not None and (change < -5 if higher_is_better else change > 5):
+            flag = ' REGRESSION'
+        change_text = f'{change:+.1f}%' if change is not None else 'n/a'
+        print(f'{path:<28} {format_value(a):>10} {format_value(b):>10} {change_text:>8}{flag}')
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端截图接收基准')
+    parser.add_argument('--clients', type=int, default=100, help='模拟的客户端数量')
+    parser.add_argument('--concurrency', choices=CONCURRENCY, default='thread', help='模拟客户端的驱动方式')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='process 驱动的进程数')
+    parser.add_argument('--duration', type=float, default=30, help='发送时长(秒)')
+    parser.add_argument('--interval', type=float, default=1.0, help='每个客户端的发送间隔(秒)，0 表示收到确认后立即发送')
+    parser.add_argument('--width', type=int, default=1920, help='合成截图宽度')
+    parser.add_argument('--height', type=int, default=1080, help='合成截图高度')
+    parser.add_argument('--quality', type=int, default=70, help='JPEG 质量')
+    parser.add_argument('--change-rate', type=float, default=capture.SYNTHETIC_CHANGE_RATE, help='每帧变化的图块比例')
+    parser.add_argument('--pool', type=int, default=30, help='预先编码的截图数')
+    parser.add_argument('--delta', action=argparse.BooleanOptionalAction, default=False, help='发送差分帧')
+    parser.add_argument('--unique', action=argparse.BooleanOptionalAction, default=True,
+                        help='每个关键帧内容不同，不被服务器去重')
+    parser.add_argument('--encrypt', action=argparse.BooleanOptionalAction, default=ENCRYPT_PAYLOAD,
+                        help='用会话密钥加密负载')
+    parser.add_argument('--server-mode', choices=['thread', 'asyncio'], default='thread', help='服务器连接处理模式')
+    parser.add_argument('--storage', choices=['files', 'pack'], default='files', help='服务器截图存储方式')
+    parser.add_argument('--server', metavar='HOST:PORT', help='连接已运行的服务器，不启动子进程')
+    parser.add_argument('--server-pid', type=int, help='已运行服务器的进程号，用于统计 CPU/RSS/磁盘写入')
+    parser.add_argument('--db', help='已运行服务器的数据库路径，用于统计写入速率')
+    parser.add_argument('--output', help='结果 JSON 路径，默认写入 benchmarks/results')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='比较两次结果')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)  # 服务器子进程内部使用
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    result = run_benchmark(args)
+    output = args.output or os.path.join(RESULT_DIR, f"ingest-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2, default=float)
+    print_result(result)
+    print(f'Results written to {output}')
+
+if __name__ == '__main__':
+    main()
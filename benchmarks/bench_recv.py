@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# 截图接收路径的微基准：对比旧的 img_data += recv(4096) 与 recv_into 预分配缓冲区、直接写文件
+# 每种模式在独立子进程中运行，以便分别统计峰值RSS
+# 用法：python benchmarks/bench_recv.py [--size-mb 8] [--frames 20]
+
+import os
+import sys
+import json
+import socket
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import protocol
+
+MODES = ['legacy', 'recv_into', 'to_file']
+
+# 获取当前进程的峰值RSS，单位为MB
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 单位为KB，macOS 为字节
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 1024 / 1024
+        except (ImportError, AttributeError):
+            return None
+
+# 旧的接收方式（旧协议靠 ready/finish 分隔帧，这里限制读取长度以免读到下一帧）
+def recv_legacy(sock, length):
+    img_data = b''
+    len_recved = 0
+    while len_recved < length:
+        recved = sock.recv(min(4096, length - len_recved))
+        img_data += recved
+        len_recved += len(recved)
+    return hashlib.sha256(img_data).hexdigest()
+
+def recv_into(sock, length):
+    hasher = hashlib.sha256()
+    protocol.recv_payload(sock, length, hasher)
+    return hasher.hexdigest()
+
+def recv_to_file(sock, length, path):
+    hasher = hashlib.sha256()
+    with open(path, 'wb') as f:
+        protocol.recv_payload_to_file(sock, length, f, hasher)
+    return hasher.hexdigest()
+
+# 在子进程中运行一种模式
+def run_mode(mode, size, frames):
+    payload = os.urandom(size)
+    expected = hashlib.sha256(payload).hexdigest()
+    server, client = socket.socketpair()
+
+    def sender():
+        for _ in range(frames):
+            client.sendall(payload)
+
+    threading.Thread(target=sender, daemon=True).start()
+    tmp_path = os.path.join(tempfile.gettempdir(), f'bench_recv_{os.getpid()}.jpg')
+    start = time.perf_counter()
+    for _ in range(frames):
+        if mode == 'legacy':
+            digest = recv_legacy(server, size)
+        elif mode == 'recv_into':
+            digest = recv_into(server, size)
+        else:
+            digest = recv_to_file(server, size, tmp_path)
+        assert digest == expected, 'hash mismatch'
+    elapsed = time.perf_counter() - start
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    server.close()
+    client.close()
+    return {
+        'mode': mode,
+        'frames': frames,
+        'size_mb': size / 1024 / 1024,
+        'mb_per_s': size * frames / elapsed / 1024 / 1024,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='截图接收路径微基准')
+    parser.add_argument('--size-mb', type=float, default=8, help='单帧大小(MB)')
+    parser.add_argument('--frames', type=int, default=20, help='每种模式接收的帧数')
+    parser.add_argument('--mode', choices=MODES, help='只运行一种模式（子进程内部使用）')
+    args = parser.parse_args()
+    size = int(args.size_mb * 1024 * 1024)
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, size, args.frames)))
+        return
+
+    print(f"{'mode':<10} {'MB/s':>10} {'peak RSS (MB)':>15}")
+    for mode in MODES:
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--mode', mode,
+                                          '--size-mb', str(args.size_mb), '--frames', str(args.frames)])
+        result = json.loads(output)
+        rss = result['peak_rss_mb']
+        rss_text = f"{rss:.1f}" if rss is not None else 'n/a'
+        print(f"{mode:<10} {result['mb_per_s']:>10.1f} {rss_text:>15}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import abc
+import time
+import threading
+import numpy as np
+from PIL import Image
+
+# 截屏后端，客户端启动时逐个试用，选择单帧耗时最短的一个
+# region 为 (left, top, width, height) 的截取区域，None 表示整个主屏幕；scale < 1 时截屏后按比例缩小
+AUTO_BACKENDS = ('mss', 'pyautogui')  # 自动选择时参与比较的后端，合成画面只在显式指定时使用
+PROBE_FRAMES = 3  # 选择后端时每个后端截取的帧数
+SYNTHETIC_SIZE = (1920, 1080)
+SYNTHETIC_TILE = 64
+SYNTHETIC_CHANGE_RATE = 0.05  # 合成画面每帧变化的图块比例
+
+class CaptureError(Exception):
+    pass
+
+# 子类实现 grab，截取未缩放的一帧
+class CaptureBackend(abc.ABC):
+    name = None
+
+    def __init__(self, region=None, scale=1.0):
+        self.region = region
+        self.scale = scale
+
+    # 截取一帧，返回 RGB 图像
+    def capture(self):
+        image = self.grab()
+        if self.scale < 1.0:
+            size = (max(1, int(image.width * self.scale)), max(1, int(image.height * self.scale)))
+            image = image.resize(size, Image.BOX)
+        return image
+
+    # 生成 size 大小的灰度探测图，用于判断画面是否变化，返回 (探测图, 截取的整帧或 None)
+    # 默认截取整帧后缩小，整帧一并返回，画面变化时直接编码，不再截第二次；能只读取采样点的后端覆盖该方法
+    def probe(self, size):
+        image = self.capture()
+        return make_probe(image, size), image
+
+    @abc.abstractmethod
+    def grab(self):
+        pass
+
+    def close(self):
+        pass
+
+# pyautogui 截屏，Linux 下通常调用外部程序截图后再读回，速度最慢但兼容性最好
+class PyAutoGUIBackend(CaptureBackend):
+    name = 'pyautogui'
+
+    def __init__(self, region=None, scale=1.0):
+        super().__init__(region, scale)
+        import pyautogui
+        self.pyautogui = pyautogui
+
+    def grab(self):
+        return self.pyautogui.screenshot(region=self.region).convert('RGB')
+
+# mss 直接读取显示服务器的原始像素缓冲区（X11 下使用 XShm），不经过临时文件
+# mss 实例不能跨线程使用，每个线程各自创建
+class MSSBackend(CaptureBackend):
+    name = 'mss'
+
+    def __init__(self, region=None, scale=1.0):
+        super().__init__(region, scale)
+        import mss
+        self.mss = mss
+        self.local = threading.local()
+        self.instances = []
+        self.lock = threading.Lock()
+        self.session()
+
+    def session(self):
+        sct = getattr(self.local, 'sct', None)
+        if sct is None:
+            sct = self.local.sct = self.mss.mss()
+            with self.lock:
+                self.instances.append(sct)
+        return sct
+
+    def monitor(self, sct):
+        if self.region is None:
+            return sct.monitors[1]  # 与 pyautogui 一致，截取主屏幕
+        left, top, width, height = self.region
+        return {'left': left, 'top': top, 'width': width, 'height': height}
+
+    def grab(self):
+        sct = self.session()
+        shot = sct.grab(self.monitor(sct))
+        return Image.frombuffer('RGB', shot.size, shot.bgra, 'raw', 'BGRX')
+
+    # 直接在原始 BGRA 缓冲区上按步长取样，以绿色通道近似灰度，不转换整帧、不缩放
+    # 画面变化时客户端再调用 capture 截取整帧
+    def probe(self, size):
+        sct = self.session()
+        shot = sct.grab(self.monitor(sct))
+        width, height = shot.size
+        pixels = np.frombuffer(shot.bgra, dtype=np.uint8).reshape(height, width, 4)
+        step_x, step_y = max(1, width // size[0]), max(1, height // size[1])
+        return pixels[::step_y, ::step_x, 1][:size[1], :size[0]].astype(np.int16), None
+
+    def close(self):
+        with self.lock:
+            for sct in self.instances:
+                sct.close()
+            self.instances.clear()
+
+# 合成画面，不需要显示器，用于基准测试和压力测试
+# 同一个 seed 生成的帧序列完全相同；每帧随机替换 change_rate 比例的图块
+class SyntheticBackend(CaptureBackend):
+    name = 'synthetic'
+
+    def __init__(self, region=None, scale=1.0, size=SYNTHETIC_SIZE, change_rate=SYNTHETIC_CHANGE_RATE, seed=0):
+        super().__init__(region, scale)
+        self.change_rate = change_rate
+        self.rng = np.random.RandomState(seed)
+        if region is not None:
+            size = region[2:]
+        width, height = size
+        # 平滑渐变背景，接近真实桌面的可压缩程度
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        self.frame = np.empty((height, width, 3), dtype=np.uint8)
+        self.frame[..., 0] = x
+        self.frame[..., 1] = y
+        self.frame[..., 2] = (x + y) / 2
+        self.rows = -(-height // SYNTHETIC_TILE)
+        self.cols = -(-width // SYNTHETIC_TILE)
+
+    def grab(self):
+        tiles = self.rows * self.cols
+        count = int(round(tiles * self.change_rate))
+        for index in self.rng.choice(tiles, count, replace=False):
+            row, col = divmod(int(index), self.cols)
+            y, x = row * SYNTHETIC_TILE, col * SYNTHETIC_TILE
+            self.frame[y:y + SYNTHETIC_TILE, x:x + SYNTHETIC_TILE] = self.rng.randint(0, 256, 3, dtype=np.uint8)
+        return Image.fromarray(self.frame.copy())  # 复制一份，下游保留的旧帧不会被后续修改
+
+# 生成低分辨率灰度探测图
+def make_probe(image, size):
+    return np.asarray(image.convert('L').resize(size, Image.BOX), dtype=np.int16)
+
+BACKENDS = {
+    'mss': MSSBackend,
+    'pyautogui': PyAutoGUIBackend,
+    'synthetic': SyntheticBackend,
+}
+
+# 测量后端的平均单帧耗时，单位为秒
+def measure(backend, frames=PROBE_FRAMES):
+    backend.capture()  # 第一帧通常包含初始化开销，不计入
+    start = time.perf_counter()
+    for _ in range(frames):
+        backend.capture()
+    return (time.perf_counter() - start) / frames
+
+# 创建截屏后端；name 为 'auto' 时试用所有可用后端，选择最快的一个
+def select_backend(name='auto', region=None, scale=1.0):
+    if name != 'auto':
+        if name not in BACKENDS:
+            raise CaptureError(f"Unknown capture backend: {name}")
+        backend = BACKENDS[name](region, scale)
+        print(f"Capture backend {name}: {measure(backend) * 1000:.1f} ms/frame")
+        return backend
+
+    best, best_time = None, None
+    for candidate in AUTO_BACKENDS:
+        try:
+            backend = BACKENDS[candidate](region, scale)
+            elapsed = measure(backend)
+        except Exception as e:
+            print(f"Capture backend {candidate} unavailable: {e}")
+            continue
+        print(f"Capture backend {candidate}: {elapsed * 1000:.1f} ms/frame")
+        if best_time is None or elapsed < best_time:
+            if best is not None:
+                best.close()
+            best, best_time = backend, elapsed
+        else:
+            backend.close()
+    if best is None:
+        raise CaptureError("No capture backend available")
+    print(f"Using capture backend: {best.name}")
+    return best
@@ -3,23 +3,117 @@
 import os
 import socket
 import threading
-import pyautogui
+import queue
+import collections
+import random
 from PIL import Image
-from io import BytesIO
 import time
 import hashlib
-from PyQt5 import QtWidgets, QtGui
-from client_gui import run_client_app
+import numpy as np
 import uuid
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad, unpad
 import base64
+import protocol
+import delta
+import capture
+import encoding
+import stream_cipher
+import spool
 
 # 客户端配置
 SERVER_IP = '10.122.223.61'  # 替换为实际服务器的地址
 SERVER_PORT = 5000
 CAPTURE_INTERVAL = 15  # 截屏间隔时间，单位为秒
 AES_KEY = b'1234567890123456'  # 16字节密钥
+ACK_INTERVAL = 4  # 补传时每隔多少帧请求一次累积确认；实时帧每帧都请求确认，用于估计上传吞吐量
+MAX_UNACKED = 8  # 允许未确认的最大帧数，超过后等待服务器确认
+ACK_TIMEOUT = 30  # 等待确认的超时时间，单位为秒
+DELTA_MODE = True  # 二进制协议下只发送变化的图块，并定期发送关键帧
+ADAPTIVE_CAPTURE = True  # 根据画面变化决定是否截屏上传
+MIN_CAPTURE_INTERVAL = 2  # 探测画面变化的间隔，由服务器的 SET_FREQUENCY 控制
+INTERVAL_FLOOR = 0.1  # 截屏间隔的下限，服务器下发0或负数时使用，单位为秒
+PROBE_SIZE = (160, 90)  # 低分辨率探测图大小
+PROBE_PIXEL_DELTA = 12  # 探测图中灰度差超过该值才算变化，过滤JPEG噪声和光标闪烁
+CHANGE_THRESHOLD = 0.002  # 变化像素占比超过该值时立即截屏上传
+PIPELINE_QUEUE_SIZE = 2  # 截屏->编码、编码->发送之间的队列长度，满时丢弃最旧的帧
+PIPELINE_POLL = 0.5  # 流水线线程检查停止标志的间隔，单位为秒
+STATS_INTERVAL = 60  # 打印各阶段耗时统计的间隔，单位为秒
+CAPTURE_BACKEND = 'auto'  # 截屏后端：auto、mss、pyautogui 或 synthetic，auto 时选择最快的可用后端
+CAPTURE_REGION = None  # 截取区域 (left, top, width, height)，None 表示整个主屏幕
+CAPTURE_SCALE = 1.0  # 截屏后的缩放比例，小于1时先缩小再编码
+ENCRYPT_PAYLOAD = True  # 服务器下发会话密钥后加密截图负载
+SPOOL_ENABLED = True  # 与服务器断开期间把截图缓存到本地，重连后补传
+SPOOL_BATCH = 20  # 每批补传的最大帧数，整批确认后才提交补传位置
+SPOOL_BATCH_BYTES = 8 * 1024 * 1024  # 每批补传的最大字节数
+SPOOL_RATE = 2 * 1024 * 1024  # 补传速率上限，单位为字节/秒，避免重连后挤占实时截图和服务器带宽
+SPOOL_POLL = 1.0  # 没有待补传的帧时检查缓存的间隔，单位为秒
+RECONNECT_MIN_DELAY = 1.0  # 断线后第一次重连前的等待时间，单位为秒
+RECONNECT_MAX_DELAY = 60.0  # 重连失败后指数退避的上限
+
+# 计算两张探测图的变化分数：灰度差超过阈值的像素占比
+def change_score(prev_probe, probe):
+    if prev_probe is None or prev_probe.shape != probe.shape:
+        return 1.0
+    return np.count_nonzero(np.abs(probe - prev_probe) > PROBE_PIXEL_DELTA) / probe.size
+
+# 有界队列，满时丢弃最旧的一项，下游总是处理最新的画面
+class LatestQueue(queue.Queue):
+    # 放入一项，返回被丢弃的旧项，没有丢弃时返回 None
+    def put_latest(self, item):
+        with self.not_full:
+            dropped = None
+            if 0 < self.maxsize <= self._qsize():
+                dropped = self._get()
+                self.unfinished_tasks -= 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+            return dropped
+
+    # 清空队列，返回被丢弃的项数
+    def clear(self):
+        with self.not_full:
+            count = self._qsize()
+            self.queue.clear()
+            self.unfinished_tasks -= count
+            return count
+
+# 流水线单个阶段的耗时统计，单位为秒
+class StageStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.dropped = 0
+
+    def record(self, elapsed):
+        with self.lock:
+            self.count += 1
+            self.total += elapsed
+            self.max = max(self.max, elapsed)
+
+    def drop(self, count=1):
+        with self.lock:
+            self.dropped += count
+
+    # 返回统计摘要并清零
+    def take(self):
+        with self.lock:
+            avg = self.total / self.count if self.count else 0.0
+            summary = f"{avg * 1000:.1f}/{self.max * 1000:.1f}ms x{self.count}"
+            if self.dropped:
+                summary += f" dropped {self.dropped}"
+            self.reset()
+            return summary
+
+# 单调时钟的截屏时刻换算为 UTC 秒数
+def wall_time(monotonic_time):
+    return time.time() - (time.monotonic() - monotonic_time)
 
 # AES 加密和解密函数
 def aes_encrypt(data):
@@ -38,20 +132,67 @@ def aes_decrypt(enc_data):
     return pt
 
 class Client:
-    def __init__(self, server_ip=SERVER_IP, server_port=SERVER_PORT, capture_interval=CAPTURE_INTERVAL):
+    def __init__(self, server_ip=SERVER_IP, server_port=SERVER_PORT, capture_interval=CAPTURE_INTERVAL,
+                 capture_backend=CAPTURE_BACKEND, spool_dir=spool.SPOOL_DIR):
         self.server_ip = server_ip
         self.server_port = server_port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.is_running = True
-        self.capture_interval = capture_interval
+        self.capture_interval = max(capture_interval, INTERVAL_FLOOR)
+        self.min_interval = min(MIN_CAPTURE_INTERVAL, self.capture_interval)
+        self.adaptive_capture = ADAPTIVE_CAPTURE
         self.mac_address = self.get_mac_address()  # 获取MAC地址
         self.ip_address = self.get_ip_address()  # 获取IP地址
         self.username = None  # 添加用户名属性
+        self.password = None  # 断线重连时重新登录
+        self.connected = threading.Event()  # 已登录且连接可用
+        self.client_id = protocol.mac_to_client_id(self.mac_address)  # 二进制帧头中的客户端ID
+        self.protocol_version = 0  # 服务器通告支持二进制协议前使用旧的文本握手
+        self.seq = 0  # 已发送的最大帧序号
+        self.acked_seq = 0  # 服务器已确认的最大帧序号
+        self.ack_cond = threading.Condition()
+        self.in_flight = collections.deque()  # 已发出未确认的帧：(序号, 开始发送时刻, 字节数, 是否补传帧)
+        self.last_ack_at = 0.0  # 上一次收到确认的时刻
+        self.legacy_replies = queue.Queue()  # 旧协议下的 ready/finish 回复
+        self.pending_messages = []  # 登录回复时粘连收到的控制消息
+        self.delta_mode = DELTA_MODE
+        self.delta_encoder = delta.DeltaEncoder()
+        self.session_cipher = None  # 登录后服务器下发的会话密钥
+        self.capture_backend_name = capture_backend
+        self.capture_backend = None  # 第一次开始截屏时选择
+        self.encoder = encoding.AdaptiveEncoder()
+        self.encode_queue = LatestQueue(PIPELINE_QUEUE_SIZE)  # (截屏时刻, 截图)
+        self.send_queue = LatestQueue(PIPELINE_QUEUE_SIZE)  # (截屏时刻, 是否二进制协议, 是否差分帧, 图像数据)
+        self.pipeline_stop = threading.Event()
+        self.schedule_changed = threading.Event()  # 截屏间隔改变或客户端停止时唤醒截屏线程
+        self.stage_stats = {name: StageStats() for name in ('lag', 'capture', 'encode', 'send')}
+        self.send_lock = threading.Lock()  # 实时发送和补传两个线程共用连接，分配序号和写帧必须连续
+        self.spool_dir = spool_dir
+        self.spool = None  # 第一次开始截屏时打开
+        self.spool_rate = SPOOL_RATE
+        self.throttle_level = 0  # 服务器通知的过载级别，大于0时暂停补传
 
     # 连接到服务器
     def connect(self):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.connect((self.server_ip, self.server_port))
+        self.protocol_version = 0
+        self.session_cipher = None
+        self.seq = 0
+        self.acked_seq = 0
+        self.in_flight.clear()
+        self.throttle_level = 0
+        self.delta_encoder.reset()
+        while not self.legacy_replies.empty():  # 旧连接上没有取走的 ready/finish 不能留给新连接
+            self.legacy_replies.get_nowait()
+
+    # 接收一条旧协议回复，粘连在后面的消息留给接收线程处理
+    def recv_reply(self):
+        messages = protocol.split_legacy(self.sock.recv(1024))
+        if not messages:
+            raise ConnectionError("Connection closed by server")
+        self.pending_messages.extend(messages[1:])
+        return aes_decrypt(messages[0]).decode()
 
     # 获取MAC地址
     def get_mac_address(self):
@@ -75,7 +216,7 @@ class Client:
             self.connect()
             registration_info = f'REGISTER {username} {password} {self.mac_address} {self.ip_address}'
             self.sock.sendall(aes_encrypt(registration_info.encode()))
-            response = aes_decrypt(self.sock.recv(1024)).decode()
+            response = self.recv_reply()
             if response == 'REGISTERED':
                 self.username = username
                 signal.emit("Registration successful")
@@ -89,55 +230,400 @@ class Client:
     # 登录用户
     def login(self, username, password, signal):
         try:
-            self.connect()
-            login_info = f'LOGIN {username} {password}'
-            self.sock.sendall(aes_encrypt(login_info.encode()))
-            response = aes_decrypt(self.sock.recv(1024)).decode()
-            if response == 'LOGGEDIN':
+            if self.authenticate(username, password):
                 self.username = username
+                self.password = password
                 signal.emit("Login successful")
-                threading.Thread(target=self.receive_updates).start()  # 启动监听更新线程
             else:
                 signal.emit("Login failed")
         except Exception as e:
             print(f"Login error: {e}")
             signal.emit(f"Login error: {e}")
 
-    # 接收服务器的更新消息
-    def receive_updates(self):
+    # 建立连接并登录，成功后启动监听更新线程
+    def authenticate(self, username, password):
+        self.connect()
+        login_info = f'LOGIN {username} {password} {protocol.PROTOCOL_VERSION}'  # 声明支持的帧协议版本，服务器据此下发协议版本和会话密钥
+        self.sock.sendall(aes_encrypt(login_info.encode()))
+        if self.recv_reply() != 'LOGGEDIN':
+            self.sock.close()
+            return False
+        self.connected.set()
+        threading.Thread(target=self.receive_updates, args=(self.sock,)).start()  # 启动监听更新线程
+        return True
+
+    # 连接断开：关闭旧连接并唤醒等待确认的线程，由重连线程重新登录
+    # sock 为出错的连接，已经被新连接替换时忽略
+    def connection_lost(self, sock):
+        with self.ack_cond:
+            if sock is not self.sock or not self.connected.is_set():
+                return
+            self.connected.clear()
+            self.ack_cond.notify_all()
+        try:
+            sock.close()
+        except OSError:
+            pass
+        if self.is_running:
+            print("Connection to server lost, frames will be spooled until reconnected")
+
+    # 重连线程：断线后按指数退避加随机抖动重试，避免服务器重启后所有客户端同时重连
+    def reconnect_loop(self):
+        delay = RECONNECT_MIN_DELAY
+        while not self.pipeline_stop.is_set():
+            if self.connected.is_set() or self.password is None:
+                delay = RECONNECT_MIN_DELAY
+                self.pipeline_stop.wait(PIPELINE_POLL)
+                continue
+            if self.pipeline_stop.wait(delay * random.uniform(0.5, 1.0)):
+                break
+            try:
+                if not self.authenticate(self.username, self.password):
+                    raise ConnectionError("Login rejected")
+                print(f"Reconnected to server {self.server_ip}:{self.server_port}")
+            except Exception as e:
+                print(f"Reconnect failed, retrying in up to {min(delay * 2, RECONNECT_MAX_DELAY):.0f}s: {e}")
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    # 接收服务器的更新消息，同时负责读取确认帧和旧协议的 ready/finish 回复
+    def receive_updates(self, sock):
+        messages, self.pending_messages = self.pending_messages, []
+        for message in messages:
+            self.handle_message(aes_decrypt(message).decode())
         while self.is_running:
             try:
-                data = aes_decrypt(self.sock.recv(1024)).decode()
-                if data.startswith('SET_FREQUENCY'):
-                    _, new_frequency = data.split()
-                    self.capture_interval = int(new_frequency)  # 更新截屏频率
-                    print(f"Updated capture interval to: {self.capture_interval} seconds")
+                if protocol.peek_is_binary(sock):
+                    msg_type, flags, client_id, seq, payload = protocol.recv_frame(sock)
+                    if msg_type == protocol.ACK:
+                        with self.ack_cond:
+                            self.acked_seq = max(self.acked_seq, seq)
+                            self.record_delivery(seq)
+                            self.ack_cond.notify_all()
+                    elif msg_type == protocol.CONTROL:
+                        self.handle_message(aes_decrypt(payload).decode())
+                    continue
+                messages = protocol.split_legacy(sock.recv(1024))
+                if not messages:
+                    raise ConnectionError("Connection closed by server")
+                for message in messages:
+                    self.handle_message(aes_decrypt(message).decode())
             except Exception as e:
-                print(f"Error receiving update: {e}")
+                if self.is_running:
+                    print(f"Error receiving update: {e}")
                 break
+        self.connection_lost(sock)
+        with self.ack_cond:
+            self.ack_cond.notify_all()
+
+    # 处理服务器发来的一条控制消息
+    def handle_message(self, data):
+        if data in ('ready', 'finish'):
+            self.legacy_replies.put(data)
+        elif data.startswith('SET_FREQUENCY'):
+            values = data.split()[1:]
+            self.capture_interval = max(float(values[0]), INTERVAL_FLOOR)  # 更新截屏频率
+            if len(values) > 1:
+                self.min_interval = max(float(values[1]), INTERVAL_FLOOR)
+            self.min_interval = min(self.min_interval, self.capture_interval)
+            self.schedule_changed.set()
+            print(f"Updated capture interval to: {self.min_interval}-{self.capture_interval} seconds")
+        elif data.startswith('PROTOCOL'):
+            _, version = data.split()
+            self.protocol_version = min(int(version), protocol.PROTOCOL_VERSION)
+            print(f"Using frame protocol version: {self.protocol_version}")
+        elif data.startswith('SESSION_KEY'):
+            _, key = data.split()
+            self.session_cipher = stream_cipher.StreamCipher(base64.b64decode(key))
+            print("Received session key, image payloads will be encrypted")
+        elif data.startswith('SET_ENCODING'):
+            self.encoder.apply_hint(data[len('SET_ENCODING'):].strip())
+            print(f"Updated encoding: {self.encoder.describe()}")
+        elif data == 'KEYFRAME':
+            self.delta_encoder.force_keyframe()  # 服务器缺少参考帧，下一帧发送关键帧
+        elif data.startswith('THROTTLE'):
+            self.throttle_level = int(data.split()[1])  # 截屏间隔和编码档位由随后的 SET_FREQUENCY、SET_ENCODING 调整
+            print(f"Server load level: {self.throttle_level}")
+
+    # 旧协议：发送长度，等待 ready，发送图像，等待 finish；整个过程持有 send_lock，断开消息不会插在中间
+    def send_legacy(self, img_data):
+        length_msg = str(len(img_data)).encode()
+        print(f"Sending length: {length_msg}")
+        with self.send_lock:
+            self.sock.sendall(aes_encrypt(length_msg))  # 发送图像数据长度
+            self.wait_legacy_reply()  # 等待服务器准备
+            self.sock.sendall(img_data)  # 发送图像数据
+            self.wait_legacy_reply()  # 等待服务器结束
+
+    # 等待一条 ready/finish 回复，断线或客户端停止时立即放弃
+    def wait_legacy_reply(self):
+        deadline = time.monotonic() + ACK_TIMEOUT
+        while True:
+            if not self.connected.is_set() or not self.is_running:
+                raise ConnectionError("Not connected to server")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("No reply from server")
+            try:
+                return self.legacy_replies.get(timeout=min(remaining, PIPELINE_POLL))
+            except queue.Empty:
+                pass
+
+    # 服务器确认到 seq 为止的帧：用确认的字节数除以送达耗时估计上传吞吐量，调用时持有 ack_cond
+    # sendall 返回只说明数据写进了发送缓冲区，送达耗时从这批帧开始发送或上一次确认（取较晚者）算到收到确认
+    # 含补传帧的批次按 spool_rate 限速发送，耗时不反映带宽，不参与估计
+    def record_delivery(self, seq):
+        now = time.monotonic()
+        size, sent_at, spooled = 0, None, False
+        while self.in_flight and self.in_flight[0][0] <= seq:
+            _, frame_sent_at, frame_size, frame_spooled = self.in_flight.popleft()
+            size += frame_size
+            sent_at = frame_sent_at if sent_at is None else sent_at
+            spooled = spooled or frame_spooled
+        if size and not spooled:
+            self.encoder.record_delivery(size, now - max(sent_at, self.last_ack_at))
+        self.last_ack_at = now
+
+    # 二进制协议：直接流水线发送，定期请求累积确认，未确认的帧过多时等待
+    # ack_request 为 True 时这一帧必定请求确认；返回帧序号
+    def send_binary(self, img_data, flags=0, ack_request=False):
+        with self.send_lock:
+            if not self.connected.is_set():
+                raise ConnectionError("Not connected to server")
+            with self.ack_cond:
+                deadline = time.monotonic() + ACK_TIMEOUT
+                while self.seq - self.acked_seq >= MAX_UNACKED:
+                    remaining = deadline - time.monotonic()
+                    if not self.connected.is_set():
+                        raise ConnectionError("Not connected to server")
+                    if remaining <= 0 or not self.is_running:
+                        raise TimeoutError(f"No ack from server since frame {self.acked_seq}")
+                    self.ack_cond.wait(remaining)
+                self.seq += 1
+                seq = self.seq
+                self.in_flight.append((seq, time.monotonic(), len(img_data), bool(flags & protocol.FLAG_SPOOLED)))
+            if ack_request or seq % ACK_INTERVAL == 0:
+                flags |= protocol.FLAG_ACK_REQUEST
+            if ENCRYPT_PAYLOAD and self.session_cipher is not None and self.protocol_version >= 3:
+                self.session_cipher.send_frame(self.sock, protocol.FRAME, img_data, self.client_id, seq, flags)
+            else:
+                protocol.send_frame(self.sock, protocol.FRAME, img_data, self.client_id, seq, flags)
+            return seq
+
+    # 等待服务器确认到 seq 为止的所有帧
+    def wait_for_ack(self, seq):
+        with self.ack_cond:
+            deadline = time.monotonic() + ACK_TIMEOUT
+            while self.acked_seq < seq:
+                remaining = deadline - time.monotonic()
+                if not self.connected.is_set():
+                    raise ConnectionError("Not connected to server")
+                if remaining <= 0 or not self.is_running:
+                    raise TimeoutError(f"No ack from server for frame {seq}")
+                self.ack_cond.wait(remaining)
 
     # 截屏并发送屏幕图像
+    # 截屏、编码、发送分别在三个线程中运行，用有界队列连接；某一阶段变慢时丢弃最旧的帧，不会推迟下一次截屏
     def capture_and_send_screen(self):
-        while self.is_running:
+        if self.capture_backend is None:
+            try:
+                self.capture_backend = capture.select_backend(self.capture_backend_name, CAPTURE_REGION, CAPTURE_SCALE)
+            except Exception as e:
+                print(f"Error capturing screen: {e}")
+                return
+        if SPOOL_ENABLED and self.spool is None:
+            self.spool = spool.FrameSpool(self.spool_dir)
+        self.pipeline_stop.clear()
+        self.encode_queue.clear()
+        self.send_queue.clear()
+        workers = [threading.Thread(target=self.encode_loop, daemon=True),
+                   threading.Thread(target=self.send_loop, daemon=True),
+                   threading.Thread(target=self.reconnect_loop, daemon=True)]
+        if self.spool is not None:
+            workers.append(threading.Thread(target=self.drain_loop, daemon=True))
+        for worker in workers:
+            worker.start()
+        try:
+            self.capture_loop()
+        finally:
+            self.pipeline_stop.set()
+            for worker in workers:
+                worker.join()
+
+    # 截屏阶段：按单调时钟固定速率截屏，周期不包含截屏、编码和发送的耗时
+    # 落后超过一个周期时跳过错过的时刻，不连续补拍
+    # 自适应模式下每隔 min_interval 用低分辨率探测图检查一次画面，变化超过阈值或距上次上传超过 capture_interval 时
+    # 才截取整帧交给编码阶段
+    def capture_loop(self):
+        sent_probe = None
+        last_sent = None
+        last_capture = next_time = time.monotonic()
+        last_report = last_capture
+        while self.is_running and not self.pipeline_stop.is_set():
+            now = time.monotonic()
+            if self.schedule_changed.is_set():
+                self.schedule_changed.clear()
+                next_time = min(next_time, last_capture + self.next_delay())
+            if next_time > now:
+                self.schedule_changed.wait(min(next_time - now, PIPELINE_POLL))
+                continue
+            try:
+                self.stage_stats['lag'].record(now - next_time)
+                last_capture = now
+                queued = True
+                if self.adaptive_capture:
+                    # 先取低分辨率探测图，画面变化或到了上传间隔才截取整帧
+                    probe, screenshot = self.capture_backend.probe(PROBE_SIZE)
+                    score = change_score(sent_probe, probe)
+                    if (score < CHANGE_THRESHOLD and last_sent is not None
+                            and now - last_sent < self.capture_interval):
+                        queued = False
+                    else:
+                        sent_probe, last_sent = probe, now
+                        if screenshot is None:
+                            screenshot = self.capture_backend.capture()
+                else:
+                    screenshot = self.capture_backend.capture()  # 截取屏幕
+                self.stage_stats['capture'].record(time.monotonic() - now)
+                if queued and self.encode_queue.put_latest((now, screenshot)) is not None:
+                    self.stage_stats['encode'].drop()
+            except Exception as e:
+                print(f"Error capturing screen: {e}")
+                break
+
+            period = self.next_delay()
+            next_time += period
+            now = time.monotonic()
+            if next_time <= now:
+                next_time += ((now - next_time) // period + 1) * period
+            if now - last_report >= STATS_INTERVAL:
+                last_report = now
+                self.report_stage_stats()
+
+    # 编码阶段：差分编码或JPEG编码
+    def encode_loop(self):
+        while not self.pipeline_stop.is_set():
+            try:
+                captured_at, screenshot = self.encode_queue.get(timeout=PIPELINE_POLL)
+            except queue.Empty:
+                continue
+            try:
+                start = time.monotonic()
+                binary = self.protocol_version >= 1
+                settings = self.encoder.current(self.next_delay(), allow_webp=self.protocol_version >= 2)
+                image = settings.prepare(screenshot)
+                if self.spool is not None and not self.connected.is_set():
+                    # 断线期间只缓存关键帧，重连后从关键帧重新开始差分
+                    self.spool.append(wall_time(captured_at), str(settings),
+                                      delta.encode_image(image, settings.quality, settings.codec))
+                    self.delta_encoder.force_keyframe()
+                    self.stage_stats['encode'].record(time.monotonic() - start)
+                    continue
+                if binary and self.delta_mode:
+                    # 差分帧依赖前面的每一帧，发送队列满时丢弃全部积压的帧，并从关键帧重新开始
+                    if self.send_queue.full():
+                        self.stage_stats['send'].drop(self.send_queue.clear())
+                        self.delta_encoder.force_keyframe()
+                    self.delta_encoder.quality = settings.quality
+                    self.delta_encoder.codec = settings.codec
+                    encoded = self.delta_encoder.encode(image)
+                    if encoded is None:  # 画面没有变化，不发送
+                        continue
+                    is_delta, img_data = encoded
+                else:
+                    is_delta = False
+                    img_data = delta.encode_image(image, settings.quality, settings.codec)  # 获取图像数据
+                self.stage_stats['encode'].record(time.monotonic() - start)
+                item = (captured_at, binary, is_delta, img_data, str(settings))
+                if self.send_queue.put_latest(item) is not None:
+                    self.stage_stats['send'].drop()
+            except Exception as e:
+                print(f"Error encoding screen: {e}")
+                self.pipeline_stop.set()
+                break
+
+    # 发送阶段：二进制协议流水线发送，旧协议等待 ready/finish
+    # 协议版本2起在负载前附带编码参数，版本4起附带截屏时刻
+    # 二进制协议每帧请求确认，由接收线程按确认估计上传吞吐量；旧协议等到 finish 才算发送完成，直接用发送耗时估计
+    # 发送失败时标记断线，关键帧转入离线缓存，差分帧丢弃
+    def send_loop(self):
+        while not self.pipeline_stop.is_set():
             try:
-                screenshot = pyautogui.screenshot()  # 截取屏幕
-                buffered = BytesIO()
-                screenshot.save(buffered, format="JPEG", quality=85)
-                img_data = buffered.getvalue()  # 获取图像数据
+                captured_at, binary, is_delta, img_data, meta = self.send_queue.get(timeout=PIPELINE_POLL)
+            except queue.Empty:
+                continue
+            sock = self.sock
+            try:
+                if not self.connected.is_set():
+                    raise ConnectionError("Not connected to server")
+                start = time.monotonic()
                 img_hash = hashlib.sha256(img_data).hexdigest()
                 print(f"Original image hash: {img_hash}")
+                payload = img_data
+                if binary:
+                    flags = protocol.FLAG_DELTA if is_delta else 0
+                    if self.protocol_version >= 2:
+                        flags |= protocol.FLAG_META
+                        payload = protocol.pack_meta(meta) + payload
+                    if self.protocol_version >= 4:
+                        flags |= protocol.FLAG_TIMESTAMP
+                        payload = protocol.pack_timestamp(wall_time(captured_at)) + payload
+                    self.send_binary(payload, flags, ack_request=True)
+                    self.encoder.record_size(len(payload))
+                else:
+                    self.send_legacy(payload)
+                    self.encoder.record(len(payload), time.monotonic() - start)
+                elapsed = time.monotonic() - start
+                self.stage_stats['send'].record(elapsed)
+                print(f"Sent data of length: {len(payload)}")
+            except Exception as e:
+                print(f"Error sending screen: {e}")
+                if self.spool is not None and binary and not is_delta:
+                    self.spool.append(wall_time(captured_at), meta, img_data)
+                else:
+                    self.stage_stats['send'].drop()
+                self.connection_lost(sock)
 
-                length_msg = str(len(img_data)).encode()
-                print(f"Sending length: {length_msg}")
-                self.sock.sendall(aes_encrypt(length_msg))  # 发送图像数据长度
-                self.sock.recv(1024)  # 等待服务器准备
-                self.sock.sendall(img_data)  # 发送图像数据
-                self.sock.recv(1024)  # 等待服务器结束
-                print(f"Sent data of length: {len(img_data)}")
-                time.sleep(self.capture_interval)  # 等待下一次截屏
+    # 补传阶段：连接可用时从离线缓存分批读取关键帧，按原截屏时刻补传
+    # 每批最后一帧请求确认，确认后才提交补传位置；按 spool_rate 限速，实时截图优先；服务器过载时暂停
+    def drain_loop(self):
+        while not self.pipeline_stop.is_set():
+            if (not self.connected.is_set() or self.protocol_version < 4 or self.throttle_level > 0
+                    or self.spool.empty()):
+                self.pipeline_stop.wait(SPOOL_POLL)
+                continue
+            records, position = self.spool.read_batch(SPOOL_BATCH, SPOOL_BATCH_BYTES)
+            sock = self.sock
+            try:
+                start = time.monotonic()
+                sent = 0
+                last_seq = None
+                flags = protocol.FLAG_TIMESTAMP | protocol.FLAG_META | protocol.FLAG_SPOOLED
+                for i, (captured_at, meta, img_data) in enumerate(records):
+                    payload = protocol.pack_timestamp(captured_at) + protocol.pack_meta(meta) + img_data
+                    last_seq = self.send_binary(payload, flags, ack_request=i == len(records) - 1)
+                    sent += len(payload)
+                    delay = sent / self.spool_rate - (time.monotonic() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+                if last_seq is not None:
+                    self.wait_for_ack(last_seq)
+                self.spool.commit(position)
+                if records:
+                    print(f"Uploaded {len(records)} spooled frames ({sent / 1024:.0f} KB), "
+                          f"{self.spool.pending_bytes() / 1024 / 1024:.1f} MB left")
             except Exception as e:
-                print(f"Error capturing or sending screen: {e}")
-                break
+                print(f"Error uploading spooled frames: {e}")
+                self.connection_lost(sock)
+
+    # 打印各阶段的平均/最大耗时，lag 为实际截屏时刻相对计划时刻的延迟
+    def report_stage_stats(self):
+        summary = ', '.join(f"{name} {stats.take()}" for name, stats in self.stage_stats.items())
+        print(f"Pipeline timings (avg/max, {self.capture_backend.name}): {summary}")
+        print(f"Encoding: {self.encoder.describe()}")
+
+    # 距下一次截屏的等待时间
+    def next_delay(self):
+        return min(self.min_interval, self.capture_interval) if self.adaptive_capture else self.capture_interval
 
     # 启动客户端
     def start(self):
@@ -146,19 +632,33 @@ class Client:
         capture_thread.start()
 
     # 停止客户端
+    # 先唤醒等待确认或回复的发送线程，再在 send_lock 内发送断开消息，不会与正在写入的帧交错
+    # 写入长时间卡住时不再等待，直接关闭连接
     def stop(self):
         self.is_running = False
+        self.pipeline_stop.set()
+        self.schedule_changed.set()
+        self.connected.clear()
+        with self.ack_cond:
+            self.ack_cond.notify_all()
         if self.sock:
+            locked = self.send_lock.acquire(timeout=ACK_TIMEOUT)
             try:
-                if self.username:  # 确保在断开连接前有用户名
+                if locked and self.username:  # 确保在断开连接前有用户名
                     disconnect_info = f'DISCONNECT {self.username} {self.mac_address} {self.ip_address}'
                     self.sock.sendall(aes_encrypt(disconnect_info.encode()))
                 self.sock.close()
             except Exception as e:
                 print(f"Error sending disconnect info: {e}")
+            finally:
+                if locked:
+                    self.send_lock.release()
+        if self.spool is not None:
+            self.spool.close()
 
 # 主函数
 def main():
+    from client_gui import run_client_app
     run_client_app(Client)
 
 # 程序入口
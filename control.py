@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import queue
+import select
+import threading
+import time
+from collections import OrderedDict
+
+# 服务器到客户端的控制消息通道
+# 每个连接有自己的待发消息表，同一类消息（如 SET_FREQUENCY）只保留最新一条；发送由少量后台线程完成，
+# 调用方（界面线程、接收线程）只把消息放入待发表后立即返回，卡住的客户端不会阻塞调用方和其他客户端
+# 面向大量连接的操作（修改全局频率、分组策略）用 submit 交给后台线程遍历连接，调用方不必等待
+CONTROL_SENDERS = 4  # 发送线程数
+CONTROL_QUEUE_SIZE = 64  # 每个连接最多积压的待发消息数，超过时丢弃最旧的消息
+CONTROL_RETRY_DELAY = 0.5  # 连接暂时不可写时的重试间隔，单位为秒
+CONTROL_BUFFER_LIMIT = 64 * 1024  # asyncio 连接的发送缓冲超过该值时视为不可写
+
+# 一个连接的待发消息，由 ClientConnection 持有
+class Outbox:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = OrderedDict()  # 消息类别 -> 消息文本，按放入顺序发送
+        self.scheduled = False  # 已在发送线程的就绪队列中或正在发送，期间新消息只放入待发表
+        self.sending = False  # 有发送线程正在发送，同一连接同时只由一个线程发送，消息不会乱序
+        self.sequence = 0  # 没有类别的消息使用递增编号，不会互相覆盖
+
+class ControlChannel:
+    def __init__(self, senders=CONTROL_SENDERS):
+        self.ready = queue.Queue()  # 有待发消息的连接和待执行的遍历任务
+        self.delayed = []  # (重试时刻, 序号, 连接)，暂时不可写的连接
+        self.delayed_lock = threading.Lock()
+        self.counter = 0
+        for _ in range(senders):
+            threading.Thread(target=self.send_loop, daemon=True).start()
+
+    # 放入一条控制消息；key 相同的未发消息被新消息替换，key 为 None 时每条都发送
+    def post(self, conn, message, key=None):
+        outbox = conn.outbox
+        with outbox.lock:
+            if key is None:
+                outbox.sequence += 1
+                key = outbox.sequence
+            outbox.messages.pop(key, None)
+            outbox.messages[key] = message
+            if len(outbox.messages) > CONTROL_QUEUE_SIZE:
+                outbox.messages.popitem(last=False)
+            if outbox.scheduled:
+                return
+            outbox.scheduled = True
+        self.ready.put(conn)
+
+    # 在发送线程中执行 func(*args)，用于遍历大量连接
+    def submit(self, func, *args):
+        self.ready.put((func, args))
+
+    def send_loop(self):
+        while True:
+            try:
+                item = self.ready.get(timeout=self.next_retry())
+            except queue.Empty:
+                self.retry_due()
+                continue
+            if isinstance(item, tuple):
+                func, args = item
+                try:
+                    func(*args)
+                except Exception as e:
+                    print(f'Control task failed: {e}')
+            else:
+                self.flush(item)
+            self.retry_due()
+
+    # 距离最早一次重试的时间，没有待重试的连接时阻塞等待
+    def next_retry(self):
+        with self.delayed_lock:
+            if not self.delayed:
+                return None
+            return max(self.delayed[0][0] - time.monotonic(), 0)
+
+    def retry_due(self):
+        now = time.monotonic()
+        with self.delayed_lock:
+            due = []
+            while self.delayed and self.delayed[0][0] <= now:
+                due.append(heapq.heappop(self.delayed)[2])
+        for conn in due:
+            self.ready.put(conn)
+
+    # 发出一个连接的全部待发消息，发送期间放入的新消息在同一次调用中接着发出；连接不可写时稍后重试，消息保留在待发表中
+    # 待发表为空时在同一个锁内清除 scheduled 和 sending，之后放入的消息会重新进入就绪队列
+    def flush(self, conn):
+        outbox = conn.outbox
+        with outbox.lock:
+            if outbox.sending:
+                return
+            outbox.sending = True
+        while True:
+            if conn.closed:
+                with outbox.lock:
+                    outbox.messages.clear()
+                    outbox.scheduled = outbox.sending = False
+                return
+            if not writable(conn):
+                with outbox.lock:
+                    outbox.sending = False
+                with self.delayed_lock:
+                    self.counter += 1
+                    heapq.heappush(self.delayed, (time.monotonic() + CONTROL_RETRY_DELAY, self.counter, conn))
+                return
+            with outbox.lock:
+                messages = list(outbox.messages.values())
+                outbox.messages.clear()
+                if not messages:
+                    outbox.scheduled = outbox.sending = False
+                    return
+            for message in messages:
+                try:
+                    conn.send_control(message)
+                except OSError as e:
+                    print(f'Error sending control message to {conn.address}: {e}')
+                    with outbox.lock:
+                        outbox.messages.clear()
+                        outbox.scheduled = outbox.sending = False
+                    return
+
+# 连接的发送缓冲是否还有空间：线程模式检查 socket 是否可写，asyncio 模式检查传输层缓冲的字节数
+# 控制消息只有几十到几百字节，socket 可写时整条消息能直接放入发送缓冲，发送线程不会阻塞
+# select.select 不能处理编号不小于 FD_SETSIZE(1024) 的描述符，有 poll 的平台用 poll；Windows 的 select 没有这个限制
+def writable(conn):
+    if conn.writer is not None:
+        return conn.writer.transport.get_write_buffer_size() < CONTROL_BUFFER_LIMIT
+    try:
+        if hasattr(select, 'poll'):
+            poller = select.poll()
+            poller.register(conn.sock, select.POLLOUT)
+            return bool(poller.poll(0))
+        return bool(select.select([], [conn.sock], [], 0)[1])
+    except (OSError, ValueError):
+        return False
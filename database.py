@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+import time
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+# 数据库配置
+DB_PATH = 'screenshots.db'
+BATCH_SIZE = 500  # 每个事务最多合并的写操作数
+BATCH_INTERVAL = 0.05  # 收集一批写操作的最长等待时间，单位为秒
+BUSY_TIMEOUT = 5000  # 数据库被锁时的等待时间，单位为毫秒
+PAGE_SIZE = 200  # 历史查询每页的记录数
+
+# 设置WAL模式和常用参数；WAL下读写互不阻塞，synchronous=NORMAL 只在检查点时fsync
+def apply_pragmas(conn):
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-65536')  # 64MB页缓存
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT}')
+    return conn
+
+# 打开写连接，只应交给 DBWriter 使用
+def connect(path=DB_PATH):
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    return apply_pragmas(conn)
+
+# 打开只读连接，供历史查询等读者使用
+def connect_readonly(path=DB_PATH):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT}')
+    conn.execute('PRAGMA query_only=1')
+    return conn
+
+# 旧数据库升级：补充后来增加的列
+def upgrade_screenshots(cursor):
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(screenshots)')]
+    for column, column_type in (('image_hash', 'TEXT'), ('encoding', 'TEXT'), ('tier', 'INTEGER DEFAULT 0')):
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE screenshots ADD COLUMN {column} {column_type}')
+
+# 创建历史查询使用的索引，查询按 (条件列, timestamp, id) 顺序翻页
+def create_indexes(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_screenshots_mac_time ON screenshots (client_mac, timestamp, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_screenshots_ip_time ON screenshots (ip_address, timestamp, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_screenshots_time ON screenshots (timestamp, id)')
+
+# 按键集分页查询历史截图
+# filters 为 (start_time, end_time, ip_address, mac_address)，after 为上一页最后一行的 (timestamp, id)
+# 返回 [(id, timestamp, client_mac, ip_address, image_path, image_hash), ...]
+def query_history(conn, filters, after=None, limit=PAGE_SIZE):
+    start_time, end_time, ip_address, mac_address = filters
+    query = '''
+        SELECT id, timestamp, client_mac, ip_address, image_path, image_hash
+        FROM screenshots
+        WHERE 1=1
+    '''
+    params = []
+
+    if start_time and end_time:
+        query += ' AND timestamp BETWEEN ? AND ?'
+        params.extend([start_time, end_time])
+
+    if ip_address:
+        query += ' AND ip_address = ?'
+        params.append(ip_address)
+
+    if mac_address:
+        query += ' AND client_mac = ?'
+        params.append(mac_address)
+
+    if after is not None:
+        query += ' AND (timestamp > ? OR (timestamp = ? AND id > ?))'
+        params.extend([after[0], after[0], after[1]])
+
+    query += ' ORDER BY timestamp ASC, id ASC LIMIT ?'
+    params.append(limit)
+    return conn.execute(query, params).fetchall()
+
+# 写入线程已经停止，写操作不会再执行
+class WriterStopped(Exception):
+    pass
+
+# 单线程批量写入器
+# 所有写操作放入队列，由一个线程按数量/时间窗口合并为一个事务提交，避免每条记录一次fsync和多线程争用同一连接
+# 每个写操作是一个接收cursor的函数，在各自的SAVEPOINT中执行，单个操作失败不会影响同批的其他操作
+# 参与者（如分区写入器）管理其他数据库文件的事务，接口：
+#   begin_item()/release_item()/rollback_item()  每个写操作前后调用，参与者在自己的库中同样使用SAVEPOINT
+#   prepare(cursor)  主库提交前调用，参与者先提交自己的事务，并在主库事务中记录提交的位置
+#   commit()  主库提交后调用；rollback(cursor)  批次失败时调用，撤销本批次已经提交到参与者的数据
+# 停止后提交的写操作直接抛出 WriterStopped；线程停止或异常退出时，队列中还没有执行的写操作也以 WriterStopped 结束，调用方不会一直等待
+class DBWriter(threading.Thread):
+    def __init__(self, conn, batch_size=BATCH_SIZE, batch_interval=BATCH_INTERVAL):
+        super().__init__(daemon=True)
+        self.conn = conn
+        self.participants = []
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()  # 保证停止之后不再有写操作放入队列
+        self.is_running = True
+        self.committed = 0  # 已提交的写操作数
+
+    # 注册参与者，需在线程启动前调用
+    def add_participant(self, participant):
+        self.participants.append(participant)
+
+    def put(self, item):
+        with self.lock:
+            if not self.is_running:
+                raise WriterStopped('Database writer is stopped')
+            self.queue.put(item)
+
+    # 提交一个写操作，不等待结果
+    def submit(self, func, *args):
+        self.put((func, args, None))
+
+    # 提交一个写操作并等待结果，func 抛出的异常会在调用方重新抛出
+    def call(self, func, *args):
+        future = Future()
+        self.put((func, args, future))
+        return future.result()
+
+    # 执行一条SQL并等待完成
+    def execute(self, sql, params=()):
+        return self.call(lambda cursor: cursor.execute(sql, params).rowcount)
+
+    # 等待队列中已有的写操作全部提交
+    def flush(self):
+        self.call(lambda cursor: None)
+
+    def stop(self):
+        with self.lock:
+            self.is_running = False
+        self.queue.put(None)
+
+    def run(self):
+        batch = []
+        try:
+            self.write_loop(batch)
+        finally:
+            with self.lock:
+                self.is_running = False
+            self.fail_pending(batch)
+
+    # 停止前放入队列的写操作全部执行后退出
+    def write_loop(self, batch):
+        cursor = self.conn.cursor()
+        while self.is_running or not self.queue.empty():
+            item = self.queue.get()
+            if item is None:
+                continue
+            batch[:] = [item]
+            deadline = time.monotonic() + self.batch_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    break
+                batch.append(item)
+            self.write_batch(cursor, batch)
+
+    def write_batch(self, cursor, batch):
+        results = []
+        try:
+            cursor.execute('BEGIN')
+            for func, args, future in batch:
+                cursor.execute('SAVEPOINT item')
+                for participant in self.participants:
+                    participant.begin_item()
+                try:
+                    results.append((future, func(cursor, *args), None))
+                    cursor.execute('RELEASE item')
+                    for participant in self.participants:
+                        participant.release_item()
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO item')
+                    cursor.execute('RELEASE item')
+                    for participant in self.participants:
+                        participant.rollback_item()
+                    results.append((future, None, e))
+                    if future is None:
+                        print(f'Database write failed: {e}')
+            for participant in self.participants:
+                participant.prepare(cursor)
+            cursor.execute('COMMIT')
+            for participant in self.participants:
+                participant.commit()
+            self.committed += len(batch)
+        except Exception as e:
+            print(f'Database batch failed: {e}')
+            if self.conn.in_transaction:
+                self.conn.rollback()
+            for participant in self.participants:
+                participant.rollback(cursor)
+            results = [(future, None, e) for _, _, future in batch]
+        for future, result, error in results:
+            if future is None:
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    # 线程退出时结束正在写入的批次和队列中剩余的写操作
+    def fail_pending(self, batch):
+        items = list(batch)
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        for item in items:
+            if item is not None and item[2] is not None and not item[2].done():
+                item[2].set_exception(WriterStopped('Database writer stopped before the write was committed'))
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import struct
+from io import BytesIO
+import numpy as np
+from PIL import Image
+
+# 分块差分编码，客户端和服务端共用
+# 画面按 TILE_SIZE 切成方块，与上一帧逐块比较，只发送变化的块；每隔 KEYFRAME_INTERVAL 帧发送一次完整关键帧
+# 差分帧负载：帧头(宽, 高, 块大小, 块数) + 每块坐标(列, 行) + 所有变化块拼成的一张JPEG图集
+TILE_SIZE = 64  # 取16的倍数，使JPEG的编码块与图块边界对齐
+KEYFRAME_INTERVAL = 30  # 每隔多少帧强制发送关键帧
+KEYFRAME_RATIO = 0.5  # 变化块超过该比例时直接发送关键帧
+JPEG_QUALITY = 85
+WEBP_METHOD = 0  # WebP 编码速度档位，0 最快
+# 关键帧和图集可用的图像格式：名称 -> (PIL格式, 保存参数)；服务端按内容识别格式，解码不需要额外信息
+IMAGE_FORMATS = {
+    'jpeg': ('JPEG', {}),
+    'webp': ('WEBP', {'method': WEBP_METHOD}),
+}
+
+DELTA_HEADER = struct.Struct('!HHHI')
+TILE_INDEX = struct.Struct('!HH')
+
+class MissingKeyframe(Exception):
+    pass
+
+# 按指定格式编码
+def encode_image(image, quality=JPEG_QUALITY, codec='jpeg'):
+    image_format, params = IMAGE_FORMATS[codec]
+    buffered = BytesIO()
+    image.save(buffered, format=image_format, quality=quality, **params)
+    return buffered.getvalue()
+
+# JPEG编码
+def encode_jpeg(image, quality=JPEG_QUALITY):
+    return encode_image(image, quality)
+
+# 解码为RGB数组，JPEG 和 WebP 均可
+def decode_jpeg(data):
+    return np.array(Image.open(BytesIO(data)).convert('RGB'))
+
+# 把图像数组补齐到块大小的整数倍
+def pad_to_tiles(arr, tile_size):
+    h, w = arr.shape[:2]
+    pad_h = -h % tile_size
+    pad_w = -w % tile_size
+    if pad_h or pad_w:
+        arr = np.pad(arr, ((0, pad_h), (0, pad_w), (0, 0)), mode='edge')
+    return arr
+
+# 把补齐后的图像数组视为 (行, 列, 块高, 块宽, 通道) 的块视图，不复制数据
+def tile_view(arr, tile_size):
+    h, w, c = arr.shape
+    return arr.reshape(h // tile_size, tile_size, w // tile_size, tile_size, c).swapaxes(1, 2)
+
+# 比较两帧，返回 (行, 列) 形状的布尔数组，表示每一块是否变化
+def changed_tiles(prev, cur, tile_size=TILE_SIZE):
+    diff = np.any(prev != cur, axis=2)
+    h, w = diff.shape
+    rows, cols = -(-h // tile_size), -(-w // tile_size)
+    padded = np.zeros((rows * tile_size, cols * tile_size), dtype=bool)
+    padded[:h, :w] = diff
+    return padded.reshape(rows, tile_size, cols, tile_size).any(axis=(1, 3))
+
+# 把若干块拼成一张接近正方形的图集
+def build_atlas(tiles):
+    n, tile_size = tiles.shape[0], tiles.shape[1]
+    cols = int(np.ceil(np.sqrt(n)))
+    rows = -(-n // cols)
+    padded = np.zeros((rows * cols,) + tiles.shape[1:], dtype=tiles.dtype)
+    padded[:n] = tiles
+    return padded.reshape(rows, cols, tile_size, tile_size, -1).swapaxes(1, 2).reshape(
+        rows * tile_size, cols * tile_size, -1)
+
+# 从图集中取出前 n 块
+def split_atlas(atlas, n, tile_size):
+    return tile_view(atlas, tile_size).reshape((-1, tile_size, tile_size, atlas.shape[2]))[:n]
+
+# 客户端差分编码器
+class DeltaEncoder:
+    def __init__(self, tile_size=TILE_SIZE, keyframe_interval=KEYFRAME_INTERVAL, quality=JPEG_QUALITY):
+        self.tile_size = tile_size
+        self.keyframe_interval = keyframe_interval
+        self.quality = quality
+        self.codec = 'jpeg'  # 关键帧和图集的编码格式，可在两帧之间修改
+        self.reset()
+
+    # 清空参考帧，下一帧发送关键帧
+    def reset(self):
+        self.prev = None
+        self.frames_since_key = 0
+        self.keyframe_requested = False
+
+    # 请求下一帧发送关键帧；可能在接收线程中调用，由编码线程在下一次编码时处理
+    def force_keyframe(self):
+        self.keyframe_requested = True
+
+    # 编码一帧，返回 (是否差分帧, 负载)；画面没有变化时返回 None
+    def encode(self, image):
+        image = image.convert('RGB')
+        cur = np.asarray(image)
+        if self.keyframe_requested:
+            self.keyframe_requested = False
+            return self.keyframe(image, cur)
+        if (self.prev is None or self.prev.shape != cur.shape
+                or self.frames_since_key >= self.keyframe_interval):
+            return self.keyframe(image, cur)
+
+        mask = changed_tiles(self.prev, cur, self.tile_size)
+        count = int(mask.sum())
+        if count == 0:
+            return None
+        if count > mask.size * KEYFRAME_RATIO:
+            return self.keyframe(image, cur)
+
+        ys, xs = np.nonzero(mask)
+        tiles = tile_view(pad_to_tiles(cur, self.tile_size), self.tile_size)[ys, xs]
+        atlas = Image.fromarray(build_atlas(tiles))
+        h, w = cur.shape[:2]
+        index = np.empty((count, 2), dtype='>u2')
+        index[:, 0] = xs
+        index[:, 1] = ys
+        payload = (DELTA_HEADER.pack(w, h, self.tile_size, count) + index.tobytes()
+                   + encode_image(atlas, self.quality, self.codec))
+        self.prev = cur
+        self.frames_since_key += 1
+        return True, payload
+
+    def keyframe(self, image, cur):
+        self.prev = cur
+        self.frames_since_key = 0
+        return False, encode_image(image, self.quality, self.codec)
+
+# 服务端差分解码器，每个连接一个，负责重建完整画面
+class DeltaDecoder:
+    def __init__(self, quality=JPEG_QUALITY):
+        self.quality = quality
+        self.keyframe_data = None
+        self.frame = None  # 补齐到块大小整数倍的当前画面
+        self.size = None
+
+    # 记录关键帧；只有收到差分帧时才解码，未使用差分模式的客户端不增加开销
+    def set_keyframe(self, data):
+        self.keyframe_data = data
+        self.frame = None
+
+    # 应用差分帧，返回重建后的完整JPEG
+    def apply(self, payload):
+        payload = memoryview(payload)
+        w, h, tile_size, count = DELTA_HEADER.unpack_from(payload)
+        if self.frame is None:
+            if self.keyframe_data is None:
+                raise MissingKeyframe("No keyframe received yet")
+            frame = decode_jpeg(self.keyframe_data)
+            self.keyframe_data = None
+            self.size = frame.shape[:2]
+            self.frame = pad_to_tiles(frame, tile_size).copy()
+        if self.size != (h, w) or self.frame.shape[0] % tile_size or self.frame.shape[1] % tile_size:
+            self.frame = None
+            raise MissingKeyframe("Delta frame does not match keyframe")
+
+        offset = DELTA_HEADER.size
+        index = np.frombuffer(payload, dtype='>u2', count=count * 2, offset=offset).reshape(count, 2)
+        offset += count * TILE_INDEX.size
+        tiles = split_atlas(decode_jpeg(payload[offset:]), count, tile_size)
+        tile_view(self.frame, tile_size)[index[:, 1], index[:, 0]] = tiles
+        return encode_jpeg(Image.fromarray(self.frame[:h, :w]), self.quality)
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+# 旧截图的分级降采样
+# 截图超过各级的保留期后重新编码为更低的分辨率和质量，并按客户端稀疏到每 N 分钟一帧
+# 编码在低优先级的进程池中进行；写数据库的操作交给写入线程分批提交，实时截图积压时暂停
+# 服务器用 --downsample 定期运行，也可以在停止服务器后单独运行：python downsample.py
+
+import os
+import time
+import calendar
+import hashlib
+import argparse
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+import database
+import partitions
+import delta
+from encoding import Encoding
+from storage import make_thumbnail
+
+# 降采样级别：(保留天数, 编码参数, 每个客户端每多少分钟保留一帧)，级别按保留天数递增
+TIERS = [
+    (7, 'codec=jpeg quality=60 scale=0.75 gray=0', 1),
+    (30, 'codec=jpeg quality=40 scale=0.5 gray=0', 10),
+]
+DOWNSAMPLE_INTERVAL = 6 * 3600  # 服务器中两次降采样之间的间隔，单位为秒
+DOWNSAMPLE_BATCH = 200  # 每批读取和提交的记录数
+DOWNSAMPLE_WORKERS = 2  # 编码进程数
+DOWNSAMPLE_NICE = 19  # 编码进程的 nice 值（仅 POSIX）
+DOWNSAMPLE_RATE = 20  # 每秒最多处理的帧数
+INGEST_BUSY_QUEUE = 50  # 写入队列积压超过该值时暂停，优先写入实时截图
+DOWNSAMPLE_OWNER = 'downsampled'  # 分段存储中降采样结果的归属，避免关闭客户端当天正在写入的分段
+
+# 进程池初始化：降低编码进程的调度优先级
+def lower_priority():
+    if hasattr(os, 'nice'):
+        os.nice(DOWNSAMPLE_NICE)
+
+# 在编码进程中执行：按编码参数重新编码，返回 (新图像, 新图像的缩略图)，结果不比原图小时返回 None
+def transcode(data, encoding_text):
+    encoding = Encoding.parse(encoding_text)
+    image = Image.open(BytesIO(data))
+    if encoding.scale < 1.0:
+        image.draft('RGB', (int(image.width * encoding.scale), int(image.height * encoding.scale)))
+    image = encoding.prepare(image.convert('RGB'))
+    result = delta.encode_image(image, encoding.quality, encoding.codec)
+    if len(result) >= len(data):
+        return None
+    return result, make_thumbnail(result)
+
+# 记录中的时间文本转换为时间戳(秒)
+def parse_timestamp(text):
+    return calendar.timegm(time.strptime(str(text)[:19], partitions.TIMESTAMP_FORMAT))
+
+class Downsampler:
+    def __init__(self, db_path, store, db_writer, partition_writer, tiers=TIERS, workers=DOWNSAMPLE_WORKERS,
+                 rate=DOWNSAMPLE_RATE):
+        self.db_path = db_path
+        self.store = store
+        self.db_writer = db_writer
+        self.partitions = partition_writer
+        self.tiers = tiers
+        self.workers = workers
+        self.rate = rate
+
+    # 从最旧的级别开始处理，超过多个级别保留期的截图直接编码为最终级别，不会重复编码
+    # should_stop 返回 True 时尽快结束；返回 (重新编码帧数, 删除帧数, 回收字节数)
+    def run_once(self, should_stop=lambda: False):
+        totals = [0, 0, 0]
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=lower_priority) as pool:
+            for level, (age_days, encoding_text, thin_minutes) in reversed(list(enumerate(self.tiers, 1))):
+                bucket = thin_minutes * 60
+                cutoff = (int(time.time()) - age_days * 86400) // bucket * bucket  # 对齐到稀疏间隔，避免同一时段分两次处理
+                cutoff_text = partitions.format_timestamp(cutoff)
+                tables = [(None, self.db_path)] + [(key, path) for key, path in partitions.list_partitions(self.db_path)
+                                                   if key <= cutoff_text[:10]]
+                for key, path in tables:
+                    if should_stop():
+                        break
+                    for i, value in enumerate(self.process_table(pool, key, path, level, encoding_text, bucket,
+                                                                 cutoff_text, should_stop)):
+                        totals[i] += value
+        elapsed = time.perf_counter() - start
+        print(f'Downsampling finished in {elapsed:.1f}s: {totals[0]} frames transcoded, {totals[1]} frames thinned, '
+              f'{totals[2] / 1024 / 1024:.1f} MB reclaimed')
+        return tuple(totals)
+
+    # 处理一张截图表（主库旧表或一个分区），按 (客户端, 时间, id) 顺序分批读取，使用 idx_screenshots_mac_time 索引
+    def process_table(self, pool, key, path, level, encoding_text, bucket, cutoff_text, should_stop):
+        transcoded = thinned = reclaimed = 0
+        position = ('', '', 0)
+        kept_bucket = None  # 上一个保留帧的 (客户端, 时间段)
+        conn = database.connect_readonly(path)
+        try:
+            while not should_stop():
+                rows = conn.execute('''
+                    SELECT id, client_mac, timestamp, image_path, image_hash FROM screenshots
+                    WHERE timestamp < ? AND COALESCE(tier, 0) < ?
+                    AND (client_mac, timestamp, id) > (?, ?, ?)
+                    ORDER BY client_mac, timestamp, id LIMIT ?
+                ''', (cutoff_text, level) + position + (DOWNSAMPLE_BATCH,)).fetchall()
+                if not rows:
+                    break
+                batch_start = time.monotonic()
+                position = (rows[-1][1], rows[-1][2], rows[-1][0])
+
+                # 每个客户端每个时间段只保留第一帧
+                kept, deletes = [], []
+                for row in rows:
+                    slot = (row[1], parse_timestamp(row[2]) // bucket)
+                    if slot == kept_bucket:
+                        deletes.append((row[0], row[4]))
+                    else:
+                        kept_bucket = slot
+                        kept.append(row)
+
+                # 同一图像只编码一次
+                sources = {}
+                for row_id, mac, timestamp, image_path, img_hash in kept:
+                    if img_hash and img_hash not in sources:
+                        data = self.store.read(self.store.resolve(img_hash, image_path))
+                        if data is not None:
+                            sources[img_hash] = (bytes(data), str(timestamp)[:10])
+                hashes = list(sources)
+                results = pool.map(transcode, [sources[h][0] for h in hashes], [encoding_text] * len(hashes))
+                replaced = {}  # 原哈希 -> (新位置, 新哈希, 大小)
+                for img_hash, result in zip(hashes, results):
+                    if result is not None:
+                        result, thumbnail = result
+                        new_hash = hashlib.sha256(result).hexdigest()
+                        day = sources[img_hash][1]
+                        location = self.store.put(new_hash, result, owner=DOWNSAMPLE_OWNER, day=day)
+                        # 原图的缩略图随原图释放，新图的缩略图与新图一起在 apply_batch 中登记
+                        self.store.put_thumbnail(new_hash, result, owner=DOWNSAMPLE_OWNER, day=day, thumbnail=thumbnail)
+                        replaced[img_hash] = (location, new_hash, len(result))
+
+                updates = []
+                for row_id, mac, timestamp, image_path, img_hash in kept:
+                    if img_hash in replaced:
+                        updates.append((row_id, img_hash) + replaced[img_hash])
+                    else:
+                        updates.append((row_id, img_hash, None, None, None))
+
+                self.wait_for_ingest(should_stop)
+                reclaimed += self.db_writer.call(self.apply_batch, key, level, encoding_text, updates, deletes)
+                reclaimed -= sum(size for _, _, size in replaced.values())
+                transcoded += sum(1 for update in updates if update[2] is not None)
+                thinned += len(deletes)
+
+                # 限速：按每秒帧数补足本批应占用的时间
+                delay = len(rows) / self.rate - (time.monotonic() - batch_start)
+                if delay > 0:
+                    time.sleep(delay)
+        finally:
+            conn.close()
+        return transcoded, thinned, reclaimed
+
+    # 写入队列积压时等待，实时截图优先
+    def wait_for_ingest(self, should_stop):
+        while self.db_writer.queue.qsize() > INGEST_BUSY_QUEUE and not should_stop():
+            time.sleep(1.0)
+
+    # 在写入线程中提交一批结果，返回释放的字节数
+    def apply_batch(self, cursor, key, level, encoding_text, updates, deletes):
+        table = cursor if key is None else self.partitions.cursor_for(key)
+        reclaimed = 0
+        for row_id, img_hash in deletes:
+            table.execute('DELETE FROM screenshots WHERE id = ?', (row_id,))
+            if img_hash:
+                reclaimed += self.store.release(cursor, img_hash)
+        for row_id, img_hash, location, new_hash, size in updates:
+            if new_hash is None:
+                table.execute('UPDATE screenshots SET tier = ? WHERE id = ?', (level, row_id))
+                continue
+            table.execute('''
+                UPDATE screenshots SET image_path = ?, image_hash = ?, encoding = ?, tier = ? WHERE id = ?
+            ''', (location, new_hash, encoding_text, level, row_id))
+            self.store.add_ref(cursor, new_hash, size)
+            reclaimed += self.store.release(cursor, img_hash)
+        return reclaimed
+
+# 单独运行降采样，运行前先停止服务器
+def main():
+    from storage import ContentStore
+    from packstore import PackStore, PACK_DIR
+    parser = argparse.ArgumentParser(description='旧截图分级降采样')
+    parser.add_argument('--db', default=database.DB_PATH, help='数据库路径')
+    parser.add_argument('--storage', choices=['files', 'pack'], default='files', help='截图存储方式')
+    parser.add_argument('--screenshot-dir', default='screenshots', help='截图文件目录')
+    parser.add_argument('--pack-dir', default=PACK_DIR, help='分段文件目录')
+    parser.add_argument('--workers', type=int, default=DOWNSAMPLE_WORKERS, help='编码进程数')
+    parser.add_argument('--rate', type=float, default=DOWNSAMPLE_RATE, help='每秒最多处理的帧数')
+    args = parser.parse_args()
+
+    conn = database.connect(args.db)
+    database.upgrade_screenshots(conn.cursor())
+    store = PackStore(args.pack_dir, args.db) if args.storage == 'pack' else ContentStore(args.screenshot_dir)
+    partition_writer = partitions.PartitionWriter(args.db)
+    writer = database.DBWriter(conn)
+    writer.add_participant(partition_writer)
+    writer.start()
+    writer.call(partition_writer.recover)
+    try:
+        Downsampler(args.db, store, writer, partition_writer, workers=args.workers, rate=args.rate).run_once()
+    finally:
+        writer.stop()
+        writer.join()
+        partition_writer.close()
+        if hasattr(store, 'close'):
+            store.close()
+        conn.close()
+
+if __name__ == '__main__':
+    main()
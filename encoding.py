@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from PIL import Image
+import delta
+
+# 客户端自适应编码：根据实测上传吞吐量和服务器提示选择编码方式、质量和分辨率
+# 编码参数以 "codec=jpeg quality=85 scale=1 gray=0" 的文本形式随帧发送，并原样记录在 screenshots.encoding 列
+UPLOAD_SHARE = 0.5  # 单帧上传时间最多占截屏间隔的比例
+DOWNGRADE_FRAMES = 1  # 连续多少帧超出预算后降一级
+UPGRADE_FRAMES = 5  # 连续多少帧低于预算一半后升一级
+THROUGHPUT_ALPHA = 0.3  # 吞吐量指数平滑系数
+
+class Encoding:
+    def __init__(self, codec='jpeg', quality=85, scale=1.0, gray=False):
+        if codec not in delta.IMAGE_FORMATS:
+            raise ValueError(f"Unknown codec: {codec}")
+        self.codec = codec
+        self.quality = max(1, min(100, int(quality)))
+        self.scale = max(0.1, min(1.0, float(scale)))
+        self.gray = bool(gray)
+
+    # 从 "key=value ..." 文本解析，缺少的参数取默认值
+    @classmethod
+    def parse(cls, text):
+        values = dict(item.split('=', 1) for item in text.split() if '=' in item)
+        return cls(values.get('codec', 'jpeg'), int(values.get('quality', 85)),
+                   float(values.get('scale', 1.0)), values.get('gray', '0') not in ('0', 'false'))
+
+    def __str__(self):
+        return f"codec={self.codec} quality={self.quality} scale={self.scale:g} gray={int(self.gray)}"
+
+    # 按参数缩放和转换灰度，返回处理后的图像
+    def prepare(self, image):
+        if self.scale < 1.0:
+            size = (max(1, int(image.width * self.scale)), max(1, int(image.height * self.scale)))
+            image = image.resize(size, Image.BILINEAR)
+        if self.gray:
+            image = image.convert('L')
+        return image
+
+# 编码档位，从高画质到小体积排列
+LEVELS = [
+    Encoding('jpeg', 85),
+    Encoding('jpeg', 70),
+    Encoding('webp', 60),
+    Encoding('webp', 50, 0.75),
+    Encoding('webp', 40, 0.5),
+    Encoding('webp', 30, 0.5, gray=True),
+]
+
+# 按上传吞吐量在 LEVELS 中升降档；服务器可以通过 SET_ENCODING 限定最低档位或固定编码参数
+class AdaptiveEncoder:
+    def __init__(self, levels=LEVELS):
+        self.levels = levels
+        self.lock = threading.Lock()
+        self.level = 0
+        self.min_level = 0  # 服务器要求的最低档位，数字越大帧越小
+        self.pinned = None  # 服务器固定的编码参数
+        self.throughput = None  # 平滑后的上传吞吐量，字节/秒
+        self.over_budget = 0
+        self.under_budget = 0
+        self.last_size = None
+
+    # 选择下一帧的编码参数；allow_webp 为 False 时（对端不支持）把 WebP 档位换成同等参数的 JPEG
+    def current(self, interval, allow_webp=True):
+        with self.lock:
+            if self.pinned is not None:
+                encoding = self.pinned
+            else:
+                self.adjust(interval)
+                encoding = self.levels[max(self.level, self.min_level)]
+        if encoding.codec == 'webp' and not allow_webp:
+            encoding = Encoding('jpeg', encoding.quality, encoding.scale, encoding.gray)
+        return encoding
+
+    # 根据上一帧大小和吞吐量估计的上传时间调整档位
+    def adjust(self, interval):
+        if self.throughput is None or self.last_size is None:
+            return
+        budget = self.throughput * interval * UPLOAD_SHARE
+        if self.last_size > budget:
+            self.over_budget += 1
+            self.under_budget = 0
+            if self.over_budget >= DOWNGRADE_FRAMES and self.level < len(self.levels) - 1:
+                self.level += 1
+                self.over_budget = 0
+        elif self.last_size < budget / 2:
+            self.under_budget += 1
+            self.over_budget = 0
+            if self.under_budget >= UPGRADE_FRAMES and self.level > 0:
+                self.level -= 1
+                self.under_budget = 0
+        else:
+            self.over_budget = self.under_budget = 0
+        self.last_size = None  # 每个发送结果只参与一次调整
+
+    # 记录一帧发出的大小，下一次选择编码参数时与吞吐量预算比较
+    def record_size(self, size):
+        with self.lock:
+            self.last_size = size
+
+    # 记录服务器确认收到的字节数和送达耗时，更新吞吐量估计
+    def record_delivery(self, size, elapsed):
+        rate = size / max(elapsed, 1e-6)
+        with self.lock:
+            if self.throughput is None:
+                self.throughput = rate
+            else:
+                self.throughput += THROUGHPUT_ALPHA * (rate - self.throughput)
+
+    # 记录一帧的发送结果，用于发送完成即已送达的场合（旧协议等待 finish）
+    def record(self, size, elapsed):
+        self.record_delivery(size, elapsed)
+        self.record_size(size)
+
+    # 处理服务器的 SET_ENCODING 提示：
+    #   level=N          至少使用第N档
+    #   codec=... 等参数  固定使用指定参数，不再自适应
+    #   auto             取消以上限制
+    def apply_hint(self, text):
+        with self.lock:
+            if text.strip() == 'auto':
+                self.min_level = 0
+                self.pinned = None
+            elif text.startswith('level='):
+                self.min_level = max(0, min(int(text.split('=', 1)[1]), len(self.levels) - 1))
+                self.pinned = None
+            else:
+                self.pinned = Encoding.parse(text)
+
+    def describe(self):
+        with self.lock:
+            if self.pinned is not None:
+                return f"pinned {self.pinned}"
+            rate = f"{self.throughput / 1024:.0f}KB/s" if self.throughput is not None else 'unknown'
+            return f"level {max(self.level, self.min_level)} (min {self.min_level}), throughput {rate}"
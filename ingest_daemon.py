@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+
+# 无界面的截图接收服务，不导入 PyQt5
+# 主进程负责数据库写入、存储索引、过期清理和降采样，并在本机的监控端口上向界面推送实时通知
+# N 个工作进程各自用 SO_REUSEPORT 监听截图端口，由内核分配新连接；工作进程处理连接、解密、差分重建并写入图像，
+# 截图记录、注册和用户状态通过队列交给主进程，数据库只有主进程的写入线程一个写者
+# 启动：python server.py --headless --workers 4；界面连接：python server.py --attach 127.0.0.1:5001
+
+import os
+import sys
+import json
+import queue
+import socket
+import signal
+import time
+import itertools
+import threading
+import multiprocessing
+import server
+import metrics
+
+MONITOR_HOST = '127.0.0.1'  # 监控端口只监听本机
+MONITOR_QUEUE_SIZE = 256  # 每个监控连接最多积压的通知数，积压时丢弃截图通知
+STATUS_FLUSH_INTERVAL = 0.2  # 客户端状态变化合并后推送给界面的间隔，单位为秒
+CALL_TIMEOUT = 10.0  # 工作进程等待主进程回复的最长时间，单位为秒
+WORKER_CHECK_INTERVAL = 1.0  # 检查工作进程是否退出的间隔，单位为秒
+
+# 工作进程中的服务器：数据库只读，写操作和通知发给主进程
+class WorkerServer(server.Server):
+    def __init__(self, worker_id, events, commands, policies, **kwargs):
+        self.worker_id = worker_id
+        self.events = events  # 发往主进程的队列，所有工作进程共用
+        self.commands = commands  # 主进程发来的命令和调用结果
+        self.calls = {}  # 调用编号 -> [完成事件, 结果]
+        self.call_ids = itertools.count(1)
+        super().__init__(**kwargs)
+        self.policies.restore(policies)  # 策略由主进程从数据库读取，修改时随命令下发
+        self.screenshot_interval, self.min_screenshot_interval = policies['default']
+        threading.Thread(target=self.command_loop, daemon=True).start()
+        threading.Thread(target=self.metrics_loop, daemon=True).start()
+
+    def open_database(self, retention_days, enable_downsample):
+        pass
+
+    def close_database(self):
+        pass
+
+    # 每个工作进程写自己的分段，同一客户端重连到另一个进程时也不会同时追加同一个文件
+    def store_owner(self, conn):
+        return f'{conn.mac_address}-w{self.worker_id}'
+
+    # 截图记录和界面通知一起发给主进程；分段存储的新记录位置随之传递，主进程登记索引时使用
+    def record_screenshot(self, conn, received_at, image_path, img_hash, size, encoding=None, live=True):
+        record = (received_at, conn.mac_address, image_path, conn.ip_address, img_hash, size, encoding)
+        self.events.put(('screenshot', conn.address, record, self.store.pending_locations(img_hash), live))
+
+    def update_client_status(self, client_address, fields):
+        self.events.put(('status', client_address, fields, self.worker_id))
+
+    def add_user(self, username, password, mac_address, ip_address):
+        return self.call('add_user', username, password, mac_address, ip_address)
+
+    # 策略由主进程保存
+    def save_policy(self, scope, target, interval, min_interval):
+        pass
+
+    def save_group(self, username, group):
+        pass
+
+    def save_important(self, username, important):
+        pass
+
+    # 工作进程没有写入队列，快照中不含 db_queue；过载级别取自身和主进程下发的较大值
+    def metrics_snapshot(self):
+        snapshot = self.metrics.snapshot(self.connections())
+        snapshot['gauges']['inflight'] = self.backpressure.inflight_count()
+        snapshot['gauges']['backpressure_level'] = self.backpressure.level
+        return snapshot
+
+    # 工作进程只有正在处理的帧，写入队列的积压由主进程下发的最低级别体现
+    def ingest_backlog(self):
+        return 0
+
+    # 定期把运行指标快照发给主进程合并
+    def metrics_loop(self):
+        while self.is_running:
+            time.sleep(metrics.METRICS_INTERVAL)
+            self.events.put(('metrics', self.worker_id, self.metrics_snapshot()))
+
+    # 在主进程中执行一个操作并等待结果
+    def call(self, op, *args):
+        call_id = next(self.call_ids)
+        waiter = self.calls[call_id] = [threading.Event(), None]
+        self.events.put(('call', self.worker_id, call_id, op, args))
+        if not waiter[0].wait(CALL_TIMEOUT):
+            self.calls.pop(call_id, None)
+            raise TimeoutError(f'No reply from main process for {op}')
+        return waiter[1]
+
+    # 处理主进程发来的消息
+    def command_loop(self):
+        while True:
+            command = self.commands.get()
+            kind = command[0]
+            if kind == 'reply':
+                waiter = self.calls.pop(command[1], None)
+                if waiter is not None:
+                    waiter[1] = command[2]
+                    waiter[0].set()
+            elif kind == 'set_frequency':
+                self.set_frequency(*command[1:])
+            elif kind == 'set_policy':
+                self.set_policy(*command[1:])
+            elif kind == 'set_group':
+                self.set_group(*command[1:])
+            elif kind == 'set_important':
+                self.set_important(*command[1:])
+            elif kind == 'backpressure':
+                self.backpressure.floor = command[1]
+            elif kind == 'set_encoding':
+                self.set_encoding(*command[1:])
+            elif kind == 'stop':
+                self.stop()
+                break
+
+# 工作进程入口
+def worker_main(worker_id, options, events, commands):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # 由主进程统一停止
+    worker = WorkerServer(worker_id, events, commands, **options)
+    worker.start()
+
+# 主进程：写入数据库、管理工作进程、向监控界面推送通知
+class IngestDaemon(server.Server):
+    def __init__(self, workers=server.HEADLESS_WORKERS, monitor_port=server.MONITOR_PORT, **kwargs):
+        super().__init__(**kwargs)
+        self.sock.close()  # 主进程不接受截图连接
+        self.reuse_port = hasattr(socket, 'SO_REUSEPORT')
+        if workers > 1 and not self.reuse_port:
+            print('SO_REUSEPORT is not available on this platform, using a single worker process')
+            workers = 1
+        self.workers = workers
+        self.worker_options = {
+            'mode': self.mode,
+            'backlog': self.backlog,
+            'max_connections': max(1, self.max_connections // workers),
+            'storage': self.storage,
+            'reuse_port': self.reuse_port,
+        }
+        self.context = multiprocessing.get_context('spawn')
+        self.events = self.context.Queue()
+        self.commands = []  # 每个工作进程的命令队列
+        self.processes = []
+        self.monitor = MonitorHub(self, MONITOR_HOST, monitor_port)
+        self.listeners.append(self.monitor)
+        self.worker_metrics = {}  # 工作进程编号 -> 最近一次上报的指标快照
+        self.worker_clients = {}  # 工作进程编号 -> 该进程上报在线的客户端，进程退出时标记为离线
+
+    # 启动监控端口和工作进程，然后在当前线程中处理工作进程发来的消息，直到 stop
+    def start(self):
+        self.monitor.start()
+        self.start_metrics_endpoint()
+        threading.Thread(target=self.backpressure_loop, daemon=True).start()
+        for worker_id in range(self.workers):
+            self.commands.append(self.context.Queue())
+            self.processes.append(None)
+            self.spawn_worker(worker_id)
+        print(f'Ingest daemon listening on {self.server_ip}:{self.server_port} with {self.workers} worker processes, '
+              f'monitor on {MONITOR_HOST}:{self.monitor.port}')
+        while self.is_running:
+            try:
+                message = self.events.get(timeout=WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                self.check_workers()
+                continue
+            try:
+                self.handle_event(message)
+            except Exception as e:
+                print(f'Error handling worker message {message[0]}: {e}')
+
+    def spawn_worker(self, worker_id):
+        options = dict(self.worker_options, policies=self.policies.snapshot())
+        process = self.context.Process(target=worker_main, args=(worker_id, options, self.events,
+                                                                 self.commands[worker_id]), daemon=True)
+        process.start()
+        self.processes[worker_id] = process
+        if self.backpressure.level:
+            self.commands[worker_id].put(('backpressure', self.backpressure.level))
+
+    # 工作进程意外退出时重新启动，其他进程的连接不受影响；退出进程的客户端标记为离线，重连后重新上线
+    def check_workers(self):
+        for worker_id, process in enumerate(self.processes):
+            if self.is_running and not process.is_alive():
+                print(f'Worker {worker_id} exited with code {process.exitcode}, restarting')
+                for client_address in self.worker_clients.pop(worker_id, set()):
+                    self.update_user_status(client_address, False)
+                self.spawn_worker(worker_id)
+
+    def handle_event(self, message):
+        kind = message[0]
+        if kind == 'screenshot':
+            _, client_address, record, locations, live = message
+            self.store.remember(locations)
+            if live:
+                self.update_ui(record[4], client_address)
+            self.db_writer.submit(self.insert_screenshot, *record)
+        elif kind == 'status':
+            _, client_address, fields, worker_id = message
+            if 'online' in fields:
+                for clients in self.worker_clients.values():
+                    clients.discard(client_address)
+                if fields['online']:
+                    self.worker_clients.setdefault(worker_id, set()).add(client_address)
+            self.update_client_status(client_address, fields)
+        elif kind == 'call':
+            _, worker_id, call_id, op, args = message
+            result = self.add_user(*args) if op == 'add_user' else None
+            self.commands[worker_id].put(('reply', call_id, result))
+        elif kind == 'metrics':
+            self.worker_metrics[message[1]] = message[2]
+
+    # 主进程的写入和通知指标与各工作进程的接收指标合并
+    def metrics_snapshot(self):
+        return metrics.merge([super().metrics_snapshot()] + list(self.worker_metrics.values()))
+
+    # 频率策略在主进程保存，和编码提示一起转发给所有工作进程，由持有连接的进程发给客户端
+    def set_frequency(self, new_frequency, min_interval=None):
+        super().set_frequency(new_frequency, min_interval)
+        self.forward('set_frequency', new_frequency, min_interval)
+        self.monitor.policies_changed()
+
+    def set_policy(self, scope, target, interval, min_interval=None):
+        super().set_policy(scope, target, interval, min_interval)
+        self.forward('set_policy', scope, target, interval, min_interval)
+        self.monitor.policies_changed()
+
+    def set_group(self, username, group):
+        super().set_group(username, group)
+        self.forward('set_group', username, group)
+        self.monitor.policies_changed()
+
+    def set_important(self, username, important):
+        super().set_important(username, important)
+        self.forward('set_important', username, important)
+        self.monitor.policies_changed()
+
+    def set_encoding(self, hint, address=None):
+        self.forward('set_encoding', hint, address)
+
+    # 主进程按写入队列计算过载级别，作为工作进程的最低级别下发
+    def pressure_changed(self):
+        self.forward('backpressure', self.backpressure.level)
+
+    def forward(self, *command):
+        for commands in self.commands:
+            commands.put(command)
+
+    def stop(self):
+        self.is_running = False
+        for commands in self.commands:
+            commands.put(('stop',))
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        if self.metrics_endpoint is not None:
+            self.metrics_endpoint.stop()
+        self.monitor.stop()
+        self.close_database()
+
+# 监控端口上的一个界面连接；通知先放入有界队列再由发送线程写出，界面卡住时不会拖慢接收
+class MonitorClient:
+    def __init__(self, hub, sock):
+        self.hub = hub
+        self.sock = sock
+        self.outbox = queue.Queue(MONITOR_QUEUE_SIZE)
+        self.closed = False
+
+    def start(self):
+        threading.Thread(target=self.send_loop, daemon=True).start()
+        threading.Thread(target=self.read_loop, daemon=True).start()
+
+    # 截图通知积压时直接丢弃，界面只需要每个客户端的最新一帧；状态通知不能丢，积压时断开，界面重连后重新取得完整状态
+    def post(self, line, droppable=False):
+        try:
+            self.outbox.put_nowait(line)
+        except queue.Full:
+            if not droppable:
+                self.close()
+
+    def send_loop(self):
+        while not self.closed:
+            try:
+                line = self.outbox.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            try:
+                self.sock.sendall(line)
+            except OSError:
+                break
+        self.close()
+
+    # 界面发来的命令，每行一个JSON对象；格式错误的命令只跳过这一行
+    def read_loop(self):
+        try:
+            with self.sock.makefile('rb') as rfile:
+                for line in rfile:
+                    try:
+                        self.hub.handle_command(json.loads(line))
+                    except (ValueError, KeyError, TypeError, AttributeError) as e:
+                        print(f'Ignoring malformed monitor command: {e!r}')
+        except OSError as e:
+            print(f'Monitor connection error: {e}')
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.hub.remove(self)
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+# 监控端口：向连接的界面推送截图和用户状态通知，接收设置频率和编码的命令
+# 作为主进程服务器的监听者，通知在主进程的消息处理线程中产生
+class MonitorHub:
+    def __init__(self, daemon, host=MONITOR_HOST, port=server.MONITOR_PORT):
+        self.daemon = daemon
+        self.host = host
+        self.port = port
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.clients = []
+        self.pending_status = {}  # 尚未推送的客户端状态变化，同一客户端的多次变化合并
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.sock.bind((self.host, self.port))
+        self.port = self.sock.getsockname()[1]
+        self.sock.listen()
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        threading.Thread(target=self.metrics_loop, daemon=True).start()
+        threading.Thread(target=self.status_loop, daemon=True).start()
+
+    def accept_loop(self):
+        while True:
+            try:
+                sock, address = self.sock.accept()
+            except OSError:
+                break
+            print(f'Monitor attached from {address}')
+            client = MonitorClient(self, sock)
+            client.post(self.encode(self.hello()))
+            with self.lock:
+                # 完整状态和加入推送列表在同一个锁内完成，之后的变化都会在下一次合并推送中送达
+                client.post(self.encode(self.status_message(self.daemon.status_snapshot())))
+                self.clients.append(client)
+            client.start()
+
+    def remove(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    # 界面打开存储和数据库所需的信息，路径转换为绝对路径
+    def hello(self):
+        daemon = self.daemon
+        return {
+            'type': 'hello',
+            'db_path': os.path.abspath(daemon.db_path),
+            'storage': daemon.storage,
+            'store_root': os.path.abspath(daemon.store.root),
+            'policies': daemon.policies_snapshot(),
+        }
+
+    @staticmethod
+    def encode(message):
+        return (json.dumps(message) + '\n').encode()
+
+    # 客户端状态消息，items 为 [((MAC地址, IP地址), 字段), ...]；连接时发送完整状态，之后只发送变化的字段
+    @staticmethod
+    def status_message(items):
+        return {'type': 'status', 'changes': [[mac, ip, dict(fields)] for (mac, ip), fields in items]}
+
+    def broadcast(self, message, droppable=False):
+        line = self.encode(message)
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.post(line, droppable)
+
+    # 监听者接口
+    def frame_received(self, img_hash, client_address):
+        locations = self.daemon.store.pending_locations(img_hash)
+        self.broadcast({'type': 'frame', 'hash': img_hash, 'address': list(client_address),
+                        'locations': {key: list(location) for key, location in locations.items()}}, droppable=True)
+
+    def client_status_changed(self, client_address, fields):
+        with self.lock:
+            self.pending_status.setdefault(client_address, {}).update(fields)
+
+    # 定期把合并后的状态变化推送给界面；登录高峰时每个间隔只发送一条消息
+    def status_loop(self):
+        while self.daemon.is_running:
+            time.sleep(STATUS_FLUSH_INTERVAL)
+            with self.lock:
+                changes, self.pending_status = self.pending_status, {}
+                clients = list(self.clients)
+            if changes:
+                line = self.encode(self.status_message(changes.items()))
+                for client in clients:
+                    client.post(line)
+
+    def policies_changed(self):
+        self.broadcast({'type': 'policies', 'policies': self.daemon.policies_snapshot()})
+
+    # 定期向界面推送运行指标快照，没有界面连接时跳过
+    def metrics_loop(self):
+        while self.daemon.is_running:
+            time.sleep(metrics.METRICS_INTERVAL)
+            if self.clients:
+                self.broadcast({'type': 'metrics', 'metrics': self.daemon.metrics_snapshot()}, droppable=True)
+
+    def handle_command(self, message):
+        kind = message.get('type')
+        if kind == 'set_frequency':
+            self.daemon.set_frequency(float(message['frequency']), message.get('min_interval'))
+        elif kind == 'set_policy':
+            self.daemon.set_policy(message['scope'], message['target'], message.get('interval'),
+                                   message.get('min_interval'))
+        elif kind == 'set_group':
+            self.daemon.set_group(message['username'], message.get('group'))
+        elif kind == 'set_important':
+            self.daemon.set_important(message['username'], bool(message['important']))
+        elif kind == 'set_encoding':
+            address = message.get('address')
+            self.daemon.set_encoding(message['hint'], tuple(address) if address else None)
+
+    def stop(self):
+        self.sock.close()
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.close()
+
+def run_daemon(workers=server.HEADLESS_WORKERS, monitor_port=server.MONITOR_PORT, **kwargs):
+    daemon = IngestDaemon(workers=workers, monitor_port=monitor_port, **kwargs)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        daemon.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        daemon.stop()
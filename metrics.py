@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 接收路径的运行指标：各阶段耗时直方图、全局计数器和每个客户端的帧数/字节数
+# 记录一次耗时只做一次二分查找和两次加法；每个客户端的计数直接累加在连接对象上，读取快照时才汇总
+# 连接关闭时计数并入该客户端的累计值，断线重连后 client_frames_total 等计数器继续增长，不会归零
+# 快照是可以 JSON 序列化的字典，无界面模式下工作进程把快照发给主进程合并
+# 可选的本机 HTTP 端口按 Prometheus 文本格式输出：python server.py --metrics-port 9100，访问 /metrics
+STAGES = ['recv', 'decrypt', 'hash', 'delta', 'disk', 'thumbnail', 'db', 'ui']
+# 直方图桶的上界，单位为秒
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNTERS = ['frames', 'bytes_in', 'connections', 'errors']
+METRICS_HOST = '127.0.0.1'  # 指标端口只监听本机
+METRICS_INTERVAL = 2.0  # 工作进程上报快照、监控端口推送快照的间隔，单位为秒
+PREFIX = 'screenmon'
+MAX_GAUGES = {'backpressure_level'}  # 合并快照时取最大值而不是相加的仪表值
+
+# 单个阶段的耗时直方图
+class Histogram:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(BUCKETS) + 1)  # 最后一个桶为 +Inf
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(BUCKETS, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += seconds
+
+    def snapshot(self):
+        with self.lock:
+            return {'buckets': list(self.counts), 'sum': self.sum}
+
+# 边计算摘要边累计耗时的 sha256，接收负载时代替 hashlib.sha256()
+class TimedHasher:
+    def __init__(self):
+        self.hasher = hashlib.sha256()
+        self.elapsed = 0.0
+
+    def update(self, data):
+        start = time.perf_counter()
+        self.hasher.update(data)
+        self.elapsed += time.perf_counter() - start
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+class IngestMetrics:
+    def __init__(self):
+        self.stages = {stage: Histogram() for stage in STAGES}
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.closed_clients = {}  # 客户端标签 -> [已关闭连接的帧数, 字节数]
+        self.closed_connections = set()  # 计数已经并入累计值的连接，快照中不再重复计算
+
+    def observe(self, stage, seconds):
+        self.stages[stage].observe(seconds)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    # 收到一帧，length 为线路上的负载字节数
+    def frame_received(self, length):
+        with self.lock:
+            self.counters['frames'] += 1
+            self.counters['bytes_in'] += length
+
+    # 连接关闭，计数并入客户端的累计值；没有收到过截图的连接不保留标签
+    def connection_closed(self, conn):
+        with self.lock:
+            if conn.frames:
+                totals = self.closed_clients.setdefault(client_label(conn), [0, 0])
+                totals[0] += conn.frames
+                totals[1] += conn.bytes_in
+            self.closed_connections.add(conn)
+
+    # 当前快照，connections 为正在接收截图的连接（ClientConnection）
+    def snapshot(self, connections=()):
+        connections = list(connections)
+        with self.lock:
+            counters = dict(self.counters)
+            clients = {label: tuple(values) for label, values in self.closed_clients.items()}
+            for conn in connections:
+                if conn in self.closed_connections:
+                    continue
+                frames, total = clients.get(client_label(conn), (0, 0))
+                clients[client_label(conn)] = (frames + conn.frames, total + conn.bytes_in)
+            self.closed_connections.intersection_update(connections)  # 已经离开连接列表的不必再记住
+        return {
+            'stages': {stage: histogram.snapshot() for stage, histogram in self.stages.items()},
+            'counters': counters,
+            'gauges': {'connections': len(connections)},
+            'clients': {label: list(values) for label, values in clients.items()},
+        }
+
+def client_label(conn):
+    return conn.mac_address or f'{conn.address[0]}:{conn.address[1]}'
+
+# 合并多个快照（主进程和各工作进程），直方图、计数器和仪表值都相加，MAX_GAUGES 中的仪表值取最大值
+def merge(snapshots):
+    result = {'stages': {}, 'counters': {}, 'gauges': {}, 'clients': {}}
+    for snapshot in snapshots:
+        for stage, histogram in snapshot['stages'].items():
+            merged = result['stages'].setdefault(stage, {'buckets': [0] * len(histogram['buckets']), 'sum': 0.0})
+            merged['buckets'] = [a + b for a, b in zip(merged['buckets'], histogram['buckets'])]
+            merged['sum'] += histogram['sum']
+        for section in ('counters', 'gauges'):
+            for name, value in snapshot[section].items():
+                if section == 'gauges' and name in MAX_GAUGES:
+                    result[section][name] = max(result[section].get(name, 0), value)
+                else:
+                    result[section][name] = result[section].get(name, 0) + value
+        for label, (frames, total) in snapshot['clients'].items():
+            old_frames, old_total = result['clients'].get(label, (0, 0))
+            result['clients'][label] = [old_frames + frames, old_total + total]
+    return result
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# 快照转换为 Prometheus 文本格式
+def render(snapshot):
+    lines = [f'# HELP {PREFIX}_stage_seconds Time spent in each ingest stage',
+             f'# TYPE {PREFIX}_stage_seconds histogram']
+    for stage, histogram in snapshot['stages'].items():
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), histogram['buckets']):
+            cumulative += count
+            lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]:.6f}')
+        lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {cumulative}')
+    for name, value in snapshot['counters'].items():
+        lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+        lines.append(f'{PREFIX}_{name}_total {value}')
+    for name, value in snapshot['gauges'].items():
+        lines.append(f'# TYPE {PREFIX}_{name} gauge')
+        lines.append(f'{PREFIX}_{name} {value}')
+    lines.append(f'# TYPE {PREFIX}_client_frames_total counter')
+    for label, (frames, total) in snapshot['clients'].items():
+        lines.append(f'{PREFIX}_client_frames_total{{client="{escape_label(label)}"}} {frames}')
+    lines.append(f'# TYPE {PREFIX}_client_bytes_total counter')
+    for label, (frames, total) in snapshot['clients'].items():
+        lines.append(f'{PREFIX}_client_bytes_total{{client="{escape_label(label)}"}} {total}')
+    return '\n'.join(lines) + '\n'
+
+# 两个快照之间的速率和各阶段平均耗时，供界面显示
+# 返回 (每秒帧数, 每秒字节数, {阶段: 平均耗时(秒)})，没有新数据的阶段不出现
+def rates(previous, current, elapsed):
+    if previous is None or elapsed <= 0:
+        return 0.0, 0.0, {}
+    frames = current['counters']['frames'] - previous['counters'].get('frames', 0)
+    total = current['counters']['bytes_in'] - previous['counters'].get('bytes_in', 0)
+    averages = {}
+    for stage, histogram in current['stages'].items():
+        old = previous['stages'].get(stage, {'buckets': [], 'sum': 0.0})
+        count = sum(histogram['buckets']) - sum(old['buckets'])
+        if count > 0:
+            averages[stage] = (histogram['sum'] - old['sum']) / count
+    return max(frames, 0) / elapsed, max(total, 0) / elapsed, averages
+
+# 本机 HTTP 端口，GET /metrics 返回 collect() 快照的 Prometheus 文本
+class MetricsEndpoint:
+    def __init__(self, collect, port, host=METRICS_HOST):
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = render(endpoint.collect()).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # 抓取请求不打印日志
+
+        self.collect = collect
+        self.host = host
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        print(f'Metrics available at http://{self.host}:{self.port}/metrics')
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
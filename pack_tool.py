@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+# 分段存储维护工具，运行前先停止服务器
+#   python pack_tool.py migrate [--delete]  把 screenshots 目录中的截图文件导入分段存储，并改写截图记录的 image_path
+#   python pack_tool.py compact             压缩有效数据占比低的分段
+
+import os
+import time
+import hashlib
+import argparse
+import database
+import partitions
+from storage import ContentStore, THUMBNAIL_SUFFIX
+from packstore import PackStore, PACK_DIR, KIND_THUMBNAIL, COMPACT_THRESHOLD
+
+SCREENSHOT_DIR = 'screenshots'
+MIGRATE_BATCH = 500  # 每个事务迁移的记录数
+
+# 迁移一批记录，table_conn 为记录所在的数据库，cursor 为主库游标
+# 返回 (本批最后一条记录的id, 已迁移的记录, 缺失文件数, 字节数)，没有剩余记录时id为None
+def migrate_batch(table_conn, cursor, files, pack, last_id, sources, hashes):
+    table = table_conn.cursor()
+    rows = table.execute('''
+        SELECT id, client_mac, timestamp, image_path, image_hash FROM screenshots
+        WHERE id > ? AND (image_path IS NULL OR image_path NOT LIKE 'pack:%')
+        ORDER BY id LIMIT ?
+    ''', (last_id, MIGRATE_BATCH)).fetchall()
+    if not rows:
+        return None, [], 0, 0
+    updates = []
+    missing = total_bytes = 0
+    for row_id, mac, timestamp, image_path, img_hash in rows:
+        last_id = row_id
+        path = files.resolve(img_hash, image_path)
+        data = files.read(path)
+        if data is None:
+            missing += 1
+            continue
+        img_hash = img_hash or hashlib.sha256(data).hexdigest()
+        day = str(timestamp)[:10] if timestamp else None
+        locator = pack.put(img_hash, data, owner=mac, day=day)
+        thumb_path = files.thumb_path(img_hash)
+        thumb = files.read(thumb_path)
+        if thumb is not None:
+            pack.put_record(img_hash + THUMBNAIL_SUFFIX, KIND_THUMBNAIL, img_hash, thumb, mac, day)
+            sources.add(thumb_path)
+        else:
+            pack.put_thumbnail(img_hash, data, owner=mac, day=day)
+        sources.add(path)
+        hashes.add(img_hash)
+        updates.append((row_id, locator, img_hash, len(data)))
+        total_bytes += len(data)
+
+    # 分区库中的记录与主库的引用计数分属两个事务，先提交主库，中断后重新迁移只会多登记引用，不会丢失文件
+    separate = table_conn is not cursor.connection
+    cursor.execute('BEGIN')
+    if separate:
+        table.execute('BEGIN')
+    for row_id, locator, img_hash, size in updates:
+        table.execute('UPDATE screenshots SET image_path = ?, image_hash = ? WHERE id = ?',
+                      (locator, img_hash, row_id))
+        pack.add_ref(cursor, img_hash, size)
+    cursor.execute('COMMIT')
+    if separate:
+        table.execute('COMMIT')
+    return last_id, updates, missing, total_bytes
+
+# 迁移截图文件：按 id 顺序分批读取尚未迁移的记录，写入分段后在同一事务中改写记录并登记引用
+# 依次处理主库的旧记录和各个分区库，引用计数统一登记在主库
+def migrate(db_path, screenshot_dir, pack_dir, delete=False):
+    conn = database.connect(db_path)
+    files = ContentStore(screenshot_dir)
+    pack = PackStore(pack_dir, db_path)
+    cursor = conn.cursor()
+    pack.create_tables(cursor)
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(screenshots)')]
+    if 'image_hash' not in columns:
+        cursor.execute('ALTER TABLE screenshots ADD COLUMN image_hash TEXT')
+
+    migrated = missing = total_bytes = 0
+    sources = set()  # 已迁移的原文件
+    hashes = set()  # 已迁移的哈希，删除原文件时一并清理 blobs 表
+    start = time.perf_counter()
+    tables = [conn] + [database.connect(path) for _, path in partitions.list_partitions(db_path)]
+    for table_conn in tables:
+        last_id = 0
+        while True:
+            last_id, updates, batch_missing, batch_bytes = migrate_batch(table_conn, cursor, files, pack, last_id,
+                                                                         sources, hashes)
+            if last_id is None:
+                break
+            migrated += len(updates)
+            missing += batch_missing
+            total_bytes += batch_bytes
+            print(f"Migrated {migrated} screenshots ({total_bytes / 1024 / 1024:.1f} MB), {missing} missing")
+        if table_conn is not conn:
+            table_conn.close()
+
+    if delete:
+        cursor.execute('BEGIN')
+        cursor.executemany('DELETE FROM blobs WHERE hash = ?', [(img_hash,) for img_hash in hashes])
+        cursor.execute('COMMIT')
+        for path in sources:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        print(f"Removed {len(sources)} migrated files")
+    pack.close()
+    conn.close()
+    elapsed = time.perf_counter() - start
+    print(f"Migration finished in {elapsed:.1f}s: {migrated} screenshots, {missing} files missing")
+
+# 压缩分段，索引更新通过写入线程提交
+def compact(db_path, pack_dir, threshold):
+    conn = database.connect(db_path)
+    writer = database.DBWriter(conn)
+    writer.start()
+    pack = PackStore(pack_dir, db_path)
+    try:
+        reclaimed = pack.compact(writer, threshold)
+    finally:
+        writer.stop()
+        writer.join()
+        pack.close()
+        conn.close()
+    print(f"Compaction reclaimed {reclaimed / 1024 / 1024:.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description='分段存储维护工具')
+    parser.add_argument('--db', default=database.DB_PATH, help='数据库路径')
+    parser.add_argument('--pack-dir', default=PACK_DIR, help='分段文件目录')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help='导入 screenshots 目录中的截图文件')
+    migrate_parser.add_argument('--screenshot-dir', default=SCREENSHOT_DIR, help='截图文件目录')
+    migrate_parser.add_argument('--delete', action='store_true', help='迁移完成后删除原文件')
+    compact_parser = subparsers.add_parser('compact', help='压缩分段')
+    compact_parser.add_argument('--threshold', type=float, default=COMPACT_THRESHOLD, help='有效数据占比阈值')
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        migrate(args.db, args.screenshot_dir, args.pack_dir, args.delete)
+    else:
+        compact(args.db, args.pack_dir, args.threshold)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import mmap
+import time
+import struct
+import threading
+from collections import OrderedDict
+import database
+from storage import make_thumbnail, THUMBNAIL_SUFFIX
+
+# 分段追加写入的截图存储，接口与 storage.ContentStore 相同
+# 每个客户端每天一组分段文件：packs/2024-05-01/00-11-22-33-44-55.0001.pack，超过 SEGMENT_MAX_SIZE 时换下一个分段
+# 每条记录：记录头(magic, 类型, 长度, sha256) + 数据；偏移索引保存在数据库的 pack_objects 表中
+# 截图记录的 image_path 保存为 "pack:<哈希>"，与实际所在分段无关，压缩分段后不需要修改截图记录
+# 读取时通过 mmap 直接返回分段文件中的一段内存视图，不复制数据
+PACK_DIR = 'packs'
+SEGMENT_MAX_SIZE = 256 * 1024 * 1024
+SEGMENT_SUFFIX = '.pack'
+LOCATOR_PREFIX = 'pack:'
+COMPACT_THRESHOLD = 0.5  # 有效数据占比低于该值的分段会被压缩
+# 多个进程（工作进程、降采样、pack_tool）可能同时追加和压缩，不使用锁，按分段的修改时间协调：
+# 超过 SEGMENT_REUSE_AGE 没有追加的分段不再续写，只压缩修改时间早于 COMPACT_MIN_AGE 的往日分段
+SEGMENT_REUSE_AGE = 600  # 单位为秒
+COMPACT_MIN_AGE = 3600  # 单位为秒，必须远大于 SEGMENT_REUSE_AGE
+COMPACT_PREFIX = 'c'  # 压缩生成的分段编号带该前缀，追加写入时不会选中
+MAX_OPEN_MAPS = 64  # 同时保持映射的分段数
+PENDING_SIZE = 10000  # 尚未写入索引的新记录位置，最多保留的条数
+
+RECORD_MAGIC = b'SPK1'
+RECORD_HEADER = struct.Struct('!4sBI32s')  # magic, 类型, 数据长度, sha256
+KIND_IMAGE = 0
+KIND_THUMBNAIL = 1
+
+# 客户端标识转换为文件名
+def owner_name(owner):
+    return re.sub(r'[^0-9A-Za-z]+', '-', owner).strip('-') if owner else 'unknown'
+
+class PackStore:
+    def __init__(self, root=PACK_DIR, db_path=database.DB_PATH, segment_max_size=SEGMENT_MAX_SIZE):
+        self.root = root
+        self.db_path = db_path
+        self.segment_max_size = segment_max_size
+        os.makedirs(self.root, exist_ok=True)
+        self.lock = threading.Lock()
+        self.writers = {}  # (客户端, 日期) -> [分段路径, 文件描述符, 当前大小, 最近追加时刻]
+        self.pending = OrderedDict()  # 索引键 -> (分段路径, 偏移, 长度)，索引提交前供读取和登记使用
+        self.maps = OrderedDict()  # 分段路径 -> mmap
+        self.local = threading.local()
+
+    # 创建偏移索引表，refcount 只记录在原图上，缩略图随原图一起删除
+    def create_tables(self, cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pack_objects (
+                key TEXT PRIMARY KEY,
+                segment TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                refcount INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pack_objects_segment ON pack_objects (segment)')
+
+    # 当前线程的只读连接
+    def read_conn(self):
+        conn = getattr(self.local, 'db_conn', None)
+        if conn is None:
+            conn = self.local.db_conn = database.connect_readonly(self.db_path)
+        return conn
+
+    # 查找记录位置，返回 (分段路径, 偏移, 长度)，不存在时返回 None
+    def locate(self, key):
+        with self.lock:
+            location = self.pending.get(key)
+        if location is not None:
+            return location
+        return self.read_conn().execute(
+            'SELECT segment, offset, length FROM pack_objects WHERE key = ?', (key,)).fetchone()
+
+    # 取得 (客户端, 日期) 的写入分段，当前分段写满或空闲过久时换下一个，调用方需持有 self.lock
+    def writer_for(self, owner, day, size):
+        key = (owner, day)
+        writer = self.writers.get(key)
+        if writer is not None and writer[2] > 0 and writer[2] + size > self.segment_max_size:
+            os.close(self.writers.pop(key)[1])
+            path = self.segment_path(owner, day, reuse=False)
+        elif writer is not None and writer[3] < time.time() - SEGMENT_REUSE_AGE:
+            os.close(self.writers.pop(key)[1])
+            path = self.segment_path(owner, day, reuse=True, size=size)  # 其他进程也没有续写时换新分段
+        elif writer is None:
+            # 换到新的日期后关闭该客户端之前日期的分段
+            for old_key in [k for k in self.writers if k[0] == owner]:
+                os.close(self.writers.pop(old_key)[1])
+            path = self.segment_path(owner, day, reuse=True, size=size)
+        else:
+            return writer
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, 'O_BINARY', 0), 0o644)
+        writer = self.writers[key] = [path, fd, os.fstat(fd).st_size, time.time()]
+        return writer
+
+    # 选择分段文件：优先继续写入当天最后一个未满、最近有追加的分段，否则创建下一个
+    def segment_path(self, owner, day, reuse=True, size=0):
+        directory = os.path.join(self.root, day)
+        os.makedirs(directory, exist_ok=True)
+        numbers = [int(name[len(owner) + 1:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+                   if name.startswith(owner + '.') and name.endswith(SEGMENT_SUFFIX)
+                   and name[len(owner) + 1:-len(SEGMENT_SUFFIX)].isdigit()]
+        if numbers:
+            last = os.path.join(directory, f"{owner}.{max(numbers):04d}{SEGMENT_SUFFIX}")
+            stat = os.stat(last)
+            if (reuse and stat.st_size + size <= self.segment_max_size
+                    and stat.st_mtime >= time.time() - SEGMENT_REUSE_AGE):
+                return last
+        return os.path.join(directory, f"{owner}.{max(numbers, default=0) + 1:04d}{SEGMENT_SUFFIX}")
+
+    # 追加一条记录，返回 (分段路径, 数据偏移, 长度)
+    def append(self, key, kind, img_hash, data, owner=None, day=None):
+        data = memoryview(data)
+        header = RECORD_HEADER.pack(RECORD_MAGIC, kind, len(data), bytes.fromhex(img_hash))
+        owner = owner_name(owner)
+        day = day or time.strftime('%Y-%m-%d', time.gmtime())
+        with self.lock:
+            writer = self.writer_for(owner, day, len(header) + len(data))
+            path, fd, offset, _ = writer
+            os.write(fd, header)
+            written = 0
+            while written < len(data):
+                written += os.write(fd, data[written:])
+            writer[2] += len(header) + len(data)
+            writer[3] = time.time()
+            location = (path, offset + len(header), len(data))
+            self.pending[key] = location
+            while len(self.pending) > PENDING_SIZE:
+                self.pending.popitem(last=False)
+        return location
+
+    # 写入一条记录，内容已存在时不再追加
+    # 已存在的位置也放入 pending，即使索引在登记引用前被删除，add_ref 仍能重新登记
+    def put_record(self, key, kind, img_hash, data, owner, day):
+        location = self.locate(key)
+        if location is None:
+            self.append(key, kind, img_hash, data() if callable(data) else data, owner, day)
+        else:
+            with self.lock:
+                self.pending[key] = tuple(location)
+        return LOCATOR_PREFIX + key
+
+    # 图像和缩略图尚未写入索引的位置；多进程接收时随截图记录交给写入进程，由其 remember 后登记索引
+    def pending_locations(self, img_hash):
+        with self.lock:
+            return {key: self.pending[key] for key in (img_hash, img_hash + THUMBNAIL_SUFFIX) if key in self.pending}
+
+    def remember(self, locations):
+        with self.lock:
+            for key, location in locations.items():
+                self.pending[key] = tuple(location)
+            while len(self.pending) > PENDING_SIZE:
+                self.pending.popitem(last=False)
+
+    # 写入图像，返回写入截图记录的 image_path
+    def put(self, img_hash, data, suffix=None, owner=None, day=None):
+        return self.put_record(img_hash, KIND_IMAGE, img_hash, data, owner, day)
+
+    def image_path(self, img_hash):
+        return LOCATOR_PREFIX + img_hash
+
+    def thumb_path(self, img_hash):
+        return LOCATOR_PREFIX + img_hash + THUMBNAIL_SUFFIX
+
+    # 生成并保存缩略图，写入原图所在的同一组分段；thumbnail 为已经生成好的缩略图
+    def put_thumbnail(self, img_hash, data, owner=None, day=None, thumbnail=None):
+        return self.put_record(img_hash + THUMBNAIL_SUFFIX, KIND_THUMBNAIL, img_hash,
+                               thumbnail or (lambda: make_thumbnail(data)), owner, day)
+
+    # 增加引用计数并登记索引，与截图记录在同一个事务中执行
+    def add_ref(self, cursor, img_hash, size):
+        cursor.execute('UPDATE pack_objects SET refcount = refcount + 1 WHERE key = ?', (img_hash,))
+        if cursor.rowcount == 0:
+            self.insert_index(cursor, img_hash, 1)
+        self.insert_index(cursor, img_hash + THUMBNAIL_SUFFIX, 0)
+
+    def insert_index(self, cursor, key, refcount):
+        with self.lock:
+            location = self.pending.get(key)
+        if location is None:
+            if refcount:
+                print(f'Pack record not found for {key}')
+            return
+        cursor.execute('''
+            INSERT INTO pack_objects (key, segment, offset, length, refcount) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(key) DO NOTHING
+        ''', (key,) + tuple(location) + (refcount,))
+
+    # 减少引用计数，计数归零时删除索引，数据留在分段中等待压缩；返回释放的字节数
+    def release(self, cursor, img_hash, count=1):
+        cursor.execute('UPDATE pack_objects SET refcount = refcount - ? WHERE key = ?', (count, img_hash))
+        keys = (img_hash, img_hash + THUMBNAIL_SUFFIX)
+        row = cursor.execute('SELECT refcount FROM pack_objects WHERE key = ?', (img_hash,)).fetchone()
+        if row is None or row[0] > 0:
+            return 0
+        freed = 0
+        for key in keys:
+            length = cursor.execute('SELECT length FROM pack_objects WHERE key = ?', (key,)).fetchone()
+            if length is not None:
+                freed += length[0]
+                cursor.execute('DELETE FROM pack_objects WHERE key = ?', (key,))
+        with self.lock:
+            for key in keys:
+                self.pending.pop(key, None)
+        return freed
+
+    # 计数归零时 release 已经删除索引，没有遗留的记录，接口与文件存储相同
+    def sweep(self, cursor):
+        return 0
+
+    # 解析截图的位置，迁移前的旧记录仍使用原来的文件路径
+    def resolve(self, img_hash, image_path=None):
+        if image_path and image_path.startswith(LOCATOR_PREFIX):
+            return image_path
+        if img_hash and self.locate(img_hash) is not None:
+            return LOCATOR_PREFIX + img_hash
+        return image_path
+
+    def exists(self, path):
+        if path and path.startswith(LOCATOR_PREFIX):
+            return self.locate(path[len(LOCATOR_PREFIX):]) is not None
+        return bool(path) and os.path.exists(path)
+
+    # 读取图像数据；分段中的记录返回 mmap 上的内存视图，不复制数据
+    def read(self, path):
+        if not path:
+            return None
+        if not path.startswith(LOCATOR_PREFIX):
+            try:
+                with open(path, 'rb') as f:
+                    return f.read()
+            except FileNotFoundError:
+                return None
+        location = self.locate(path[len(LOCATOR_PREFIX):])
+        if location is None:
+            return None
+        segment, offset, length = location
+        return self.view(segment, offset, length)
+
+    # 取得分段中的一段内存视图；分段仍在追加写入时按需重新映射
+    def view(self, segment, offset, length):
+        with self.lock:
+            mapped = self.maps.get(segment)
+            if mapped is None or len(mapped) < offset + length:
+                if mapped is not None:
+                    self.close_map(self.maps.pop(segment))
+                with open(segment, 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.maps[segment] = mapped
+                while len(self.maps) > MAX_OPEN_MAPS:
+                    self.close_map(self.maps.popitem(last=False)[1])
+            else:
+                self.maps.move_to_end(segment)
+        return memoryview(mapped)[offset:offset + length]
+
+    # 关闭映射；仍有内存视图在使用时交给垃圾回收处理
+    def close_map(self, mapped):
+        try:
+            mapped.close()
+        except BufferError:
+            pass
+
+    # 压缩分段：有效数据占比低于阈值的分段，把仍被引用的记录复制到新分段后删除旧分段
+    # 当天的分段和最近修改过的分段可能仍在被其他进程追加，或含有尚未登记索引的记录，不压缩
+    # 索引更新交给写入线程执行，返回回收的字节数
+    def compact(self, db_writer, threshold=COMPACT_THRESHOLD):
+        live = dict(self.read_conn().execute(
+            f'SELECT segment, SUM(length + {RECORD_HEADER.size}) FROM pack_objects GROUP BY segment').fetchall())
+        with self.lock:
+            active = {writer[0] for writer in self.writers.values()}
+        today = time.strftime('%Y-%m-%d', time.gmtime())
+        cutoff = time.time() - COMPACT_MIN_AGE
+        reclaimed = 0
+        for day in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, day)
+            if day >= today or not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                segment = os.path.join(directory, name)
+                if not name.endswith(SEGMENT_SUFFIX) or segment in active:
+                    continue
+                stat = os.stat(segment)
+                if stat.st_mtime > cutoff:
+                    continue
+                size = stat.st_size
+                if size and live.get(segment, 0) >= size * threshold:
+                    continue
+                reclaimed += self.compact_segment(db_writer, segment, day, name, size)
+        return reclaimed
+
+    def compact_segment(self, db_writer, segment, day, name, size):
+        rows = self.read_conn().execute(
+            'SELECT key, offset, length FROM pack_objects WHERE segment = ? ORDER BY offset', (segment,)).fetchall()
+        moves = []
+        new_segment = None
+        if rows:
+            new_segment, fd = self.compacted_segment(name.rsplit('.', 2)[0], day)
+            with os.fdopen(fd, 'wb') as out:
+                for key, offset, length in rows:
+                    data = self.view(segment, offset, length)
+                    img_hash = key[:-len(THUMBNAIL_SUFFIX)] if key.endswith(THUMBNAIL_SUFFIX) else key
+                    kind = KIND_THUMBNAIL if key.endswith(THUMBNAIL_SUFFIX) else KIND_IMAGE
+                    out.write(RECORD_HEADER.pack(RECORD_MAGIC, kind, length, bytes.fromhex(img_hash)))
+                    moves.append((new_segment, out.tell(), key, segment))
+                    out.write(data)
+                    del data
+                out.flush()
+                os.fsync(out.fileno())
+        remaining = db_writer.call(self.relocate, segment, moves)
+        if remaining:
+            print(f'Segment {segment} gained new references during compaction, keeping it')
+            return 0
+        with self.lock:
+            mapped = self.maps.pop(segment, None)
+            for key in [k for k, location in self.pending.items() if location[0] == segment]:
+                del self.pending[key]
+        if mapped is not None:
+            self.close_map(mapped)
+        try:
+            os.remove(segment)
+        except OSError as e:
+            print(f'Error removing segment {segment}: {e}')
+            return 0
+        new_size = os.path.getsize(new_segment) if new_segment else 0
+        print(f'Compacted {segment}: {size} -> {new_size} bytes')
+        return size - new_size
+
+    # 创建压缩输出的分段并打开；编号不是纯数字，追加写入不会续写，O_EXCL 保证多个压缩进程不会选中同一个文件
+    def compacted_segment(self, owner, day):
+        directory = os.path.join(self.root, day)
+        number = 1
+        while True:
+            path = os.path.join(directory, f"{owner}.{COMPACT_PREFIX}{number:04d}{SEGMENT_SUFFIX}")
+            try:
+                return path, os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o644)
+            except FileExistsError:
+                number += 1
+
+    # 把记录指向新分段，返回旧分段中仍然存在的记录数
+    def relocate(self, cursor, segment, moves):
+        cursor.executemany('UPDATE pack_objects SET segment = ?, offset = ? WHERE key = ? AND segment = ?', moves)
+        return cursor.execute('SELECT COUNT(*) FROM pack_objects WHERE segment = ?', (segment,)).fetchone()[0]
+
+    # 关闭所有写入中的分段和映射
+    def close(self):
+        with self.lock:
+            for writer in self.writers.values():
+                os.close(writer[1])
+            self.writers.clear()
+            for mapped in self.maps.values():
+                self.close_map(mapped)
+            self.maps.clear()
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import datetime
+from collections import OrderedDict
+import database
+
+# 按时间分区的截图记录
+# 每个分区是一个独立的数据库文件：screenshots_partitions/2024-05-01.db，表结构与主库的 screenshots 表相同
+# 主库的 screenshots 表保留分区之前的旧记录，查询时与分区合并
+# 过期的分区整个关闭并删除文件，不需要大批量 DELETE 和 VACUUM
+# 分区内的 id 从 (分区起始日距1970-01-01的天数 << 32) 开始递增，不同分区和旧表的 id 不会重复，(timestamp, id) 翻页仍然有效
+PARTITION_PERIOD = 'day'  # 分区粒度：'day' 或 'week'（从周一开始）
+RETENTION_DAYS = 0  # 保留天数，0 表示不删除
+RETENTION_CHECK_INTERVAL = 3600  # 检查过期分区的间隔，单位为秒
+MAX_OPEN_PARTITIONS = 8  # 写入线程同时保持打开的分区数
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'  # 与 SQLite 的 CURRENT_TIMESTAMP 相同，UTC
+DROPPED_SUFFIX = '.dropped'  # 已删除、等待主库提交后再删除文件的分区
+DB_SUFFIXES = ('', '-wal', '-shm')  # 分区数据库文件和 WAL 模式的附属文件
+
+EPOCH = datetime.date(1970, 1, 1)
+
+# 分区目录，与主库放在一起
+def partition_dir(db_path=database.DB_PATH):
+    return os.path.splitext(db_path)[0] + '_partitions'
+
+# 时间戳(秒)转换为记录中的时间文本
+def format_timestamp(t):
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(t))
+
+# 时间戳所在分区的起始日期
+def period_start(t, period=PARTITION_PERIOD):
+    day = datetime.datetime.fromtimestamp(t, datetime.timezone.utc).date()
+    if period == 'week':
+        day -= datetime.timedelta(days=day.weekday())
+    return day
+
+def period_length(period=PARTITION_PERIOD):
+    return datetime.timedelta(days=7 if period == 'week' else 1)
+
+# 分区名即起始日期
+def partition_key(t, period=PARTITION_PERIOD):
+    return period_start(t, period).isoformat()
+
+# 分区结束日期（不含）
+def partition_end(key, period=PARTITION_PERIOD):
+    return (datetime.date.fromisoformat(key) + period_length(period)).isoformat()
+
+def id_base(key):
+    return (datetime.date.fromisoformat(key) - EPOCH).days << 32
+
+def partition_path(key, db_path=database.DB_PATH):
+    return os.path.join(partition_dir(db_path), f'{key}.db')
+
+# 所有分区，按时间排序，返回 [(分区名, 路径), ...]
+def list_partitions(db_path=database.DB_PATH):
+    directory = partition_dir(db_path)
+    if not os.path.isdir(directory):
+        return []
+    keys = sorted(name[:-3] for name in os.listdir(directory) if name.endswith('.db'))
+    return [(key, os.path.join(directory, key + '.db')) for key in keys]
+
+# 与时间范围有交集的分区；时间为 'YYYY-MM-DD HH:MM:SS' 文本，为空表示不限
+def overlapping(db_path, start_time=None, end_time=None, period=PARTITION_PERIOD):
+    result = []
+    for key, path in list_partitions(db_path):
+        if start_time and partition_end(key, period) <= start_time:
+            continue
+        if end_time and key > end_time:
+            continue
+        result.append((key, path))
+    return result
+
+# 跨旧表和分区的键集分页查询，参数和返回值与 database.query_history 相同
+# 分区按时间先后排列且互不重叠，依次查询直到凑满一页，再与旧表的结果合并排序
+def query_history(db_path, filters, after=None, limit=database.PAGE_SIZE):
+    start_time, end_time = filters[0], filters[1]
+    if not (start_time and end_time):
+        start_time = end_time = None  # 与 database.query_history 一致，只给出一端时不按时间过滤
+    conn = database.connect_readonly(db_path)
+    try:
+        rows = database.query_history(conn, filters, after, limit)
+    finally:
+        conn.close()
+
+    collected = []
+    for key, path in overlapping(db_path, start_time, end_time):
+        if after is not None and str(after[0]) >= partition_end(key):
+            continue
+        conn = database.connect_readonly(path)
+        try:
+            collected.extend(database.query_history(conn, filters, after, limit - len(collected)))
+        finally:
+            conn.close()
+        if len(collected) >= limit:
+            break
+    return sorted(rows + collected, key=lambda row: (str(row[1]), row[0]))[:limit]
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+# 创建分区表
+def create_partition_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS screenshots (
+            id INTEGER PRIMARY KEY,
+            client_mac TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            image_path TEXT,
+            ip_address TEXT,
+            image_hash TEXT,
+            encoding TEXT,
+            tier INTEGER DEFAULT 0
+        )
+    ''')
+    database.upgrade_screenshots(cursor)
+    database.create_indexes(cursor)
+
+# 分区写入器，只在数据库写入线程中使用
+# 注册为 DBWriter 的参与者：每批写操作中用到的分区各自开启事务，单个写操作失败时同时回滚分区中的SAVEPOINT
+# 分区先于主库提交，主库事务中记录每个分区已提交的最大 id（partition_marks 表）；
+# 主库提交失败或进程在两次提交之间退出时，分区中超过记录的行没有对应的引用计数，由 rollback 或启动时的 recover 删除
+# 删除过期分区时文件先改名，主库提交后才真正删除；提交失败时改回原名，分区中的记录与恢复的引用计数仍然一致
+class PartitionWriter:
+    def __init__(self, db_path=database.DB_PATH, period=PARTITION_PERIOD, max_open=MAX_OPEN_PARTITIONS):
+        self.db_path = db_path
+        self.period = period
+        self.max_open = max_open
+        self.conns = OrderedDict()  # 分区名 -> 写连接
+        self.dirty = set()  # 本批次有写入、尚未提交的分区
+        self.item_keys = set()  # 当前写操作中建立了SAVEPOINT的分区
+        self.committed = set()  # 本批次已提交、等待主库提交的分区
+        self.dropped = []  # 本批次删除、文件已改名的分区
+        self.item_dropped = 0  # 当前写操作开始时 dropped 的长度
+        os.makedirs(partition_dir(db_path), exist_ok=True)
+
+    # 取得分区的写连接，超过 max_open 时关闭最久未用且没有未提交事务的连接
+    def connection(self, key):
+        conn = self.conns.get(key)
+        if conn is None:
+            for old_key in [k for k in self.conns if k not in self.dirty][:max(0, len(self.conns) - self.max_open + 1)]:
+                self.conns.pop(old_key).close()
+            conn = database.connect(partition_path(key, self.db_path))
+            create_partition_tables(conn.cursor())
+            self.conns[key] = conn
+        else:
+            self.conns.move_to_end(key)
+        return conn
+
+    # 取得分区的游标，本批次第一次写入时开启事务，当前写操作第一次写入时建立SAVEPOINT
+    def cursor_for(self, key):
+        conn = self.connection(key)
+        if key not in self.dirty:
+            conn.execute('BEGIN')
+            self.dirty.add(key)
+        if key not in self.item_keys:
+            conn.execute('SAVEPOINT item')
+            self.item_keys.add(key)
+        return conn.cursor()
+
+    def begin_item(self):
+        self.item_keys.clear()
+        self.item_dropped = len(self.dropped)
+
+    def release_item(self):
+        for key in self.item_keys:
+            if key in self.conns:
+                self.conns[key].execute('RELEASE item')
+        self.item_keys.clear()
+
+    def rollback_item(self):
+        for key in self.item_keys:
+            if key in self.conns:
+                self.conns[key].execute('ROLLBACK TO item')
+                self.conns[key].execute('RELEASE item')
+        self.item_keys.clear()
+        for key in reversed(self.dropped[self.item_dropped:]):
+            self.restore(key)
+        del self.dropped[self.item_dropped:]
+
+    # 插入一条截图记录，t 为截图时间(秒)
+    def insert(self, t, mac_address, image_path, ip_address, img_hash, encoding=None):
+        key = partition_key(t, self.period)
+        cursor = self.cursor_for(key)
+        cursor.execute('''
+            INSERT INTO screenshots (id, client_mac, timestamp, image_path, ip_address, image_hash, encoding)
+            VALUES ((SELECT COALESCE(MAX(id), ?) + 1 FROM screenshots), ?, ?, ?, ?, ?, ?)
+        ''', (id_base(key), mac_address, format_timestamp(t), image_path, ip_address, img_hash, encoding))
+
+    # 主库提交前：记录各分区的最大 id 并提交分区
+    def prepare(self, cursor):
+        for key in list(self.dirty):
+            conn = self.conns[key]
+            max_id = conn.execute('SELECT MAX(id) FROM screenshots').fetchone()[0]
+            cursor.execute('INSERT OR REPLACE INTO partition_marks (key, max_id) VALUES (?, ?)', (key, max_id))
+            conn.execute('COMMIT')
+            self.dirty.discard(key)
+            self.committed.add(key)
+
+    # 主库提交后删除本批次删除的分区文件
+    def commit(self):
+        self.committed.clear()
+        for key in self.dropped:
+            self.purge(key)
+        self.dropped.clear()
+
+    # 批次失败：回滚未提交的分区，已提交的分区删除超过主库记录的行，删除的分区改回原名
+    def rollback(self, cursor):
+        for key in self.dirty:
+            conn = self.conns[key]
+            if conn.in_transaction:
+                conn.rollback()
+        self.dirty.clear()
+        self.item_keys.clear()
+        for key in self.committed:
+            self.trim(cursor, key)
+        self.committed.clear()
+        for key in reversed(self.dropped):
+            self.restore(key)
+        self.dropped.clear()
+
+    # 删除分区中 id 超过主库记录的行；没有记录的分区是在失败的批次中新建的，全部删除
+    def trim(self, cursor, key):
+        row = cursor.execute('SELECT max_id FROM partition_marks WHERE key = ?', (key,)).fetchone()
+        max_id = row[0] if row is not None and row[0] is not None else id_base(key)
+        removed = self.connection(key).execute('DELETE FROM screenshots WHERE id > ?', (max_id,)).rowcount
+        if removed:
+            print(f'Removed {removed} uncommitted screenshots from partition {key}')
+
+    # 启动时调用：建表并清理上次中断留下的分区记录；还没有记录的分区（升级前创建）以当前最大 id 为准
+    # 改名等待删除的分区在主库中仍有记录时说明删除没有提交，改回原名，否则删除
+    def recover(self, cursor):
+        cursor.execute('CREATE TABLE IF NOT EXISTS partition_marks (key TEXT PRIMARY KEY, max_id INTEGER)')
+        marked = {key for key, in cursor.execute('SELECT key FROM partition_marks')}
+        pending = '.db' + DROPPED_SUFFIX
+        for name in os.listdir(partition_dir(self.db_path)):
+            if name.endswith(pending):
+                key = name[:-len(pending)]
+                if key in marked and not os.path.exists(partition_path(key, self.db_path)):
+                    self.restore(key)
+                else:
+                    self.purge(key)
+        for key, _ in list_partitions(self.db_path):
+            if key in marked:
+                self.trim(cursor, key)
+            else:
+                max_id = self.connection(key).execute('SELECT MAX(id) FROM screenshots').fetchone()[0]
+                cursor.execute('INSERT INTO partition_marks (key, max_id) VALUES (?, ?)', (key, max_id))
+
+    # 早于 cutoff 日期（不含）结束的分区
+    def expired(self, cutoff):
+        return [key for key, _ in list_partitions(self.db_path) if partition_end(key, self.period) <= cutoff]
+
+    # 分区中每个图像哈希的引用次数，删除分区前用于释放存储引用
+    def hash_counts(self, key):
+        conn = database.connect_readonly(partition_path(key, self.db_path))
+        try:
+            return conn.execute('''
+                SELECT image_hash, COUNT(*) FROM screenshots WHERE image_hash IS NOT NULL GROUP BY image_hash
+            ''').fetchall()
+        finally:
+            conn.close()
+
+    # 删除分区：删除主库中的提交记录，关闭连接并把分区文件改名，主库提交后由 commit 删除
+    def drop(self, key, cursor):
+        cursor.execute('DELETE FROM partition_marks WHERE key = ?', (key,))
+        self.close_partition(key)
+        path = partition_path(key, self.db_path)
+        for suffix in DB_SUFFIXES:
+            try:
+                os.replace(path + suffix, path + DROPPED_SUFFIX + suffix)
+            except FileNotFoundError:
+                pass
+        self.dropped.append(key)
+
+    # 关闭分区的写连接，丢弃未提交的写入
+    def close_partition(self, key):
+        conn = self.conns.pop(key, None)
+        if conn is not None:
+            if key in self.dirty:
+                conn.rollback()
+                self.dirty.discard(key)
+            self.item_keys.discard(key)
+            self.committed.discard(key)
+            conn.close()
+
+    # 撤销删除：同一批次中重新创建的同名分区随之丢弃，改名的文件改回原名
+    def restore(self, key):
+        self.close_partition(key)
+        path = partition_path(key, self.db_path)
+        for suffix in DB_SUFFIXES:
+            remove_file(path + suffix)
+        for suffix in DB_SUFFIXES:
+            try:
+                os.replace(path + DROPPED_SUFFIX + suffix, path + suffix)
+            except FileNotFoundError:
+                pass
+
+    # 删除已经提交删除的分区文件
+    def purge(self, key):
+        path = partition_path(key, self.db_path)
+        for suffix in DB_SUFFIXES:
+            remove_file(path + DROPPED_SUFFIX + suffix)
+
+    def close(self):
+        for conn in self.conns.values():
+            conn.close()
+        self.conns.clear()
+        self.dirty.clear()
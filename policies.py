@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+# 截屏间隔策略
+# 全局默认间隔之外，可以按用户名、分组或 MAC 地址单独设置截屏间隔和画面变化时的最短间隔
+# 连接登录后按 MAC > 用户 > 分组 > 默认 的顺序取第一个匹配的策略；用户所属分组保存在 users 表的 group_name 列
+# 重要客户端（users 表的 important 列）在服务器过载时最后受到限制，见 backpressure.py
+# 策略保存在主库的 capture_policies 表，修改时先更新内存再交给写入线程，不等待写入完成
+SCOPES = ['mac', 'user', 'group']  # 匹配优先级从高到低
+DEFAULT_SCOPE = 'default'  # 全局默认间隔在表中的作用范围，target 为空字符串
+
+# 建表；旧数据库的 users 表补充 group_name 和 important 列
+def create_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS capture_policies (
+            scope TEXT,
+            target TEXT,
+            interval REAL,
+            min_interval REAL,
+            PRIMARY KEY (scope, target)
+        )
+    ''')
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(users)')]
+    for column, column_type in (('group_name', 'TEXT'), ('important', 'INTEGER DEFAULT 0')):
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE users ADD COLUMN {column} {column_type}')
+
+# 写入或删除一条策略，在写入线程中执行；interval 为 None 时删除
+def save_policy(cursor, scope, target, interval, min_interval=None):
+    if interval is None:
+        cursor.execute('DELETE FROM capture_policies WHERE scope = ? AND target = ?', (scope, target))
+    else:
+        cursor.execute('INSERT OR REPLACE INTO capture_policies (scope, target, interval, min_interval) '
+                       'VALUES (?, ?, ?, ?)', (scope, target, interval, min_interval))
+
+def save_group(cursor, username, group):
+    cursor.execute('UPDATE users SET group_name = ? WHERE username = ?', (group, username))
+
+def save_important(cursor, username, important):
+    cursor.execute('UPDATE users SET important = ? WHERE username = ?', (int(important), username))
+
+# 内存中的策略表，接收线程登录时查询，界面线程和控制线程修改
+class CapturePolicies:
+    def __init__(self, interval, min_interval):
+        self.lock = threading.Lock()
+        self.interval = interval  # 全局默认
+        self.min_interval = min_interval
+        self.policies = {}  # (scope, target) -> (interval, min_interval)
+        self.groups = {}  # 用户名 -> 分组
+        self.important = set()  # 重要客户端的用户名
+
+    # 从数据库读取策略和用户分组
+    def load(self, conn):
+        with self.lock:
+            for scope, target, interval, min_interval in conn.execute(
+                    'SELECT scope, target, interval, min_interval FROM capture_policies'):
+                if scope == DEFAULT_SCOPE:
+                    self.interval = interval
+                    if min_interval is not None:
+                        self.min_interval = min_interval
+                else:
+                    self.policies[(scope, target)] = (interval, min_interval)
+            self.groups = dict(conn.execute('SELECT username, group_name FROM users WHERE group_name IS NOT NULL'))
+            self.important = {username for username, in conn.execute('SELECT username FROM users WHERE important')}
+
+    def set_default(self, interval, min_interval=None):
+        with self.lock:
+            self.interval = interval
+            if min_interval is not None:
+                self.min_interval = min_interval
+
+    # 设置一条策略，interval 为 None 时删除
+    def set(self, scope, target, interval, min_interval=None):
+        with self.lock:
+            if interval is None:
+                self.policies.pop((scope, target), None)
+            else:
+                self.policies[(scope, target)] = (interval, min_interval)
+
+    # 设置用户所属分组，group 为空时移出分组
+    def set_group(self, username, group):
+        with self.lock:
+            if group:
+                self.groups[username] = group
+            else:
+                self.groups.pop(username, None)
+
+    def set_important(self, username, important):
+        with self.lock:
+            if important:
+                self.important.add(username)
+            else:
+                self.important.discard(username)
+
+    def is_important(self, username):
+        with self.lock:
+            return username in self.important
+
+    # 连接适用的 (截屏间隔, 最短间隔)；策略没有设置最短间隔时沿用默认值，但不超过截屏间隔
+    def resolve(self, username, mac_address):
+        with self.lock:
+            keys = (('mac', mac_address), ('user', username), ('group', self.groups.get(username)))
+            for key in keys:
+                policy = self.policies.get(key)
+                if policy is not None:
+                    interval, min_interval = policy
+                    if min_interval is None:
+                        min_interval = min(self.min_interval, interval)
+                    return interval, min_interval
+            return self.interval, self.min_interval
+
+    # 修改 (scope, target) 的策略后，连接是否可能受影响
+    def affects(self, scope, target, username, mac_address):
+        if scope == DEFAULT_SCOPE:
+            return True
+        if scope == 'mac':
+            return mac_address == target
+        if scope == 'user':
+            return username == target
+        with self.lock:
+            return self.groups.get(username) == target
+
+    # 可以 JSON 序列化的完整副本，发给工作进程和界面
+    def snapshot(self):
+        with self.lock:
+            return {
+                'default': [self.interval, self.min_interval],
+                'policies': [[scope, target, interval, min_interval]
+                             for (scope, target), (interval, min_interval) in sorted(self.policies.items())],
+                'groups': dict(self.groups),
+                'important': sorted(self.important),
+            }
+
+    def restore(self, snapshot):
+        with self.lock:
+            self.interval, self.min_interval = snapshot['default']
+            self.policies = {(scope, target): (interval, min_interval)
+                             for scope, target, interval, min_interval in snapshot['policies']}
+            self.groups = dict(snapshot['groups'])
+            self.important = set(snapshot['important'])
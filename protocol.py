@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import struct
+
+# 二进制帧协议，客户端和服务端共用
+# 帧头：magic(1) version(1) type(1) flags(1) length(4) client_id(8) seq(4)，共20字节，网络字节序
+# 旧的文本握手消息是base64字符串，第一个字节不可能是MAGIC，因此可以按消息逐条区分新旧协议
+MAGIC = 0xA5
+PROTOCOL_VERSION = 4  # 0 表示旧的 length/ready/finish 文本握手；2 增加 FLAG_META；3 增加 FLAG_ENCRYPTED；4 增加 FLAG_TIMESTAMP/FLAG_SPOOLED
+HEADER = struct.Struct('!BBBBIQI')
+HEADER_SIZE = HEADER.size
+MAX_PAYLOAD = 256 * 1024 * 1024  # 单帧负载上限，防止异常长度耗尽内存
+
+# 帧类型
+FRAME = 1  # 截图数据，负载为图像字节
+ACK = 2  # 累积确认，seq 为已收到的最大帧序号
+CONTROL = 3  # 控制消息，负载为 AES 加密后的文本（如 SET_FREQUENCY）
+
+# 标志位
+FLAG_ACK_REQUEST = 0x01  # 请求对方回复累积确认
+FLAG_DELTA = 0x02  # 负载为分块差分帧（见 delta.py），不带该标志的截图帧即关键帧
+FLAG_META = 0x04  # 负载前带有元数据：长度(2字节) + "key=value ..." 文本，如编码参数（版本2）
+FLAG_ENCRYPTED = 0x08  # 负载经会话密钥分块加密（见 stream_cipher.py），元数据也在密文内（版本3）
+FLAG_TIMESTAMP = 0x10  # 负载最前面带有截屏时刻：UTC 秒数(8字节 double)，在元数据之前（版本4）
+FLAG_SPOOLED = 0x20  # 断线期间缓存在本地、重连后补传的关键帧，不参与实时的差分链（版本4）
+
+META_LENGTH = struct.Struct('!H')
+TIMESTAMP = struct.Struct('!d')
+
+# 大于该长度的负载单独发送，避免拼接帧头时复制整块数据
+INLINE_PAYLOAD_LIMIT = 64 * 1024
+# 接收负载时单次 recv_into 的最大字节数
+RECV_CHUNK = 1024 * 1024
+
+class ProtocolError(Exception):
+    pass
+
+# 帧头中的版本号取能表示该帧的最低版本，不含新标志的帧旧版本的对端仍能解析
+def frame_version(flags):
+    if flags & (FLAG_TIMESTAMP | FLAG_SPOOLED):
+        return 4
+    if flags & FLAG_ENCRYPTED:
+        return 3
+    return 2 if flags & FLAG_META else 1
+
+# 打包帧头
+def pack_header(msg_type, length, client_id=0, seq=0, flags=0):
+    return HEADER.pack(MAGIC, frame_version(flags), msg_type, flags, length, client_id, seq)
+
+# 解析帧头，返回 (type, flags, length, client_id, seq)
+def unpack_header(data):
+    magic, version, msg_type, flags, length, client_id, seq = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ProtocolError(f"Bad frame magic: {magic:#x}")
+    if version == 0 or version > PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version: {version}")
+    if length > MAX_PAYLOAD:
+        raise ProtocolError(f"Frame too large: {length}")
+    return msg_type, flags, length, client_id, seq
+
+# 判断一条消息是否为二进制帧（只需要第一个字节）
+def is_binary(first_bytes):
+    return bool(first_bytes) and first_bytes[0] == MAGIC
+
+# MAC地址转换为帧头中的客户端ID
+def mac_to_client_id(mac_address):
+    try:
+        return int(mac_address.replace(':', '').replace('-', ''), 16) & 0xFFFFFFFFFFFFFFFF
+    except (AttributeError, ValueError):
+        return 0
+
+# 接收指定长度的数据
+def recv_exactly(sock, length):
+    buf = bytearray(length)
+    view = memoryview(buf)
+    received = 0
+    while received < length:
+        n = sock.recv_into(view[received:], length - received)
+        if n == 0:
+            raise ConnectionError("Connection closed by peer")
+        received += n
+    return bytes(buf)
+
+# 接收负载到预分配的缓冲区，避免 bytes 拼接造成的反复复制；传入hasher时边收边计算摘要
+def recv_payload(sock, length, hasher=None):
+    buf = bytearray(length)
+    view = memoryview(buf)
+    received = 0
+    while received < length:
+        n = sock.recv_into(view[received:], min(length - received, RECV_CHUNK))
+        if n == 0:
+            raise ConnectionError("Connection closed while receiving payload")
+        if hasher is not None:
+            hasher.update(view[received:received + n])
+        received += n
+    return buf
+
+# 接收负载并直接写入文件，内存中只保留一个固定大小的缓冲区
+def recv_payload_to_file(sock, length, file, hasher=None):
+    buf = bytearray(min(length, RECV_CHUNK) or 1)
+    view = memoryview(buf)
+    remaining = length
+    while remaining:
+        n = sock.recv_into(view, min(remaining, len(buf)))
+        if n == 0:
+            raise ConnectionError("Connection closed while receiving payload")
+        chunk = view[:n]
+        if hasher is not None:
+            hasher.update(chunk)
+        file.write(chunk)
+        remaining -= n
+    return length
+
+# asyncio版本：从StreamReader分块读取到预分配的缓冲区
+async def read_payload(reader, length, hasher=None):
+    buf = bytearray(length)
+    received = 0
+    while received < length:
+        chunk = await reader.read(min(length - received, RECV_CHUNK))
+        if not chunk:
+            raise ConnectionError("Connection closed while receiving payload")
+        n = len(chunk)
+        buf[received:received + n] = chunk
+        if hasher is not None:
+            hasher.update(chunk)
+        received += n
+    return buf
+
+# 查看下一条消息是否为二进制帧，不消耗数据
+def peek_is_binary(sock):
+    first = sock.recv(1, socket.MSG_PEEK)
+    if not first:
+        raise ConnectionError("Connection closed by peer")
+    return is_binary(first)
+
+# 接收帧头
+def recv_header(sock):
+    return unpack_header(recv_exactly(sock, HEADER_SIZE))
+
+# 接收完整的一帧，返回 (type, flags, client_id, seq, payload)
+def recv_frame(sock):
+    msg_type, flags, length, client_id, seq = recv_header(sock)
+    payload = recv_payload(sock, length)
+    return msg_type, flags, client_id, seq, payload
+
+# 发送一帧
+def send_frame(sock, msg_type, payload=b'', client_id=0, seq=0, flags=0):
+    header = pack_header(msg_type, len(payload), client_id, seq, flags)
+    if len(payload) <= INLINE_PAYLOAD_LIMIT:
+        sock.sendall(header + payload)
+    else:
+        sock.sendall(header)
+        sock.sendall(payload)
+
+# 打包一帧为字节串，用于无法直接写socket的场景（如asyncio）
+def pack_frame(msg_type, payload=b'', client_id=0, seq=0, flags=0):
+    return pack_header(msg_type, len(payload), client_id, seq, flags) + payload
+
+# 打包负载前的元数据
+def pack_meta(text):
+    data = text.encode()
+    return META_LENGTH.pack(len(data)) + data
+
+# 拆分带 FLAG_META 的负载，返回 (元数据文本, 剩余负载)，剩余负载不复制
+def split_meta(payload):
+    view = memoryview(payload)
+    if len(view) < META_LENGTH.size:
+        raise ProtocolError("Truncated frame metadata")
+    length, = META_LENGTH.unpack_from(view)
+    end = META_LENGTH.size + length
+    if end > len(view):
+        raise ProtocolError("Truncated frame metadata")
+    return bytes(view[META_LENGTH.size:end]).decode(), view[end:]
+
+# 打包负载前的截屏时刻
+def pack_timestamp(t):
+    return TIMESTAMP.pack(t)
+
+# 拆分带 FLAG_TIMESTAMP 的负载，返回 (截屏时刻, 剩余负载)，剩余负载不复制
+def split_timestamp(payload):
+    view = memoryview(payload)
+    if len(view) < TIMESTAMP.size:
+        raise ProtocolError("Truncated frame timestamp")
+    t, = TIMESTAMP.unpack_from(view)
+    return t, view[TIMESTAMP.size:]
+
+# 拆分一次recv中粘在一起的多条旧协议消息
+# 旧协议消息格式为 base64(iv) + b':' + base64(ct)，其中 base64(iv) 固定24个字符且不含冒号
+LEGACY_IV_LENGTH = 24
+
+def split_legacy(data):
+    data = bytes(data).strip()
+    colons = []
+    pos = data.find(b':')
+    while pos != -1:
+        colons.append(pos)
+        pos = data.find(b':', pos + 1)
+    if len(colons) <= 1:
+        return [data] if data else []
+    messages = []
+    for i, colon in enumerate(colons):
+        start = max(colon - LEGACY_IV_LENGTH, 0)
+        end = colons[i + 1] - LEGACY_IV_LENGTH if i + 1 < len(colons) else len(data)
+        messages.append(data[start:end])
+    return messages
@@ -6,17 +6,41 @@ import sqlite3
 import socket
 import threading
 import time
-from PyQt5 import QtWidgets, QtGui, QtCore
+import datetime
+import asyncio
+import argparse
+import functools
 import hashlib
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad, unpad
 import base64
+import protocol
+import delta
+import stream_cipher
+import database
+import partitions
+import downsample
+import metrics
+import control
+import policies
+import backpressure
+from storage import ContentStore, RELEASE_GRACE
+from packstore import PackStore, PACK_DIR
 
 # 服务器配置
 SERVER_IP = '0.0.0.0'
 SERVER_PORT = 5000
 SCREENSHOT_DIR = 'screenshots'
 AES_KEY = b'1234567890123456'  # 16字节密钥
+STORAGE_ENGINE = 'files'  # 截图存储方式：'files' 每帧一个文件，'pack' 按客户端和日期追加写入分段文件
+SERVER_MODE = 'thread'  # 服务器模式：'thread' 每个连接一个线程，'asyncio' 单线程事件循环
+LISTEN_BACKLOG = 1024  # 监听队列长度，避免登录高峰时丢弃连接
+MAX_CONNECTIONS = 5000  # 最大同时连接数
+MIN_SCREENSHOT_INTERVAL = 2.0  # 客户端画面变化时的最短截屏间隔，单位为秒
+HEADLESS_WORKERS = 2  # 无界面模式的工作进程数
+MONITOR_PORT = 5001  # 无界面模式供界面连接的本机端口
+MAX_CLOCK_SKEW = 300  # 客户端截屏时刻超前服务器时钟超过该值(秒)时视为无效，使用接收时刻
+STATUS_INTERVAL = 1.0  # 统计每个客户端接收帧率的间隔，单位为秒
 
 # 确保截屏图片存放目录存在
 os.makedirs(SCREENSHOT_DIR, exist_ok=True)
@@ -37,24 +61,120 @@ def aes_decrypt(enc_data):
     pt = unpad(cipher.decrypt(ct), AES.block_size)
     return pt
 
-# 服务器类
-class Server(QtCore.QObject):
-    # 定义信号，用于在收到截图时更新UI和用户状态
-    update_signal = QtCore.pyqtSignal(str, tuple)
-    user_status_signal = QtCore.pyqtSignal(dict)
+# 一个客户端的完整状态，监听者收到的变化是其中的部分字段
+def new_status():
+    return {'online': False, 'last_frame': None, 'fps': 0.0}
 
-    def __init__(self):
-        super().__init__()
+# 客户端连接类，统一线程模式的socket和asyncio模式的StreamWriter
+class ClientConnection:
+    def __init__(self, address, sock=None, writer=None, loop=None):
+        self.address = address
+        self.sock = sock
+        self.writer = writer
+        self.loop = loop
+        self.username = None
+        self.mac_address = None
+        self.ip_address = None
+        self.binary = False  # 收到过二进制帧后，控制消息也按二进制帧发送
+        self.client_protocol = 0  # 客户端登录时声明支持的帧协议版本，旧客户端不声明，为0
+        self.session_cipher = None  # 登录成功后生成，用于解密带 FLAG_ENCRYPTED 的帧
+        self.delta_decoder = delta.DeltaDecoder()
+        self.latest_frame_at = 0.0  # 已收到的最新截屏时刻，补传的旧帧不刷新监控墙
+        self.frames = 0  # 收到的帧数和负载字节数，用于运行指标
+        self.bytes_in = 0
+        self.send_lock = threading.Lock()
+        self.outbox = control.Outbox()  # 待发的控制消息，由控制通道的发送线程发出
+        self.closed = False
+        self.pressure_level = 0  # 最近一次通知客户端的过载级别
+        self.encoding_hint = None  # 界面设置的编码提示，过载解除后恢复
+
+    # 发送数据，可以在任意线程中调用
+    def sendall(self, data):
+        if self.writer is None:
+            with self.send_lock:
+                self.sock.sendall(data)
+        else:
+            self.loop.call_soon_threadsafe(self.writer.write, data)
+
+    # 发送控制消息，按连接使用的协议选择格式
+    def send_control(self, message):
+        data = aes_encrypt(message.encode())
+        if self.binary:
+            data = protocol.pack_frame(protocol.CONTROL, data)
+        self.sendall(data)
+
+    # 关闭连接
+    def close(self):
+        if self.writer is None:
+            self.sock.close()
+        else:
+            self.loop.call_soon_threadsafe(self.writer.close)
+
+# 服务器类，不依赖界面；收到截图和用户状态变化时通知 listeners 中的每个监听者
+# 监听者实现 frame_received(img_hash, client_address) 和 client_status_changed(key, fields)，在接收线程中调用
+# 客户端状态只通知变化的字段：key 为 (MAC地址, IP地址)，fields 为 online、last_frame（最新截屏时刻）、fps 中变化的部分
+class Server:
+    def __init__(self, mode=SERVER_MODE, backlog=LISTEN_BACKLOG, max_connections=MAX_CONNECTIONS,
+                 storage=STORAGE_ENGINE, retention_days=partitions.RETENTION_DAYS, enable_downsample=False,
+                 reuse_port=False, metrics_port=0):
         self.server_ip = SERVER_IP
         self.server_port = SERVER_PORT
+        self.mode = mode
+        self.backlog = backlog
+        self.max_connections = max_connections
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)  # 多个进程监听同一端口，由内核分配新连接
         self.clients = {}
         self.user_status = {}
-        self.db_conn = sqlite3.connect('screenshots.db', check_same_thread=False)
-        self.create_db()  # 创建数据库表
+        self.status_lock = threading.Lock()  # user_status 在接收线程中更新，在界面线程中读取
+        self.listeners = []
+        self.connection_count = 0
+        self.count_lock = threading.Lock()
+        self.loop = None
+        self.stop_event = None
+        self.db_path = database.DB_PATH
+        self.storage = storage
+        if storage == 'pack':
+            self.store = PackStore(PACK_DIR, self.db_path)
+        else:
+            self.store = ContentStore(SCREENSHOT_DIR)  # 按哈希存放截图并去重
+        self.local = threading.local()  # 每个线程各自的只读连接
         self.is_running = True
         self.screenshot_interval = 15.0  # 初始截屏间隔为15秒
+        self.min_screenshot_interval = MIN_SCREENSHOT_INTERVAL
+        self.metrics = metrics.IngestMetrics()
+        self.metrics_port = metrics_port  # 0 表示不开启指标端口
+        self.metrics_endpoint = None
+        self.policies = policies.CapturePolicies(self.screenshot_interval, self.min_screenshot_interval)
+        self.control = control.ControlChannel()
+        self.backpressure = backpressure.Backpressure()
+        self.open_database(retention_days, enable_downsample)
+
+    # 建表并启动写入线程和后台维护任务
+    def open_database(self, retention_days, enable_downsample):
+        self.db_conn = database.connect(self.db_path)  # 写连接，建表后只由写入线程使用
+        self.create_db()  # 创建数据库表
+        self.load_policies()
+        self.partitions = partitions.PartitionWriter(self.db_path)  # 新记录按天写入分区库
+        self.db_writer = database.DBWriter(self.db_conn)
+        self.db_writer.add_participant(self.partitions)
+        self.db_writer.start()
+        self.db_writer.call(self.partitions.recover)
+        self.retention_days = retention_days
+        if self.retention_days > 0:
+            threading.Thread(target=self.retention_loop, daemon=True).start()
+        threading.Thread(target=self.sweep_loop, daemon=True).start()
+        if enable_downsample:
+            self.downsampler = downsample.Downsampler(self.db_path, self.store, self.db_writer, self.partitions)
+            threading.Thread(target=self.downsample_loop, daemon=True).start()
+
+    # 停止写入线程，等待已提交的写操作完成
+    def close_database(self):
+        self.db_writer.stop()
+        self.db_writer.join()
+        self.partitions.close()
 
     # 创建数据库表
     def create_db(self):
@@ -65,9 +185,13 @@ class Server(QtCore.QObject):
                 client_mac TEXT,
                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
                 image_path TEXT,
-                ip_address TEXT
+                ip_address TEXT,
+                image_hash TEXT,
+                encoding TEXT,
+                tier INTEGER DEFAULT 0
             )
         ''')
+        database.upgrade_screenshots(cursor)  # 旧数据库升级：补充图像哈希、编码参数和降采样级别列
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
                 username TEXT PRIMARY KEY,
@@ -76,145 +200,673 @@ class Server(QtCore.QObject):
                 ip_address TEXT
             )
         ''')
+        policies.create_tables(cursor)
+        database.create_indexes(cursor)
+        self.store.create_tables(cursor)
         self.db_conn.commit()
 
-    # 处理客户端连接
+    # 读取保存的截屏间隔策略，保存过的全局默认间隔代替初始值
+    def load_policies(self):
+        self.policies.load(self.read_conn())
+        self.screenshot_interval = self.policies.interval
+        self.min_screenshot_interval = self.policies.min_interval
+
+    # 当前线程的只读连接
+    def read_conn(self):
+        conn = getattr(self.local, 'db_conn', None)
+        if conn is None:
+            conn = self.local.db_conn = database.connect_readonly(self.db_path)
+        return conn
+
+    # 登记新连接，超过最大连接数时返回False
+    def acquire_connection(self):
+        with self.count_lock:
+            if self.connection_count >= self.max_connections:
+                return False
+            self.connection_count += 1
+            return True
+
+    def release_connection(self):
+        with self.count_lock:
+            self.connection_count -= 1
+
+    # 处理第一条消息（注册、登录或断开），返回是否进入截图接收循环
+    def handle_handshake(self, conn, data):
+        if data.startswith('REGISTER'):
+            _, username, password, mac_address, ip_address = data.split()
+            self.register_user(conn, username, password, mac_address, ip_address)
+            return False
+        elif data.startswith('LOGIN'):
+            # 新客户端在用户名和密码之后附加支持的协议版本，旧客户端只有三个字段
+            _, username, password, *version = data.split()
+            cursor = self.read_conn().cursor()
+            cursor.execute('SELECT mac_address, ip_address FROM users WHERE username = ? AND password = ?', 
+                           (username, password))
+            result = cursor.fetchone()
+            if result:
+                mac_address, ip_address = result
+                if self.login_user(conn, username, password, mac_address, ip_address):
+                    conn.username = username
+                    conn.client_protocol = int(version[0]) if version else 0
+                    conn.mac_address, conn.ip_address = mac_address, ip_address
+                    return True
+            else:
+                conn.sendall(aes_encrypt(b'LOGINFAILED'))
+            return False
+        elif data.startswith('DISCONNECT'):
+            _, username, mac_address, ip_address = data.split()
+            self.update_user_status((mac_address, ip_address), False)
+        return False
+
+    # 保存收到的截图并通知界面，img_hash 为接收时已经计算好的sha256
+    # captured_at 为客户端的截屏时刻，补传的帧按截屏时刻写入对应的分区；没有时使用接收时刻
+    def save_screenshot(self, conn, img_data, img_hash=None, encoding=None, captured_at=None):
+        received_at = time.time()
+        if captured_at is not None and 0 < captured_at < received_at + MAX_CLOCK_SKEW:
+            received_at = min(captured_at, received_at)  # 客户端时钟略快时不记录未来的时间
+        if img_hash is None:
+            img_hash = hashlib.sha256(img_data).hexdigest()
+
+        owner = self.store_owner(conn)
+        day = partitions.format_timestamp(received_at)[:10]  # 分段按截屏当天归档
+        start = time.perf_counter()
+        image_path = self.store.put(img_hash, img_data, owner=owner, day=day)
+        written = time.perf_counter()
+        self.metrics.observe('disk', written - start)
+        try:
+            self.store.put_thumbnail(img_hash, img_data, owner=owner, day=day)  # 实时监控墙只读取缩略图
+        except Exception as e:
+            print(f'Error creating thumbnail for {img_hash}: {e}')
+        self.metrics.observe('thumbnail', time.perf_counter() - written)
+
+        live = received_at >= conn.latest_frame_at
+        conn.latest_frame_at = max(conn.latest_frame_at, received_at)
+        self.record_screenshot(conn, received_at, image_path, img_hash, len(img_data), encoding, live)
+
+    # 分段存储中截图归属的分段组
+    def store_owner(self, conn):
+        return conn.mac_address
+
+    # 通知界面并把截图记录交给写入线程，live 为 False 的补传旧帧只写记录
+    def record_screenshot(self, conn, received_at, image_path, img_hash, size, encoding=None, live=True):
+        if live:
+            self.update_ui(img_hash, conn.address)
+        self.db_writer.submit(self.insert_screenshot, received_at, conn.mac_address, image_path, conn.ip_address,
+                              img_hash, size, encoding)
+
+    # 插入截图记录并增加引用计数，在写入线程的批量事务中执行
+    # 记录写入截图时间所在的分区，主库的 screenshots 表只保留分区之前的旧记录
+    def insert_screenshot(self, cursor, t, mac_address, image_path, ip_address, img_hash, size, encoding=None):
+        start = time.perf_counter()
+        self.partitions.insert(t, mac_address, image_path, ip_address, img_hash, encoding)
+        self.store.add_ref(cursor, img_hash, size)
+        self.metrics.observe('db', time.perf_counter() - start)
+
+    # 定期删除过期分区
+    def retention_loop(self):
+        while self.is_running:
+            try:
+                self.db_writer.call(self.expire_partitions)
+            except Exception as e:
+                print(f'Error expiring partitions: {e}')
+            time.sleep(partitions.RETENTION_CHECK_INTERVAL)
+
+    # 定期删除引用归零后因刚被使用而保留下来的图像
+    def sweep_loop(self):
+        while self.is_running:
+            time.sleep(RELEASE_GRACE)
+            try:
+                freed = self.db_writer.call(self.store.sweep)
+                if freed:
+                    print(f'Swept released images: {freed / 1024 / 1024:.1f} MB freed')
+            except Exception as e:
+                print(f'Error sweeping released images: {e}')
+
+    # 定期对旧截图降采样，编码在低优先级进程池中进行
+    def downsample_loop(self):
+        while self.is_running:
+            try:
+                self.downsampler.run_once(lambda: not self.is_running)
+            except Exception as e:
+                print(f'Error downsampling screenshots: {e}')
+            time.sleep(downsample.DOWNSAMPLE_INTERVAL)
+
+    # 删除早于保留天数的分区：先按分区内的引用次数释放图像，再整个删除分区文件
+    def expire_partitions(self, cursor):
+        cutoff = (datetime.datetime.now(datetime.timezone.utc).date()
+                  - datetime.timedelta(days=self.retention_days)).isoformat()
+        for key in self.partitions.expired(cutoff):
+            counts = self.partitions.hash_counts(key)
+            freed = sum(self.store.release(cursor, img_hash, count) for img_hash, count in counts)
+            self.partitions.drop(key, cursor)
+            print(f'Expired partition {key}: {sum(count for _, count in counts)} screenshots, '
+                  f'{freed / 1024 / 1024:.1f} MB freed')
+
+    # 处理一个二进制帧，截图保存后按需回复累积确认；差分帧先重建为完整画面
+    # 带 FLAG_META 的帧先拆出编码参数，随截图记录保存
+    def handle_frame(self, conn, msg_type, flags, client_id, seq, payload, img_hash=None):
+        if not conn.binary:
+            conn.binary = True
+            self.send_frequency(conn)  # 客户端支持新协议，补发带最短间隔的频率设置
+            if conn.pressure_level:
+                self.send_pressure(conn, force=True)  # 补发只有新协议客户端能理解的编码和补传限制
+        if msg_type == protocol.FRAME:
+            encoding = None
+            captured_at = None
+            if payload and flags & protocol.FLAG_TIMESTAMP:
+                captured_at, payload = protocol.split_timestamp(payload)
+                img_hash = None
+            if payload and flags & protocol.FLAG_META:
+                encoding, payload = protocol.split_meta(payload)
+                img_hash = None  # 接收时的摘要包含元数据，需要重新计算
+            if payload and flags & protocol.FLAG_DELTA:
+                try:
+                    start = time.perf_counter()
+                    payload = conn.delta_decoder.apply(payload)
+                    self.metrics.observe('delta', time.perf_counter() - start)
+                    img_hash = None
+                    if encoding:
+                        encoding += ' delta=1'  # 重建的画面由服务端重新编码为JPEG
+                except delta.MissingKeyframe as e:
+                    print(f'Requesting keyframe from {conn.address}: {e}')
+                    self.control.post(conn, 'KEYFRAME', key='KEYFRAME')
+                    payload = None
+            elif payload and not flags & protocol.FLAG_SPOOLED:
+                conn.delta_decoder.set_keyframe(payload)  # 补传的旧帧不能替换实时差分链的参考帧
+            if payload:
+                self.save_screenshot(conn, payload, img_hash, encoding, captured_at)
+            if flags & protocol.FLAG_ACK_REQUEST:
+                conn.sendall(protocol.pack_frame(protocol.ACK, client_id=client_id, seq=seq))
+
+    # 统计收到的一帧：负载接收耗时中扣除边收边做的解密和摘要耗时，剩下的是等待和读取网络数据的时间
+    def record_received(self, conn, length, elapsed, hasher, cipher=None):
+        decrypt = 0.0
+        if cipher is not None:
+            decrypt = cipher.take_decrypt_time()
+            self.metrics.observe('decrypt', decrypt)
+        self.metrics.observe('hash', hasher.elapsed)
+        self.metrics.observe('recv', max(elapsed - decrypt - hasher.elapsed, 0.0))
+        self.metrics.frame_received(length)
+        conn.frames += 1
+        conn.bytes_in += length
+
+    # 处理收到的一帧，记录排队和处理的耗时，用于判断服务器是否过载
+    def process(self, func, *args):
+        token = self.backpressure.begin()
+        try:
+            return func(*args)
+        finally:
+            self.backpressure.end(token)
+
+    # asyncio 模式：在线程池中处理，耗时包含在线程池中排队的时间
+    async def process_async(self, loop, func, *args):
+        token = self.backpressure.begin()
+        try:
+            return await loop.run_in_executor(None, func, *args)
+        finally:
+            self.backpressure.end(token)
+
+    # 连接结束时清理客户端信息
+    def finish_client(self, conn):
+        conn.closed = True
+        self.metrics.connection_closed(conn)
+        self.clients.pop(conn.address, None)
+        if conn.mac_address and conn.ip_address:
+            self.update_user_status((conn.mac_address, conn.ip_address), False)
+
+    # 处理客户端连接（线程模式）
     def handle_client(self, client_sock, client_address):
-        mac_address, ip_address = None, None
+        conn = ClientConnection(client_address, sock=client_sock)
         try:
             data = aes_decrypt(client_sock.recv(1024)).decode()
-            if data.startswith('REGISTER'):
-                _, username, password, mac_address, ip_address = data.split()
-                self.register_user(client_sock, username, password, mac_address, ip_address)
-            elif data.startswith('LOGIN'):
-                _, username, password = data.split()
-                cursor = self.db_conn.cursor()
-                cursor.execute('SELECT mac_address, ip_address FROM users WHERE username = ? AND password = ?', 
-                               (username, password))
-                result = cursor.fetchone()
-                if result:
-                    mac_address, ip_address = result
-                    self.login_user(client_sock, username, password, mac_address, ip_address)
-                else:
-                    client_sock.sendall(aes_encrypt(b'LOGINFAILED'))
-                    return
-            elif data.startswith('DISCONNECT'):
-                _, username, mac_address, ip_address = data.split()
-                self.update_user_status((mac_address, ip_address), False)
-                client_sock.close()
+            if not self.handle_handshake(conn, data):
                 return
 
-            self.clients[client_address] = client_sock
-            self.send_frequency(client_sock)
+            self.clients[client_address] = conn
+            self.metrics.count('connections')
+            self.send_welcome(conn)
 
             while self.is_running:
                 try:
+                    if conn.pressure_level >= backpressure.MAX_LEVEL:
+                        time.sleep(backpressure.SHED_DELAY)
+                    if protocol.peek_is_binary(client_sock):
+                        msg_type, flags, length, client_id, seq = protocol.recv_header(client_sock)
+                        start = time.perf_counter()
+                        hasher = metrics.TimedHasher()
+                        cipher = None
+                        if flags & protocol.FLAG_ENCRYPTED:
+                            cipher = self.session_cipher_for(conn)
+                            payload = cipher.recv_payload(client_sock, msg_type, flags, length, client_id, seq, hasher)
+                        else:
+                            payload = protocol.recv_payload(client_sock, length, hasher)
+                        self.record_received(conn, length, time.perf_counter() - start, hasher, cipher)
+                        self.process(self.handle_frame, conn, msg_type, flags, client_id, seq, payload,
+                                     hasher.hexdigest())
+                        continue
+
                     length_mesg = aes_decrypt(client_sock.recv(1024)).decode()
+                    if length_mesg.startswith('DISCONNECT'):
+                        break
                     if not length_mesg.isdigit():
                         raise ValueError(f"Invalid length message: {length_mesg}")
                     length_mesg = int(length_mesg)
-                    client_sock.sendall(aes_encrypt(b"ready"))
-                    img_data = b''
-                    len_recved = 0
-                    while len_recved < length_mesg:
-                        recved = client_sock.recv(4096)
-                        img_data += recved
-                        len_recved += len(recved)
-                    client_sock.sendall(aes_encrypt(b"finish"))
-
-                    img_hash = hashlib.sha256(img_data).hexdigest()
+                    conn.send_control("ready")
+                    start = time.perf_counter()
+                    hasher = metrics.TimedHasher()
+                    img_data = protocol.recv_payload(client_sock, length_mesg, hasher)
+                    self.record_received(conn, length_mesg, time.perf_counter() - start, hasher)
+                    conn.send_control("finish")
 
                     if not img_data:
                         break
 
-                    timestamp = time.strftime("%Y%m%d%H%M%S")
-                    image_path = os.path.join(SCREENSHOT_DIR, f"{timestamp}.jpg")
-                    with open(image_path, "wb") as img_file:
-                        img_file.write(img_data)
+                    self.process(self.save_screenshot, conn, img_data, hasher.hexdigest())
 
-                    self.update_ui(image_path, client_address)
-
-                    cursor = self.db_conn.cursor()
-                    cursor.execute('INSERT INTO screenshots (client_mac, image_path, ip_address) VALUES (?, ?, ?)',
-                                   (mac_address, image_path, ip_address))
-                    self.db_conn.commit()
-                    
                 except Exception as e:
                     print(f'Error receiving image from {client_address}: {e}')
+                    self.metrics.count('errors')
                     break
         except Exception as e:
             print(f'Error handling client {client_address}: {e}')
         finally:
             client_sock.close()
-            if mac_address and ip_address:
-                self.update_user_status((mac_address, ip_address), False)
-            del self.clients[client_address]
+            self.finish_client(conn)
+            self.release_connection()
+
+    # 处理客户端连接（asyncio模式），数据库和文件操作放到线程池中执行
+    async def handle_client_async(self, reader, writer):
+        client_address = writer.get_extra_info('peername')[:2]
+        if not self.acquire_connection():
+            print(f'Too many connections, rejecting {client_address}')
+            writer.close()
+            return
+        loop = asyncio.get_running_loop()
+        conn = ClientConnection(client_address, writer=writer, loop=loop)
+        try:
+            data = aes_decrypt(await reader.read(1024)).decode()
+            if not await loop.run_in_executor(None, self.handle_handshake, conn, data):
+                await writer.drain()
+                return
+
+            self.clients[client_address] = conn
+            self.metrics.count('connections')
+            self.send_welcome(conn)
+
+            while self.is_running:
+                try:
+                    if conn.pressure_level >= backpressure.MAX_LEVEL:
+                        await asyncio.sleep(backpressure.SHED_DELAY)
+                    first = await reader.readexactly(1)
+                    if protocol.is_binary(first):
+                        header = first + await reader.readexactly(protocol.HEADER_SIZE - 1)
+                        msg_type, flags, length, client_id, seq = protocol.unpack_header(header)
+                        start = time.perf_counter()
+                        hasher = metrics.TimedHasher()
+                        cipher = None
+                        if flags & protocol.FLAG_ENCRYPTED:
+                            cipher = self.session_cipher_for(conn)
+                            payload = await cipher.read_payload(reader, msg_type, flags, length, client_id, seq, hasher)
+                        else:
+                            payload = await protocol.read_payload(reader, length, hasher)
+                        self.record_received(conn, length, time.perf_counter() - start, hasher, cipher)
+                        await self.process_async(loop, self.handle_frame, conn, msg_type, flags,
+                                                 client_id, seq, payload, hasher.hexdigest())
+                        continue
+
+                    length_mesg = aes_decrypt(first + await reader.read(1023)).decode()
+                    if length_mesg.startswith('DISCONNECT'):
+                        break
+                    if not length_mesg.isdigit():
+                        raise ValueError(f"Invalid length message: {length_mesg}")
+                    writer.write(aes_encrypt(b"ready"))
+                    await writer.drain()
+                    start = time.perf_counter()
+                    hasher = metrics.TimedHasher()
+                    img_data = await protocol.read_payload(reader, int(length_mesg), hasher)
+                    self.record_received(conn, int(length_mesg), time.perf_counter() - start, hasher)
+                    writer.write(aes_encrypt(b"finish"))
+                    await writer.drain()
+
+                    if not img_data:
+                        break
+
+                    await self.process_async(loop, self.save_screenshot, conn, img_data, hasher.hexdigest())
+
+                except Exception as e:
+                    print(f'Error receiving image from {client_address}: {e}')
+                    self.metrics.count('errors')
+                    break
+        except Exception as e:
+            print(f'Error handling client {client_address}: {e}')
+        finally:
+            writer.close()
+            self.finish_client(conn)
+            self.release_connection()
 
     # 注册新用户
-    def register_user(self, client_sock, username, password, mac_address, ip_address):
+    def register_user(self, conn, username, password, mac_address, ip_address):
+        if self.add_user(username, password, mac_address, ip_address):
+            conn.sendall(aes_encrypt(b'REGISTERED'))
+        else:
+            conn.sendall(aes_encrypt(b'REGISTRATIONFAILED'))
+
+    # 写入用户，用户名已存在时返回 False
+    def add_user(self, username, password, mac_address, ip_address):
         try:
-            cursor = self.db_conn.cursor()
-            cursor.execute('INSERT INTO users (username, password, mac_address, ip_address) VALUES (?, ?, ?, ?)',
-                           (username, password, mac_address, ip_address))
-            self.db_conn.commit()
-            client_sock.sendall(aes_encrypt(b'REGISTERED'))
+            self.db_writer.execute('INSERT INTO users (username, password, mac_address, ip_address) VALUES (?, ?, ?, ?)',
+                                   (username, password, mac_address, ip_address))
+            return True
         except sqlite3.IntegrityError:
-            client_sock.sendall(aes_encrypt(b'REGISTRATIONFAILED'))
+            return False
 
     # 登录用户
-    def login_user(self, client_sock, username, password, mac_address, ip_address):
-        cursor = self.db_conn.cursor()
+    def login_user(self, conn, username, password, mac_address, ip_address):
+        cursor = self.read_conn().cursor()
         cursor.execute('SELECT * FROM users WHERE username = ? AND password = ? AND mac_address = ? AND ip_address = ?',
                        (username, password, mac_address, ip_address))
         user = cursor.fetchone()
         if user:
-            client_sock.sendall(aes_encrypt(b'LOGGEDIN'))
+            conn.sendall(aes_encrypt(b'LOGGEDIN'))
             self.update_user_status((mac_address, ip_address), True)
-        else:
-            client_sock.sendall(aes_encrypt(b'LOGINFAILED'))
+            return True
+        conn.sendall(aes_encrypt(b'LOGINFAILED'))
+        return False
 
-    # 更新用户状态
+    # 更新用户在线状态，下线时帧率归零
     def update_user_status(self, client_address, online):
-        self.user_status[client_address] = online
-        self.user_status_signal.emit(self.user_status)
+        self.update_client_status(client_address, {'online': online} if online else {'online': False, 'fps': 0.0})
+
+    # 合并客户端状态的变化并通知监听者，user_status 保存每个客户端的完整状态
+    def update_client_status(self, client_address, fields):
+        with self.status_lock:
+            self.user_status.setdefault(client_address, new_status()).update(fields)
+        for listener in self.listeners:
+            listener.client_status_changed(client_address, fields)
+
+    # 所有客户端状态的副本，[(客户端地址, 状态), ...]
+    def status_snapshot(self):
+        with self.status_lock:
+            return [(key, dict(status)) for key, status in self.user_status.items()]
+
+    # 定期统计每个连接的接收帧率和最新截屏时刻，只通知有变化的客户端
+    def status_loop(self):
+        sampled = {}  # 连接 -> (帧数, 帧率, 最新截屏时刻)
+        last = time.monotonic()
+        while self.is_running:
+            time.sleep(STATUS_INTERVAL)
+            now = time.monotonic()
+            elapsed, last = now - last, now
+            current = {}
+            for conn in self.connections():
+                if conn.mac_address is None or conn.closed:
+                    continue
+                frames = conn.frames
+                old_frames, old_fps, old_frame_at = sampled.get(conn, (frames, 0.0, 0.0))
+                fps = round((frames - old_frames) / elapsed, 2)
+                current[conn] = (frames, fps, conn.latest_frame_at)
+                fields = {}
+                if fps != old_fps:
+                    fields['fps'] = fps
+                if conn.latest_frame_at != old_frame_at:
+                    fields['last_frame'] = conn.latest_frame_at
+                if fields:
+                    self.update_client_status((conn.mac_address, conn.ip_address), fields)
+            sampled = current
 
     # 启动服务器
     def start(self):
         self.sock.bind((self.server_ip, self.server_port))
-        self.sock.listen(5)
-        print(f'Server listening on {self.server_ip}:{self.server_port}')
+        self.sock.listen(self.backlog)
+        print(f'Server listening on {self.server_ip}:{self.server_port} ({self.mode} mode)')
+        self.start_metrics_endpoint()
+        threading.Thread(target=self.backpressure_loop, daemon=True).start()
+        threading.Thread(target=self.status_loop, daemon=True).start()
+        if self.mode == 'asyncio':
+            asyncio.run(self.serve_async())
+        else:
+            self.serve_threaded()
+
+    # 线程模式：每个连接一个线程
+    def serve_threaded(self):
         while self.is_running:
-            client_sock, client_address = self.sock.accept()
-            threading.Thread(target=self.handle_client, args=(client_sock, client_address)).start()
+            try:
+                client_sock, client_address = self.sock.accept()
+            except OSError:
+                break
+            if not self.acquire_connection():
+                print(f'Too many connections, rejecting {client_address}')
+                client_sock.close()
+                continue
+            threading.Thread(target=self.handle_client, args=(client_sock, client_address), daemon=True).start()
+
+    # asyncio模式：所有连接在同一个事件循环中处理
+    async def serve_async(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.sock.setblocking(False)
+        server = await asyncio.start_server(self.handle_client_async, sock=self.sock, backlog=self.backlog)
+        async with server:
+            await self.stop_event.wait()
+
+    # 开启本机的指标端口（Prometheus 文本格式）
+    def start_metrics_endpoint(self):
+        if self.metrics_port:
+            self.metrics_endpoint = metrics.MetricsEndpoint(self.metrics_snapshot, self.metrics_port)
+            self.metrics_endpoint.start()
+
+    # 当前的运行指标快照
+    def metrics_snapshot(self):
+        snapshot = self.metrics.snapshot(self.connections())
+        snapshot['gauges']['db_queue'] = self.db_writer.queue.qsize()
+        snapshot['gauges']['inflight'] = self.backpressure.inflight_count()
+        snapshot['gauges']['backpressure_level'] = self.backpressure.level
+        return snapshot
+
+    # 除正在处理的帧以外的接收积压
+    def ingest_backlog(self):
+        return self.db_writer.queue.qsize()
+
+    # 定期检查是否过载，级别变化时在后台通知受影响的客户端
+    def backpressure_loop(self):
+        while self.is_running:
+            time.sleep(backpressure.CHECK_INTERVAL)
+            if self.backpressure.update(self.ingest_backlog()):
+                print(f'Backpressure level {self.backpressure.level} '
+                      f'(backlog {self.ingest_backlog()}, latency {self.backpressure.latency:.2f}s)')
+                self.pressure_changed()
+
+    def pressure_changed(self):
+        self.control.submit(self.push_pressure)
+
+    def push_pressure(self):
+        for conn in self.connections():
+            self.send_pressure(conn)
+
+    # 按连接适用的过载级别发送截屏间隔、编码档位和补传限制，级别没有变化时不发送
+    # 旧协议客户端只能延长截屏间隔；THROTTLE 大于0时新客户端暂停补传离线缓存
+    def send_pressure(self, conn, force=False):
+        level = self.backpressure.level_for(self.policies.is_important(conn.username))
+        if level == conn.pressure_level and not force:
+            return
+        conn.pressure_level = level
+        self.send_frequency(conn)
+        if conn.binary:
+            shrink = backpressure.LEVEL_ACTIONS[level][1]
+            hint = f'level={shrink}' if shrink else conn.encoding_hint or 'auto'
+            self.control.post(conn, f"SET_ENCODING {hint}", key='SET_ENCODING')
+            self.control.post(conn, f"THROTTLE {level}", key='THROTTLE')
 
     # 停止服务器
     def stop(self):
         self.is_running = False
-        self.sock.close()
+        if self.metrics_endpoint is not None:
+            self.metrics_endpoint.stop()
+            self.metrics_endpoint = None
+        if self.loop is not None and self.stop_event is not None:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+        else:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)  # 唤醒阻塞在 accept 中的线程，只关闭socket在Linux上不会返回
+            except OSError:
+                pass
+            self.sock.close()
+        self.close_database()
 
-    # 更新UI
-    def update_ui(self, image_path, client_address):
-        self.update_signal.emit(image_path, client_address)
+    # 通知监听者收到新截图，界面根据图像哈希读取缩略图
+    def update_ui(self, img_hash, client_address):
+        start = time.perf_counter()
+        for listener in self.listeners:
+            listener.frame_received(img_hash, client_address)
+        self.metrics.observe('ui', time.perf_counter() - start)
 
     # 获取截屏频率
     def get_frequency(self):
         return self.screenshot_interval
 
-    # 设置截屏频率
-    def set_frequency(self, new_frequency):
+    def get_min_interval(self):
+        return self.min_screenshot_interval
+
+    # 当前正在接收截图的连接；接收线程随时增删 clients，先复制再遍历
+    def connections(self):
+        return list(self.clients.copy().values())
+
+    # 设置全局默认截屏频率，min_interval 为画面变化时允许的最短间隔
+    # 以下设置方法只更新内存中的策略，写库和逐个通知客户端都在后台完成，可以在界面线程中调用
+    def set_frequency(self, new_frequency, min_interval=None):
         self.screenshot_interval = new_frequency
-        for client_sock in self.clients.values():
-            self.send_frequency(client_sock)
+        if min_interval is not None:
+            self.min_screenshot_interval = min_interval
+        self.policies.set_default(new_frequency, min_interval)
+        self.save_policy(policies.DEFAULT_SCOPE, '', self.screenshot_interval, self.min_screenshot_interval)
+        self.control.submit(self.push_frequency, policies.DEFAULT_SCOPE, '')
+
+    # 为一个 MAC 地址、用户或分组单独设置截屏频率，interval 为 None 时删除该策略，恢复上一级的设置
+    def set_policy(self, scope, target, interval, min_interval=None):
+        if scope not in policies.SCOPES:
+            raise ValueError(f'Unknown policy scope: {scope}')
+        self.policies.set(scope, target, interval, min_interval)
+        self.save_policy(scope, target, interval, min_interval)
+        self.control.submit(self.push_frequency, scope, target)
+
+    # 设置用户所属分组，group 为空时移出分组
+    def set_group(self, username, group):
+        self.policies.set_group(username, group or None)
+        self.save_group(username, group or None)
+        self.control.submit(self.push_frequency, 'user', username)
+
+    # 标记重要客户端，服务器过载时最后受到限制
+    def set_important(self, username, important):
+        self.policies.set_important(username, important)
+        self.save_important(username, important)
+        self.control.submit(self.push_pressure)
+
+    def save_policy(self, scope, target, interval, min_interval):
+        self.db_writer.submit(policies.save_policy, scope, target, interval, min_interval)
+
+    def save_group(self, username, group):
+        self.db_writer.submit(policies.save_group, username, group)
 
-    # 发送截屏频率给客户端
-    def send_frequency(self, client_sock):
-        message = f"SET_FREQUENCY {self.screenshot_interval}"
-        client_sock.sendall(aes_encrypt(message.encode()))
+    def save_important(self, username, important):
+        self.db_writer.submit(policies.save_important, username, important)
+
+    # 策略和分组的完整副本，供界面显示
+    def policies_snapshot(self):
+        return self.policies.snapshot()
+
+    # 向受某条策略影响的连接重新发送频率，在控制通道的发送线程中执行
+    def push_frequency(self, scope, target):
+        for conn in self.connections():
+            if self.policies.affects(scope, target, conn.username, conn.mac_address):
+                self.send_frequency(conn)
+
+    # 发送连接适用的截屏频率；未发出的旧频率消息被新消息替换
+    def send_frequency(self, conn):
+        self.control.post(conn, self.frequency_message(conn), key='SET_FREQUENCY')
+
+    # 连接适用的截屏频率，过载时按级别延长；旧客户端只能解析一个整数参数，声明了协议版本的客户端额外收到最短间隔
+    def frequency_message(self, conn):
+        interval, min_interval = self.policies.resolve(conn.username, conn.mac_address)
+        factor = backpressure.LEVEL_ACTIONS[conn.pressure_level][0]
+        interval, min_interval = interval * factor, min_interval * factor
+        if conn.client_protocol > 0:
+            return f"SET_FREQUENCY {interval} {min_interval}"
+        return f"SET_FREQUENCY {max(1, round(interval))}"
+
+    # 登录后在接收线程中按顺序直接发送截屏频率、协议版本和会话密钥，不经过控制通道
+    # 客户端收到会话密钥后开始发送二进制帧，之后到达的旧格式消息可能和确认帧粘连，所以频率必须排在前面
+    # 旧客户端每次 recv 只解密一条消息，连续的多条消息粘连后会解密失败，所以只有登录时声明了协议版本的客户端才收到协议版本和会话密钥
+    def send_welcome(self, conn):
+        conn.pressure_level = self.backpressure.level_for(self.policies.is_important(conn.username))
+        conn.send_control(self.frequency_message(conn))
+        if conn.client_protocol > 0:
+            self.send_protocol(conn)
+            self.send_session_key(conn)
+
+    # 向客户端推送编码提示，address 为 None 时在后台发给所有客户端；只有二进制协议的客户端能理解
+    # hint 为 "level=N"、"codec=webp quality=50 scale=0.5 gray=0" 或 "auto"，见 encoding.AdaptiveEncoder.apply_hint
+    def set_encoding(self, hint, address=None):
+        if address is None:
+            self.control.submit(self.push_encoding, hint)
+        else:
+            self.push_encoding(hint, address)
+
+    def push_encoding(self, hint, address=None):
+        conns = self.connections() if address is None else [self.clients.get(address)]
+        for conn in conns:
+            if conn is not None and conn.binary:
+                conn.encoding_hint = hint
+                self.control.post(conn, f"SET_ENCODING {hint}", key='SET_ENCODING')
+
+    # 生成本次会话的负载加密密钥并发给客户端；密钥本身通过加密的控制消息传输
+    def send_session_key(self, conn):
+        key = stream_cipher.new_session_key()
+        conn.session_cipher = stream_cipher.StreamCipher(key)
+        conn.send_control(f"SESSION_KEY {base64.b64encode(key).decode()}")
+
+    # 取得连接的会话密钥，没有协商密钥时不能接受加密帧
+    def session_cipher_for(self, conn):
+        if conn.session_cipher is None:
+            raise protocol.ProtocolError("Encrypted frame without a session key")
+        return conn.session_cipher
+
+    # 告知客户端双方都支持的二进制帧协议版本
+    def send_protocol(self, conn):
+        conn.send_control(f"PROTOCOL {min(conn.client_protocol, protocol.PROTOCOL_VERSION)}")
 
 # 主函数
 def main():
-    from server_gui import run_server_app
-    run_server_app(Server)
+    parser = argparse.ArgumentParser(description='屏幕监控服务器')
+    parser.add_argument('--mode', choices=['thread', 'asyncio'], default=SERVER_MODE, help='连接处理模式')
+    parser.add_argument('--backlog', type=int, default=LISTEN_BACKLOG, help='监听队列长度')
+    parser.add_argument('--max-connections', type=int, default=MAX_CONNECTIONS, help='最大同时连接数')
+    parser.add_argument('--storage', choices=['files', 'pack'], default=STORAGE_ENGINE, help='截图存储方式')
+    parser.add_argument('--retention-days', type=int, default=partitions.RETENTION_DAYS,
+                        help='截图记录保留天数，0 表示不删除')
+    parser.add_argument('--downsample', action='store_true', help='定期对旧截图降采样')
+    parser.add_argument('--headless', action='store_true', help='不启动界面，用多个工作进程接收截图')
+    parser.add_argument('--workers', type=int, default=HEADLESS_WORKERS, help='无界面模式的工作进程数')
+    parser.add_argument('--monitor-port', type=int, default=MONITOR_PORT, help='无界面模式供界面连接的本机端口')
+    parser.add_argument('--attach', metavar='HOST:PORT', help='界面连接到已运行的无界面服务')
+    parser.add_argument('--metrics-port', type=int, default=0, help='本机指标端口（Prometheus 文本格式），0 表示不开启')
+    args, _ = parser.parse_known_args()
+
+    if args.headless:
+        from ingest_daemon import run_daemon
+        run_daemon(workers=args.workers, monitor_port=args.monitor_port, mode=args.mode, backlog=args.backlog,
+                   max_connections=args.max_connections, storage=args.storage,
+                   retention_days=args.retention_days, enable_downsample=args.downsample, metrics_port=args.metrics_port)
+        return
+
+    from server_gui import run_server_app, RemoteServer
+    if args.attach:
+        host, port = args.attach.rsplit(':', 1)
+        run_server_app(functools.partial(RemoteServer, host, int(port)))
+        return
+    run_server_app(functools.partial(Server, mode=args.mode, backlog=args.backlog,
+                                     max_connections=args.max_connections, storage=args.storage,
+                                     retention_days=args.retention_days, enable_downsample=args.downsample,
+                                     metrics_port=args.metrics_port))
 
 # 程序入口
 if __name__ == '__main__':
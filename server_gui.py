@@ -2,17 +2,38 @@
 
 import os
 import sys
+import json
+import socket
 import threading
+from collections import OrderedDict
 from PyQt5 import QtWidgets, QtGui, QtCore
 import sqlite3
 import time
+import database
+import partitions
+import storage
+import metrics
+import policies
+from packstore import PackStore
+
+THUMBNAIL_CACHE_SIZE = 256  # 缩放后图片的LRU缓存条数
+IMAGE_LOADER_THREADS = 4  # 解码图片的后台线程数
+UI_FPS = 10  # 监控墙的最大刷新帧率
+TILE_SIZE = (320, 210)  # 监控墙中每个客户端图块的大小
+PREFETCH_FRAMES = 30  # 历史回放时当前帧前后各预取的帧数
+PLAYBACK_THREADS = 4  # 历史回放的解码线程数
+PLAYBACK_SPEEDS = (1, 2, 5, 10, 15, 25, 30)  # 历史回放速度，每秒帧数
+PLAYBACK_DEFAULT_SPEED = 10
+STATS_REFRESH_INTERVAL = 2000  # 状态栏运行指标的刷新间隔，单位为毫秒
+STATUS_DEFAULTS = {'online': False, 'last_frame': None, 'fps': 0.0}  # 客户端状态的默认值，与 server.new_status 相同
 
 # 频率设置对话框类
 class FrequencyDialog(QtWidgets.QDialog):
-    def __init__(self, current_frequency, parent=None):
+    def __init__(self, current_frequency, min_interval=None, parent=None):
         super().__init__(parent)
         self.setWindowTitle("设置截屏速率")  # 设置对话框标题
         self.current_frequency = current_frequency  # 当前截屏速率
+        self.min_interval = min_interval  # 画面变化时的最短截屏间隔
         self.init_ui()  # 初始化UI界面
 
     def init_ui(self):
@@ -25,6 +46,13 @@ class FrequencyDialog(QtWidgets.QDialog):
         self.input.setPlaceholderText("输入新的截屏速率 (秒)")  # 提示输入新的截屏速率
         layout.addWidget(self.input)
 
+        self.min_label = QtWidgets.QLabel(f"画面变化时最短间隔: {self.min_interval} 秒", self)
+        layout.addWidget(self.min_label)
+
+        self.min_input = QtWidgets.QLineEdit(self)
+        self.min_input.setPlaceholderText("输入最短间隔 (秒)，留空则不修改")
+        layout.addWidget(self.min_input)
+
         self.button = QtWidgets.QPushButton("应用", self)
         self.button.clicked.connect(self.apply_frequency)  # 按钮点击事件绑定
         layout.addWidget(self.button)
@@ -34,7 +62,16 @@ class FrequencyDialog(QtWidgets.QDialog):
     def apply_frequency(self):
         try:
             new_frequency = float(self.input.text())  # 获取输入的新截屏速率
+            min_text = self.min_input.text().strip()
+            new_min_interval = float(min_text) if min_text else self.min_interval
+            if new_frequency <= 0 or (new_min_interval is not None and new_min_interval <= 0):
+                QtWidgets.QMessageBox.warning(self, "输入错误", "截屏速率和最短间隔必须大于0")
+                return
+            if new_min_interval is not None and new_min_interval > new_frequency:
+                QtWidgets.QMessageBox.warning(self, "输入错误", "最短间隔不能大于截屏速率")
+                return
             self.current_frequency = new_frequency
+            self.min_interval = new_min_interval
             self.accept()  # 接受并关闭对话框
         except ValueError:
             QtWidgets.QMessageBox.warning(self, "输入错误", "请输入有效的数字")  # 提示输入错误
@@ -42,11 +79,361 @@ class FrequencyDialog(QtWidgets.QDialog):
     def get_frequency(self):
         return self.current_frequency  # 返回当前截屏速率
 
+    def get_min_interval(self):
+        return self.min_interval
+
+# 截屏间隔策略对话框：按 MAC 地址、用户或分组单独设置截屏间隔，以及设置用户所属分组
+# 修改立即交给服务器，服务器在后台写库并通知受影响的客户端
+class PolicyDialog(QtWidgets.QDialog):
+    SCOPE_NAMES = {'mac': 'MAC地址', 'user': '用户', 'group': '分组'}
+
+    def __init__(self, server, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("截屏策略")
+        self.server = server
+        self.init_ui()
+        self.refresh()
+
+    def init_ui(self):
+        layout = QtWidgets.QVBoxLayout()
+
+        self.default_label = QtWidgets.QLabel(self)
+        layout.addWidget(self.default_label)
+
+        # 已有策略，点击一行填入下方的编辑区
+        self.policy_table = QtWidgets.QTableWidget(0, 4, self)
+        self.policy_table.setHorizontalHeaderLabels(['范围', '目标', '截屏间隔', '最短间隔'])
+        self.policy_table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.policy_table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.policy_table.cellClicked.connect(self.on_policy_clicked)
+        layout.addWidget(self.policy_table)
+
+        editor = QtWidgets.QHBoxLayout()
+        self.scope_combo = QtWidgets.QComboBox(self)
+        for scope in policies.SCOPES:
+            self.scope_combo.addItem(self.SCOPE_NAMES[scope], scope)
+        editor.addWidget(self.scope_combo)
+        self.target_input = QtWidgets.QLineEdit(self)
+        self.target_input.setPlaceholderText("MAC地址 / 用户名 / 分组名")
+        editor.addWidget(self.target_input)
+        self.interval_input = QtWidgets.QLineEdit(self)
+        self.interval_input.setPlaceholderText("截屏间隔 (秒)")
+        editor.addWidget(self.interval_input)
+        self.min_input = QtWidgets.QLineEdit(self)
+        self.min_input.setPlaceholderText("最短间隔 (秒)，可留空")
+        editor.addWidget(self.min_input)
+        layout.addLayout(editor)
+
+        buttons = QtWidgets.QHBoxLayout()
+        self.save_button = QtWidgets.QPushButton("保存策略", self)
+        self.save_button.clicked.connect(self.save_policy)
+        buttons.addWidget(self.save_button)
+        self.remove_button = QtWidgets.QPushButton("删除策略", self)
+        self.remove_button.clicked.connect(self.remove_policy)
+        buttons.addWidget(self.remove_button)
+        layout.addLayout(buttons)
+
+        # 用户分组和重要客户端
+        group_layout = QtWidgets.QHBoxLayout()
+        self.username_input = QtWidgets.QLineEdit(self)
+        self.username_input.setPlaceholderText("用户名")
+        self.username_input.editingFinished.connect(self.on_username_edited)
+        group_layout.addWidget(self.username_input)
+        self.group_input = QtWidgets.QLineEdit(self)
+        self.group_input.setPlaceholderText("分组名，留空则移出分组")
+        group_layout.addWidget(self.group_input)
+        self.important_check = QtWidgets.QCheckBox("重要客户端", self)
+        self.important_check.setToolTip("服务器过载时最后降低该用户的截屏频率和画质")
+        group_layout.addWidget(self.important_check)
+        self.group_button = QtWidgets.QPushButton("设置用户", self)
+        self.group_button.clicked.connect(self.save_user)
+        group_layout.addWidget(self.group_button)
+        layout.addLayout(group_layout)
+
+        self.setLayout(layout)
+        self.resize(640, 420)
+
+    def refresh(self):
+        snapshot = self.server.policies_snapshot()
+        interval, min_interval = snapshot['default']
+        self.default_label.setText(f"默认截屏间隔: {interval} 秒，最短间隔: {min_interval} 秒；"
+                                   f"已分组用户 {len(snapshot['groups'])} 个，重要客户端 {len(snapshot['important'])} 个")
+        self.snapshot = snapshot
+        rows = snapshot['policies']
+        self.policy_table.setRowCount(len(rows))
+        for row, (scope, target, interval, min_interval) in enumerate(rows):
+            values = [self.SCOPE_NAMES.get(scope, scope), target, str(interval),
+                      '' if min_interval is None else str(min_interval)]
+            for column, value in enumerate(values):
+                item = QtWidgets.QTableWidgetItem(value)
+                item.setData(QtCore.Qt.UserRole, scope)
+                self.policy_table.setItem(row, column, item)
+
+    def on_policy_clicked(self, row, column):
+        scope = self.policy_table.item(row, 0).data(QtCore.Qt.UserRole)
+        self.scope_combo.setCurrentIndex(self.scope_combo.findData(scope))
+        self.target_input.setText(self.policy_table.item(row, 1).text())
+        self.interval_input.setText(self.policy_table.item(row, 2).text())
+        self.min_input.setText(self.policy_table.item(row, 3).text())
+
+    def save_policy(self):
+        target = self.target_input.text().strip()
+        try:
+            interval = float(self.interval_input.text())
+            min_text = self.min_input.text().strip()
+            min_interval = float(min_text) if min_text else None
+        except ValueError:
+            QtWidgets.QMessageBox.warning(self, "输入错误", "请输入有效的数字")
+            return
+        if not target or interval <= 0:
+            QtWidgets.QMessageBox.warning(self, "输入错误", "请输入目标和大于0的截屏间隔")
+            return
+        if min_interval is not None and not 0 < min_interval <= interval:
+            QtWidgets.QMessageBox.warning(self, "输入错误", "最短间隔必须大于0且不大于截屏间隔")
+            return
+        self.server.set_policy(self.scope_combo.currentData(), target, interval, min_interval)
+        self.refresh()
+
+    def remove_policy(self):
+        target = self.target_input.text().strip()
+        if target:
+            self.server.set_policy(self.scope_combo.currentData(), target, None)
+            self.refresh()
+
+    # 输入用户名后显示该用户当前的分组和是否重要
+    def on_username_edited(self):
+        username = self.username_input.text().strip()
+        self.group_input.setText(self.snapshot['groups'].get(username, ''))
+        self.important_check.setChecked(username in self.snapshot['important'])
+
+    def save_user(self):
+        username = self.username_input.text().strip()
+        if not username:
+            return
+        group = self.group_input.text().strip() or None
+        if group != self.snapshot['groups'].get(username):
+            self.server.set_group(username, group)
+        important = self.important_check.isChecked()
+        if important != (username in self.snapshot['important']):
+            self.server.set_important(username, important)
+        self.refresh()
+
+# 历史查询任务的信号，任务在线程池中执行，结果通过信号回到GUI线程
+class QuerySignals(QtCore.QObject):
+    finished = QtCore.pyqtSignal(int, list)
+    failed = QtCore.pyqtSignal(int, str)
+
+# 在线程池中查询一页历史记录，每个任务使用独立的只读连接
+class QueryTask(QtCore.QRunnable):
+    def __init__(self, db_path, filters, after, generation):
+        super().__init__()
+        self.db_path = db_path
+        self.filters = filters
+        self.after = after
+        self.generation = generation
+        self.signals = QuerySignals()
+        self.setAutoDelete(False)  # 由模型持有引用，避免线程池提前释放
+
+    def run(self):
+        try:
+            rows = partitions.query_history(self.db_path, self.filters, self.after)  # 只查询与时间范围有交集的分区
+            self.signals.finished.emit(self.generation, rows)
+        except Exception as e:
+            self.signals.failed.emit(self.generation, str(e))
+
+# 历史截图列表模型，按需分页加载，只有滚动到底部时才查询下一页
+class HistoryModel(QtCore.QAbstractListModel):
+    HashRole = QtCore.Qt.UserRole
+    PathRole = QtCore.Qt.UserRole + 1
+    first_page_loaded = QtCore.pyqtSignal(int)
+    query_failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, db_path, filters, parent=None):
+        super().__init__(parent)
+        self.db_path = db_path
+        self.filters = filters
+        self.rows = []
+        self.has_more = True
+        self.task = None  # 正在执行的查询任务
+        self.generation = 0  # 模型失效后丢弃迟到的查询结果
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        _, timestamp, mac_address, ip_address, image_path, image_hash = self.rows[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return f"Time: {timestamp}\nMAC: {mac_address}\nIP: {ip_address}\nImage: {image_hash or image_path}"
+        if role == self.HashRole:
+            return image_hash
+        if role == self.PathRole:
+            return image_path
+        return None
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        return not parent.isValid() and self.has_more and self.task is None
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        after = (self.rows[-1][1], self.rows[-1][0]) if self.rows else None
+        self.task = QueryTask(self.db_path, self.filters, after, self.generation)
+        self.task.signals.finished.connect(self.on_page_loaded)
+        self.task.signals.failed.connect(self.on_query_failed)
+        QtCore.QThreadPool.globalInstance().start(self.task)
+
+    def on_page_loaded(self, generation, rows):
+        if generation != self.generation:
+            return
+        self.task = None
+        first_page = not self.rows
+        self.has_more = len(rows) >= database.PAGE_SIZE
+        if rows:
+            self.beginInsertRows(QtCore.QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+        if first_page:
+            self.first_page_loaded.emit(len(rows))
+
+    def on_query_failed(self, generation, message):
+        if generation != self.generation:
+            return
+        self.task = None
+        self.has_more = False
+        self.query_failed.emit(message)
+
+    # 丢弃模型，正在执行的查询结果不再使用
+    def invalidate(self):
+        self.generation += 1
+        self.has_more = False
+
+# 回放帧解码任务：按目标尺寸缩小解码，JPEG 由解码器直接按比例缩小，不需要先解码完整画面
+# 开始解码前先确认该帧仍在预取窗口内，快速拖动时排队的旧任务直接跳过
+class FrameDecodeTask(QtCore.QRunnable):
+    def __init__(self, prefetcher, generation, index, path, size):
+        super().__init__()
+        self.prefetcher = prefetcher
+        self.generation = generation
+        self.index = index
+        self.path = path
+        self.size = size
+        self.skipped = False
+        self.signals = ImageLoadSignals()
+        self.setAutoDelete(False)
+
+    def run(self):
+        image = QtGui.QImage()
+        if not self.prefetcher.wanted(self.generation, self.index):
+            self.skipped = True
+        else:
+            data = self.prefetcher.store.read(self.path)
+            if data is not None:
+                buffer = QtCore.QBuffer()
+                buffer.setData(bytes(data))
+                reader = QtGui.QImageReader(buffer)
+                original = reader.size()
+                if original.isValid():
+                    reader.setScaledSize(original.scaled(self.size, QtCore.Qt.KeepAspectRatio))
+                image = reader.read()
+        self.signals.loaded.emit(self, image)
+
+# 历史回放预取器：在后台线程中解码当前帧前后各 N 帧，解码结果只保留窗口内的帧，窗口随播放位置滑动
+class FramePrefetcher(QtCore.QObject):
+    frame_ready = QtCore.pyqtSignal(int)
+
+    def __init__(self, store, radius=PREFETCH_FRAMES, max_threads=PLAYBACK_THREADS, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.radius = radius
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.paths = []
+        self.size = QtCore.QSize()
+        self.position = 0
+        self.direction = 1  # 播放方向，预取时优先解码前进方向的帧
+        self.generation = 0  # 帧列表或尺寸变化后丢弃迟到的解码结果
+        self.frames = {}  # 帧序号 -> 缩放后的QImage，解码失败时为空图像
+        self.pending = {}  # 帧序号 -> 正在解码的任务
+
+    # 换一组帧，清空缓冲区
+    def reset(self, paths, size):
+        self.paths = list(paths)
+        self.size = QtCore.QSize(size)
+        self.invalidate()
+
+    # 追加帧（历史列表加载了下一页）
+    def extend(self, paths):
+        self.paths.extend(paths)
+        self.fill()
+
+    # 显示区域大小变化后按新尺寸重新解码
+    def resize(self, size):
+        if size != self.size:
+            self.size = QtCore.QSize(size)
+            self.invalidate()
+            self.fill()
+
+    def invalidate(self):
+        self.generation += 1
+        self.pool.clear()
+        self.frames.clear()
+        self.pending.clear()
+
+    # 在解码线程中调用
+    def wanted(self, generation, index):
+        return generation == self.generation and abs(index - self.position) <= self.radius
+
+    def frame(self, index):
+        return self.frames.get(index)
+
+    # 移动到指定帧，丢弃窗口外的帧并预取窗口内缺少的帧
+    def seek(self, index, direction=1):
+        self.position = index
+        self.direction = direction
+        for stale in [i for i in self.frames if abs(i - index) > self.radius]:
+            del self.frames[stale]
+        for stale in [i for i in self.pending if abs(i - index) > self.radius]:
+            del self.pending[stale]
+        self.fill()
+
+    # 按距离当前帧由近到远提交解码任务，同样距离时播放方向优先
+    def fill(self):
+        for offset in range(self.radius + 1):
+            for index in (self.position + offset * self.direction, self.position - offset * self.direction):
+                if 0 <= index < len(self.paths) and index not in self.frames and index not in self.pending:
+                    task = FrameDecodeTask(self, self.generation, index, self.paths[index], self.size)
+                    task.signals.loaded.connect(self.on_loaded)
+                    self.pending[index] = task
+                    self.pool.start(task, self.radius - offset)
+
+    def on_loaded(self, task, image):
+        if self.pending.get(task.index) is not task:
+            return
+        del self.pending[task.index]
+        if task.skipped:
+            return
+        if image.isNull():
+            print(f"Failed to load image: {task.path}")
+        self.frames[task.index] = image
+        self.frame_ready.emit(task.index)
+
 # 显示截屏图片和用户信息的对话框类
+# 点击列表中的截图后，按该客户端的截图生成时间线，可以拖动滑块或按设定速度回放
 class ShowDialog(QtWidgets.QDialog):
-    def __init__(self, db_conn, parent=None):
+    def __init__(self, db_path, store, parent=None):
         super().__init__(parent, QtCore.Qt.WindowMinimizeButtonHint | QtCore.Qt.WindowMaximizeButtonHint | QtCore.Qt.WindowCloseButtonHint)
-        self.db_conn = db_conn  # 数据库连接
+        self.db_path = db_path  # 查询在后台线程中使用各自的只读连接
+        self.model = None
+        self.store = store  # 截图存储，根据哈希解析图片路径
+        self.prefetcher = FramePrefetcher(store, parent=self)
+        self.prefetcher.frame_ready.connect(self.on_frame_ready)
+        self.timeline = []  # 当前回放客户端的历史记录
+        self.timeline_mac = None
+        self.position = -1  # 当前显示的帧
+        self.play_timer = QtCore.QTimer(self)
+        self.play_timer.timeout.connect(self.play_next)
         self.setWindowTitle("显示截屏图片和用户信息")  # 设置对话框标题
         self.is_fullscreen = False  # 初始化全屏状态
         self.init_ui()  # 初始化UI界面
@@ -62,6 +449,27 @@ class ShowDialog(QtWidgets.QDialog):
         self.image_display.setAlignment(QtCore.Qt.AlignCenter)  # 居中显示
         image_layout.addWidget(self.image_display)
 
+        # 时间线：播放/暂停、滑块、速度和当前帧时间
+        timeline_layout = QtWidgets.QHBoxLayout()
+        self.play_button = QtWidgets.QPushButton("播放", self)
+        self.play_button.setEnabled(False)
+        self.play_button.clicked.connect(self.toggle_playback)
+        timeline_layout.addWidget(self.play_button)
+        self.timeline_slider = QtWidgets.QSlider(QtCore.Qt.Horizontal, self)
+        self.timeline_slider.setEnabled(False)
+        self.timeline_slider.valueChanged.connect(self.on_slider_moved)
+        timeline_layout.addWidget(self.timeline_slider, 1)
+        self.speed_combo = QtWidgets.QComboBox(self)
+        for fps in PLAYBACK_SPEEDS:
+            self.speed_combo.addItem(f"{fps} 帧/秒", fps)
+        self.speed_combo.setCurrentIndex(PLAYBACK_SPEEDS.index(PLAYBACK_DEFAULT_SPEED))
+        self.speed_combo.currentIndexChanged.connect(self.on_speed_changed)
+        timeline_layout.addWidget(self.speed_combo)
+        self.time_label = QtWidgets.QLabel(self)
+        timeline_layout.addWidget(self.time_label)
+        image_layout.addLayout(timeline_layout)
+        self.on_speed_changed()
+
         main_layout.addLayout(image_layout, 2)
 
         # 右边栏详细信息
@@ -91,7 +499,9 @@ class ShowDialog(QtWidgets.QDialog):
         self.show_button.clicked.connect(self.show_data)  # 按钮点击事件绑定
         details_layout.addWidget(self.show_button)
 
-        self.details_list = QtWidgets.QListWidget(self)
+        self.details_list = QtWidgets.QListView(self)
+        self.details_list.setUniformItemSizes(True)
+        self.details_list.clicked.connect(self.display_image)
         details_layout.addWidget(self.details_list)
 
         main_layout.addLayout(details_layout, 1)
@@ -111,63 +521,116 @@ class ShowDialog(QtWidgets.QDialog):
             QtWidgets.QMessageBox.warning(self, "输入错误", "请至少提供一个查询条件")  # 提示输入错误
             return
 
-        try:
-            cursor = self.db_conn.cursor()
-            query = '''
-                SELECT timestamp, client_mac, ip_address, image_path
-                FROM screenshots
-                WHERE 1=1
-            '''
-            params = []
-
-            if start_time and end_time:
-                query += ' AND timestamp BETWEEN ? AND ?'
-                params.extend([start_time, end_time])
-
-            if ip_address:
-                query += ' AND ip_address = ?'
-                params.append(ip_address)
-
-            if mac_address:
-                query += ' AND client_mac = ?'
-                params.append(mac_address)
-
-            query += ' ORDER BY timestamp ASC'
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
-
-            self.details_list.clear()
-            self.image_display.clear()
-
-            print(f"Fetched {len(rows)} rows from database")
-
-            for row in rows:
-                timestamp, mac_address, ip_address, image_path = row
-                item_text = f"Time: {timestamp}\nMAC: {mac_address}\nIP: {ip_address}\nImage Path: {image_path}"
-                list_item = QtWidgets.QListWidgetItem(item_text)
-                list_item.setData(QtCore.Qt.UserRole, image_path)
-                self.details_list.addItem(list_item)
-
-            if rows:
-                self.details_list.itemClicked.connect(self.display_image)
-            else:
-                QtWidgets.QMessageBox.information(self, "无数据", "没有找到符合条件的截图")
+        if self.model is not None:
+            self.model.invalidate()
+        self.image_display.clear()
+        self.stop_playback()
+        self.set_timeline([], None)
 
-        except Exception as e:
-            QtWidgets.QMessageBox.critical(self, "查询错误", f"查询数据库时出错: {e}")
-
-    def display_image(self, item):
-        image_path = item.data(QtCore.Qt.UserRole)
-        print(f"Displaying image from path: {image_path}")  # 打印图片路径以确认正确性
-        if os.path.exists(image_path):  # 确认图片路径存在
-            pixmap = QtGui.QPixmap(image_path)
-            if not pixmap.isNull():
-                self.image_display.setPixmap(pixmap.scaled(
-                    self.image_display.size(), QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation))
-            else:
-                QtWidgets.QMessageBox.warning(self, "显示错误", f"无法显示图片: {image_path}")
+        self.model = HistoryModel(self.db_path, (start_time, end_time, ip_address, mac_address), self)
+        self.model.rowsInserted.connect(self.on_rows_inserted)
+        self.model.first_page_loaded.connect(self.on_first_page)
+        self.model.query_failed.connect(self.on_query_failed)
+        self.details_list.setModel(self.model)
+        self.model.fetchMore()
+
+    def on_first_page(self, count):
+        print(f"Fetched {count} rows from database")
+        if count == 0:
+            QtWidgets.QMessageBox.information(self, "无数据", "没有找到符合条件的截图")
+
+    def on_query_failed(self, message):
+        QtWidgets.QMessageBox.critical(self, "查询错误", f"查询数据库时出错: {message}")
+
+    # 点击列表中的截图：以该截图所属客户端的全部已加载记录作为时间线，并跳到这一帧
+    def display_image(self, index):
+        row = self.model.rows[index.row()]
+        if row[2] != self.timeline_mac:
+            self.set_timeline([r for r in self.model.rows if r[2] == row[2]], row[2])
+        self.show_frame(self.timeline.index(row))
+
+    def set_timeline(self, rows, mac_address):
+        self.timeline = rows
+        self.timeline_mac = mac_address
+        self.position = -1
+        self.prefetcher.reset([self.store.resolve(r[5], r[4]) for r in rows], self.image_display.size())
+        self.timeline_slider.blockSignals(True)
+        self.timeline_slider.setRange(0, max(0, len(rows) - 1))
+        self.timeline_slider.blockSignals(False)
+        self.timeline_slider.setEnabled(bool(rows))
+        self.play_button.setEnabled(bool(rows))
+
+    # 历史列表加载了下一页，把当前客户端的新记录接到时间线末尾
+    def on_rows_inserted(self, parent, first, last):
+        rows = [r for r in self.model.rows[first:last + 1] if r[2] == self.timeline_mac]
+        if self.timeline_mac is None or not rows:
+            return
+        self.timeline.extend(rows)
+        self.prefetcher.extend([self.store.resolve(r[5], r[4]) for r in rows])
+        self.timeline_slider.blockSignals(True)
+        self.timeline_slider.setMaximum(len(self.timeline) - 1)
+        self.timeline_slider.blockSignals(False)
+
+    # 跳到指定帧；帧已解码时立即显示，否则等待解码完成后由 on_frame_ready 显示
+    def show_frame(self, position, direction=1):
+        self.position = position
+        self.timeline_slider.blockSignals(True)
+        self.timeline_slider.setValue(position)
+        self.timeline_slider.blockSignals(False)
+        self.time_label.setText(str(self.timeline[position][1]))
+        self.prefetcher.seek(position, direction)
+        self.render_frame()
+        # 接近已加载记录的末尾时提前查询下一页
+        if len(self.timeline) - position <= PREFETCH_FRAMES and self.model is not None and self.model.canFetchMore():
+            self.model.fetchMore()
+
+    def render_frame(self):
+        image = self.prefetcher.frame(self.position)
+        if image is None:
+            return
+        if image.isNull():
+            self.image_display.setText(f"无法显示图片: {self.prefetcher.paths[self.position]}")
         else:
-            QtWidgets.QMessageBox.warning(self, "路径错误", f"图片路径不存在: {image_path}")
+            self.image_display.setPixmap(QtGui.QPixmap.fromImage(image))
+
+    def on_frame_ready(self, index):
+        if index == self.position:
+            self.render_frame()
+
+    def on_slider_moved(self, value):
+        if self.timeline:
+            self.show_frame(value, 1 if value >= self.position else -1)
+
+    def on_speed_changed(self):
+        self.play_timer.setInterval(int(1000 / self.speed_combo.currentData()))
+
+    def toggle_playback(self):
+        if self.play_timer.isActive():
+            self.stop_playback()
+        elif self.timeline:
+            self.play_timer.start()
+            self.play_button.setText("暂停")
+
+    def stop_playback(self):
+        self.play_timer.stop()
+        self.play_button.setText("播放")
+
+    # 播放下一帧；下一帧还没有解码完成时本次跳过，不让画面时快时慢
+    def play_next(self):
+        next_position = self.position + 1
+        if next_position >= len(self.timeline):
+            if self.model is None or not (self.model.has_more or self.model.task is not None):
+                self.stop_playback()
+            return
+        if self.prefetcher.frame(next_position) is None:
+            return
+        self.show_frame(next_position)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.timeline:
+            self.prefetcher.resize(self.image_display.size())
+            self.prefetcher.seek(max(self.position, 0))
 
     def toggle_fullscreen(self):
         if self.is_fullscreen:
@@ -176,11 +639,288 @@ class ShowDialog(QtWidgets.QDialog):
             self.showFullScreen()
         self.is_fullscreen = not self.is_fullscreen
 
+# 图片解码任务的信号
+class ImageLoadSignals(QtCore.QObject):
+    loaded = QtCore.pyqtSignal(object, QtGui.QImage)
+
+# 在后台线程中解码并缩放图片；QImage可以在非GUI线程中使用，QPixmap只能在GUI线程中创建
+# 图片数据通过存储的 read 读取，文件存储和分段存储都适用
+class ImageLoadTask(QtCore.QRunnable):
+    def __init__(self, key, path, size, store):
+        super().__init__()
+        self.key = key
+        self.path = path
+        self.size = size
+        self.store = store
+        self.signals = ImageLoadSignals()
+        self.setAutoDelete(False)
+
+    def run(self):
+        data = self.store.read(self.path)
+        image = QtGui.QImage.fromData(bytes(data)) if data is not None else QtGui.QImage()
+        if not image.isNull():
+            image = image.scaled(self.size, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+        self.signals.loaded.emit(self.key, image)
+
+# 图片加载器：后台解码 + 按 (路径, 尺寸) 缓存缩放后的QPixmap
+class ImageLoader(QtCore.QObject):
+    def __init__(self, store, cache_size=THUMBNAIL_CACHE_SIZE, max_threads=IMAGE_LOADER_THREADS, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.tasks = {}  # 正在解码的任务
+        self.callbacks = {}  # 每个任务完成后要通知的回调
+
+    # 查询缓存，不触发加载
+    def cached(self, path, size):
+        return self.cache.get((path, size.width(), size.height()))
+
+    # 请求一张缩放到 size 的图片；已缓存时立即回调，否则解码完成后在GUI线程中回调 callback(pixmap)
+    def request(self, path, size, callback):
+        key = (path, size.width(), size.height())
+        pixmap = self.cache.get(key)
+        if pixmap is not None:
+            self.cache.move_to_end(key)
+            callback(pixmap)
+            return
+        self.callbacks.setdefault(key, []).append(callback)
+        if key not in self.tasks:
+            task = ImageLoadTask(key, path, QtCore.QSize(size), self.store)
+            task.signals.loaded.connect(self.on_loaded)
+            self.tasks[key] = task
+            self.pool.start(task)
+
+    def on_loaded(self, key, image):
+        self.tasks.pop(key, None)
+        callbacks = self.callbacks.pop(key, [])
+        if image.isNull():
+            print(f"Failed to load image: {key[0]}")
+            return
+        pixmap = QtGui.QPixmap.fromImage(image)
+        self.cache[key] = pixmap
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        for callback in callbacks:
+            callback(pixmap)
+
+# 监控墙模型：每个客户端一行，只记录最新一帧的哈希
+class ClientWallModel(QtCore.QAbstractListModel):
+    AddressRole = QtCore.Qt.UserRole
+    HashRole = QtCore.Qt.UserRole + 1
+    PrevHashRole = QtCore.Qt.UserRole + 2
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.addresses = []
+        self.rows = {}  # 客户端地址 -> 行号
+        self.frames = {}  # 客户端地址 -> (最新哈希, 上一帧哈希)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.addresses)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        address = self.addresses[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return f"Client {address}"
+        if role == self.AddressRole:
+            return address
+        if role == self.HashRole:
+            return self.frames[address][0]
+        if role == self.PrevHashRole:
+            return self.frames[address][1]
+        return None
+
+    # 更新客户端的最新一帧；视图只会重绘可见的行
+    def update_frame(self, address, image_hash):
+        row = self.rows.get(address)
+        if row is None:
+            row = len(self.addresses)
+            self.beginInsertRows(QtCore.QModelIndex(), row, row)
+            self.addresses.append(address)
+            self.rows[address] = row
+            self.frames[address] = (image_hash, None)
+            self.endInsertRows()
+            return
+        self.frames[address] = (image_hash, self.frames[address][0])
+        self.refresh(address)
+
+    def refresh(self, address):
+        row = self.rows.get(address)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+
+# 在线状态表的数据模型，每个客户端 (MAC地址, IP地址) 一行
+# 状态变化按界面刷新周期合并后一次应用：新客户端一次插入，已有客户端只通知变化的行和列范围，视图不需要重建
+# 排序在模型内用 list.sort 按每行保存的原始值完成，不经过代理模型逐对比较；只有排序列变化或插入新行时才重新排序
+class UserStatusModel(QtCore.QAbstractTableModel):
+    COLUMNS = ['MAC地址', 'IP地址', '状态', '最新截图', '帧率']
+    FIELD_COLUMNS = {'online': 2, 'last_frame': 3, 'fps': 4}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = {}  # (MAC地址, IP地址) -> 行号
+        self.values = []  # 每行 [MAC地址, IP地址, 是否在线, 最新截屏时刻, 帧率]
+        self.sort_column = -1
+        self.sort_order = QtCore.Qt.AscendingOrder
+        self.online_brush = QtGui.QBrush(QtGui.QColor('green'))
+        self.offline_brush = QtGui.QBrush(QtGui.QColor('gray'))
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.values)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        value = self.values[index.row()][index.column()]
+        column = index.column()
+        if role == QtCore.Qt.DisplayRole:
+            if column == 2:
+                return '在线' if value else '离线'
+            if column == 3:
+                return time.strftime('%m-%d %H:%M:%S', time.localtime(value)) if value else ''
+            if column == 4:
+                return f"{value:.2f}"
+            return value
+        if role == QtCore.Qt.BackgroundRole and column == 2:
+            return self.online_brush if value else self.offline_brush
+        return None
+
+    # 应用一批状态变化，changes 为 {(MAC地址, IP地址): 变化的字段}
+    def apply_changes(self, changes):
+        added = []
+        changed_rows = []
+        changed_columns = set()
+        for key, fields in changes.items():
+            row = self.rows.get(key)
+            if row is None:
+                values = [key[0], key[1], False, 0.0, 0.0]
+                added.append(values)
+            else:
+                values = self.values[row]
+                changed_rows.append(row)
+            for name, value in fields.items():
+                column = self.FIELD_COLUMNS.get(name)
+                if column is not None:
+                    values[column] = value or 0.0 if column == 3 else value
+                    changed_columns.add(column)
+        if changed_rows and changed_columns:
+            self.dataChanged.emit(self.index(min(changed_rows), min(changed_columns)),
+                                  self.index(max(changed_rows), max(changed_columns)))
+        if added:
+            first = len(self.values)
+            self.beginInsertRows(QtCore.QModelIndex(), first, first + len(added) - 1)
+            for row, values in enumerate(added, first):
+                self.rows[(values[0], values[1])] = row
+                self.values.append(values)
+            self.endInsertRows()
+        if added or self.sort_column in changed_columns:
+            self.resort()
+
+    # 过滤用的文本
+    def search_text(self, row):
+        values = self.values[row]
+        return f"{values[0]} {values[1]} {'在线' if values[2] else '离线'}".lower()
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        self.sort_column, self.sort_order = column, order
+        self.resort()
+
+    # 按当前排序列重新排列，并更新视图持有的持久索引（选中行等）
+    def resort(self):
+        if self.sort_column < 0:
+            return
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        keys = [(self.values[index.row()][0], self.values[index.row()][1]) for index in persistent]
+        self.values.sort(key=lambda values: values[self.sort_column],
+                         reverse=self.sort_order == QtCore.Qt.DescendingOrder)
+        self.rows = {(values[0], values[1]): row for row, values in enumerate(self.values)}
+        self.changePersistentIndexList(persistent, [self.index(self.rows[key], index.column())
+                                                    for key, index in zip(keys, persistent)])
+        self.layoutChanged.emit()
+
+# 在线状态表的过滤：任意一列包含关键字即显示；排序交给源模型，代理保持源模型的行顺序
+class UserStatusProxy(QtCore.QSortFilterProxyModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.text = ''
+
+    def set_filter_text(self, text):
+        self.text = text.strip().lower()
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, row, parent):
+        return not self.text or self.text in self.sourceModel().search_text(row)
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        self.sourceModel().sort(column, order)
+
+# 监控墙图块绘制；只有可见的图块会被绘制，因此也只有可见的客户端才会解码缩略图
+class ClientTileDelegate(QtWidgets.QStyledItemDelegate):
+    def __init__(self, loader, store, model, parent=None):
+        super().__init__(parent)
+        self.loader = loader
+        self.store = store
+        self.model = model
+        self.pending = set()  # 已请求加载、尚未完成的缩略图，同一张图只注册一次回调
+
+    def sizeHint(self, option, index):
+        return QtCore.QSize(*TILE_SIZE)
+
+    def paint(self, painter, option, index):
+        painter.save()
+        rect = option.rect.adjusted(4, 4, -4, -4)
+        if option.state & QtWidgets.QStyle.State_Selected:
+            painter.fillRect(option.rect, option.palette.highlight())
+        image_rect = rect.adjusted(0, 0, 0, -20)
+        address = index.data(ClientWallModel.AddressRole)
+        image_hash = index.data(ClientWallModel.HashRole)
+        thumb_path = self.store.thumb_path(image_hash)
+        pixmap = self.loader.cached(thumb_path, image_rect.size())
+        if pixmap is None:
+            if thumb_path not in self.pending:
+                self.pending.add(thumb_path)
+                self.loader.request(thumb_path, image_rect.size(),
+                                    lambda _, path=thumb_path, address=address: self.on_loaded(path, address))
+            # 新图加载完成前继续显示上一帧，避免闪烁
+            prev_hash = index.data(ClientWallModel.PrevHashRole)
+            if prev_hash:
+                pixmap = self.loader.cached(self.store.thumb_path(prev_hash), image_rect.size())
+        if pixmap is not None:
+            x = image_rect.x() + (image_rect.width() - pixmap.width()) // 2
+            y = image_rect.y() + (image_rect.height() - pixmap.height()) // 2
+            painter.drawPixmap(x, y, pixmap)
+        else:
+            painter.fillRect(image_rect, QtGui.QColor('black'))
+        painter.drawText(rect.adjusted(0, rect.height() - 20, 0, 0), QtCore.Qt.AlignCenter,
+                         index.data(QtCore.Qt.DisplayRole))
+        painter.restore()
+
+    def on_loaded(self, thumb_path, address):
+        self.pending.discard(thumb_path)
+        self.model.refresh(address)
+
 # 客户端窗口类
 class ClientWindow(QtWidgets.QWidget):
-    def __init__(self, client_address, parent=None):
+    def __init__(self, client_address, loader, parent=None):
         super().__init__(parent)
         self.client_address = client_address  # 客户端地址
+        self.loader = loader  # 后台图片加载器
+        self.current_path = None  # 最近一次请求显示的图片
         self.is_fullscreen = False  # 初始化全屏状态
         self.init_ui()  # 初始化UI界面
 
@@ -197,16 +937,18 @@ class ClientWindow(QtWidgets.QWidget):
 
         self.setWindowTitle(f"Client {self.client_address}")
 
-    def display_image(self, image_path):
-        if os.path.exists(image_path):  # 确认图片路径存在
-            pixmap = QtGui.QPixmap(image_path)
-            if not pixmap.isNull():
-                self.label.setPixmap(pixmap.scaled(
-                    self.label.size(), QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation))
-            else:
-                QtWidgets.QMessageBox.warning(self, "显示错误", f"无法显示图片: {image_path}")
-        else:
-            QtWidgets.QMessageBox.warning(self, "路径错误", f"图片路径不存在: {image_path}")
+    # 显示图片：窗口不大于缩略图时只读取缩略图，全屏等大窗口才读取原图
+    def display_image(self, thumb_path, image_path):
+        size = self.label.size()
+        use_thumb = (size.width() <= storage.THUMBNAIL_SIZE[0] * 1.5 and size.height() <= storage.THUMBNAIL_SIZE[1] * 1.5
+                     and self.loader.store.exists(thumb_path))
+        path = thumb_path if use_thumb else image_path
+        self.current_path = path
+        self.loader.request(path, size, lambda pixmap: self.set_pixmap(path, pixmap))
+
+    def set_pixmap(self, path, pixmap):
+        if path == self.current_path:  # 忽略已经过时的图片
+            self.label.setPixmap(pixmap)
 
     def toggle_fullscreen(self):
         if self.is_fullscreen:
@@ -218,16 +960,169 @@ class ClientWindow(QtWidgets.QWidget):
     def mouseDoubleClickEvent(self, event):
         self.toggle_fullscreen()
 
-# 服务器GUI类
+# 把服务器的通知转换为Qt信号；通知在接收线程中产生，信号在GUI线程中处理
+# 客户端状态变化不逐条发信号，先在这里按客户端合并，由界面的刷新定时器取走
+class ServerEvents(QtCore.QObject):
+    update_signal = QtCore.pyqtSignal(str, tuple)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.status_lock = threading.Lock()
+        self.pending_status = {}
+
+    def frame_received(self, img_hash, client_address):
+        self.update_signal.emit(img_hash, tuple(client_address))
+
+    def client_status_changed(self, client_address, fields):
+        with self.status_lock:
+            self.pending_status.setdefault(tuple(client_address), {}).update(fields)
+
+    # 取走合并后的状态变化
+    def take_status(self):
+        with self.status_lock:
+            changes, self.pending_status = self.pending_status, {}
+        return changes
+
+# 连接到无界面接收服务（ingest_daemon）的监控端口，提供界面使用的 Server 接口
+# 截图和数据库在本机共享，界面直接读取；关闭界面只断开监控连接，接收服务继续运行
+class RemoteServer:
+    def __init__(self, host, port):
+        self.sock = socket.create_connection((host, port))
+        self.rfile = self.sock.makefile('rb')
+        hello = json.loads(self.rfile.readline())
+        self.db_path = hello['db_path']
+        if hello['storage'] == 'pack':
+            self.store = PackStore(hello['store_root'], self.db_path)
+        else:
+            self.store = storage.ContentStore(hello['store_root'])
+        self.policies = policies.CapturePolicies(*hello['policies']['default'])
+        self.policies.restore(hello['policies'])
+        self.screenshot_interval, self.min_screenshot_interval = hello['policies']['default']
+        self.user_status = {}
+        self.status_lock = threading.Lock()  # user_status 在接收线程中更新，在界面线程中读取
+        self.listeners = []
+        self.send_lock = threading.Lock()
+        self.latest_metrics = None  # 接收服务定期推送的运行指标快照
+
+    # 接收通知直到连接断开，在后台线程中运行；格式错误的通知只跳过这一条
+    # 断开后无法再得知客户端状态，全部标记为离线
+    def start(self):
+        try:
+            for line in self.rfile:
+                try:
+                    self.handle_message(json.loads(line))
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    print(f'Ignoring malformed monitor message: {e!r}')
+        except OSError as e:
+            print(f'Monitor connection error: {e}')
+        print('Disconnected from ingest daemon')
+        fields = {'online': False, 'fps': 0.0}
+        with self.status_lock:
+            offline = [key for key, status in self.user_status.items() if status['online']]
+            for key in offline:
+                self.user_status[key].update(fields)
+        for key in offline:
+            for listener in self.listeners:
+                listener.client_status_changed(key, fields)
+
+    # 所有客户端状态的副本，[(客户端地址, 状态), ...]
+    def status_snapshot(self):
+        with self.status_lock:
+            return [(key, dict(status)) for key, status in self.user_status.items()]
+
+    def handle_message(self, message):
+        kind = message['type']
+        if kind == 'frame':
+            self.store.remember(message['locations'])  # 分段存储中尚未写入索引的新截图
+            for listener in self.listeners:
+                listener.frame_received(message['hash'], tuple(message['address']))
+        elif kind == 'status':
+            for mac, ip, fields in message['changes']:
+                with self.status_lock:
+                    self.user_status.setdefault((mac, ip), dict(STATUS_DEFAULTS)).update(fields)
+                for listener in self.listeners:
+                    listener.client_status_changed((mac, ip), fields)
+        elif kind == 'policies':
+            self.policies.restore(message['policies'])
+            self.screenshot_interval, self.min_screenshot_interval = message['policies']['default']
+        elif kind == 'metrics':
+            self.latest_metrics = message['metrics']
+
+    def metrics_snapshot(self):
+        return self.latest_metrics
+
+    def send(self, message):
+        with self.send_lock:
+            self.sock.sendall((json.dumps(message) + '\n').encode())
+
+    def get_frequency(self):
+        return self.screenshot_interval
+
+    def get_min_interval(self):
+        return self.min_screenshot_interval
+
+    def set_frequency(self, new_frequency, min_interval=None):
+        self.screenshot_interval = new_frequency
+        if min_interval is not None:
+            self.min_screenshot_interval = min_interval
+        self.policies.set_default(new_frequency, min_interval)
+        self.send({'type': 'set_frequency', 'frequency': new_frequency, 'min_interval': min_interval})
+
+    # 先更新本地副本，接收服务保存后推送完整的策略表
+    def set_policy(self, scope, target, interval, min_interval=None):
+        self.policies.set(scope, target, interval, min_interval)
+        self.send({'type': 'set_policy', 'scope': scope, 'target': target, 'interval': interval,
+                   'min_interval': min_interval})
+
+    def set_group(self, username, group):
+        self.policies.set_group(username, group)
+        self.send({'type': 'set_group', 'username': username, 'group': group})
+
+    def set_important(self, username, important):
+        self.policies.set_important(username, important)
+        self.send({'type': 'set_important', 'username': username, 'important': important})
+
+    def policies_snapshot(self):
+        return self.policies.snapshot()
+
+    def set_encoding(self, hint, address=None):
+        self.send({'type': 'set_encoding', 'hint': hint, 'address': list(address) if address else None})
+
+    def stop(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+# 服务器GUI类，server 可以是同一进程中的 Server，也可以是连接到无界面服务的 RemoteServer
 class ServerGUI(QtWidgets.QMainWindow):
     def __init__(self, server):
         super().__init__()
         self.server = server  # 服务器实例
-        self.server.update_signal.connect(self.display_image)
-        self.server.user_status_signal.connect(self.update_user_tree)
-        self.client_windows = {}
+        self.events = ServerEvents(self)
+        self.events.update_signal.connect(self.display_image)
+        self.server.listeners.append(self.events)
+        for client_address, status in self.server.status_snapshot():
+            self.events.client_status_changed(client_address, status)  # 注册监听者之前已经登录的客户端
+        self.client_windows = {}  # 双击打开的单个客户端窗口
+        self.pending_frames = {}  # 等待刷新的最新帧，同一客户端的多帧只保留最后一帧
+        self.image_loader = ImageLoader(self.server.store, parent=self)
         self.init_ui()  # 初始化UI界面
 
+        # 按固定帧率合并刷新，而不是每收到一帧就重绘
+        self.render_timer = QtCore.QTimer(self)
+        self.render_timer.timeout.connect(self.flush_frames)
+        self.render_timer.timeout.connect(self.flush_status)
+        self.render_timer.start(1000 // UI_FPS)
+
+        # 定期刷新状态栏中的接收速率和各阶段耗时
+        self.stats_snapshot = None
+        self.stats_time = None
+        self.stats_timer = QtCore.QTimer(self)
+        self.stats_timer.timeout.connect(self.update_stats)
+        self.stats_timer.start(STATS_REFRESH_INTERVAL)
+
     def init_ui(self):
         self.setWindowTitle('屏幕监控服务器')  # 设置主窗口标题
         self.setWindowIcon(QtGui.QIcon("icon.png"))  # 设置任务栏图标
@@ -240,6 +1135,10 @@ class ServerGUI(QtWidgets.QMainWindow):
         settings_action.triggered.connect(self.open_frequency_dialog)
         toolbar.addAction(settings_action)
 
+        policy_action = QtWidgets.QAction("策略", self)
+        policy_action.triggered.connect(self.open_policy_dialog)
+        toolbar.addAction(policy_action)
+
         show_action = QtWidgets.QAction("历史", self)
         show_action.triggered.connect(self.open_show_dialog)
         toolbar.addAction(show_action)
@@ -250,70 +1149,124 @@ class ServerGUI(QtWidgets.QMainWindow):
         self.setCentralWidget(self.central_widget)
 
         self.statusBar().showMessage("Ready")  # 状态栏显示准备就绪
+        self.stats_label = QtWidgets.QLabel(self)
+        self.statusBar().addPermanentWidget(self.stats_label)
+
+        # 上部布局：虚拟化的监控墙，只绘制可见的图块
+        self.wall_model = ClientWallModel(self)
+        self.wall_view = QtWidgets.QListView(self)
+        self.wall_view.setViewMode(QtWidgets.QListView.IconMode)
+        self.wall_view.setResizeMode(QtWidgets.QListView.Adjust)
+        self.wall_view.setMovement(QtWidgets.QListView.Static)
+        self.wall_view.setUniformItemSizes(True)
+        self.wall_view.setGridSize(QtCore.QSize(*TILE_SIZE))
+        self.wall_view.setModel(self.wall_model)
+        self.wall_view.setItemDelegate(ClientTileDelegate(self.image_loader, self.server.store, self.wall_model, self))
+        self.wall_view.doubleClicked.connect(self.open_client_window)
+        central_layout.addWidget(self.wall_view)
+
+        # 下部布局：在线状态表，支持按列排序和按关键字过滤
+        self.user_filter = QtWidgets.QLineEdit(self)
+        self.user_filter.setPlaceholderText("过滤 MAC地址 / IP地址 / 状态")
+        self.user_filter.setClearButtonEnabled(True)
+        central_layout.addWidget(self.user_filter)
 
-        # 上部布局
-        self.scroll_area = QtWidgets.QScrollArea(self)
-        self.scroll_area.setWidgetResizable(True)
-        self.scroll_content = QtWidgets.QWidget()
-        self.scroll_layout = QtWidgets.QGridLayout(self.scroll_content)
-        self.scroll_area.setWidget(self.scroll_content)
-        central_layout.addWidget(self.scroll_area)
-
-        # 下部布局
-        self.user_tree = QtWidgets.QTreeWidget(self)
-        self.user_tree.setColumnCount(3)
-        self.user_tree.setHeaderLabels(['MAC地址', 'IP地址', '状态'])
+        self.user_model = UserStatusModel(self)
+        self.user_proxy = UserStatusProxy(self)
+        self.user_proxy.setSourceModel(self.user_model)
+        self.user_filter.textChanged.connect(self.user_proxy.set_filter_text)
+
+        self.user_tree = QtWidgets.QTreeView(self)
+        self.user_tree.setRootIsDecorated(False)
+        self.user_tree.setUniformRowHeights(True)  # 行高相同，视图不需要逐行计算布局
+        self.user_tree.setModel(self.user_proxy)
+        self.user_tree.setSortingEnabled(True)
+        self.user_tree.sortByColumn(0, QtCore.Qt.AscendingOrder)
         central_layout.addWidget(self.user_tree)
 
     def open_frequency_dialog(self):
         current_frequency = self.server.get_frequency()  # 获取当前频率
-        dialog = FrequencyDialog(current_frequency, self)
+        dialog = FrequencyDialog(current_frequency, self.server.get_min_interval(), self)
         if dialog.exec_() == QtWidgets.QDialog.Accepted:
             new_frequency = dialog.get_frequency()
-            self.server.set_frequency(new_frequency)  # 设置新的频率
+            self.server.set_frequency(new_frequency, dialog.get_min_interval())  # 设置新的频率
+
+    def open_policy_dialog(self):
+        dialog = PolicyDialog(self.server, self)
+        dialog.exec_()
 
     def open_show_dialog(self):
-        dialog = ShowDialog(self.server.db_conn, self)
+        dialog = ShowDialog(self.server.db_path, self.server.store, self)
         dialog.exec_()
 
-    def display_image(self, image_path, client_address):
-        if client_address not in self.client_windows:
-            self.create_client_window(client_address)  # 创建新的客户端窗口
-        self.client_windows[client_address].display_image(image_path)
-        self.statusBar().showMessage(f"Received image from {client_address}")  # 状态栏显示接收到的图像信息
-        QtWidgets.QApplication.processEvents()
-
-    def create_client_window(self, client_address):
-        client_window = ClientWindow(client_address, self)
-        self.client_windows[client_address] = client_window
-        row = len(self.client_windows) // 3
-        col = len(self.client_windows) % 3
-        self.scroll_layout.addWidget(client_window, row, col)
+    # 收到新截图时只记录下来，由定时器统一刷新
+    def display_image(self, image_hash, client_address):
+        self.pending_frames[client_address] = image_hash
+
+    # 刷新界面：窗口最小化或隐藏时跳过，每个客户端只显示最新一帧
+    def flush_frames(self):
+        if not self.pending_frames or self.isMinimized() or not self.isVisible():
+            return
+        frames, self.pending_frames = self.pending_frames, {}
+        store = self.server.store
+        for client_address, image_hash in frames.items():
+            self.wall_model.update_frame(client_address, image_hash)
+            client_window = self.client_windows.get(client_address)
+            if client_window is not None and client_window.isVisible() and not client_window.isMinimized():
+                client_window.display_image(store.thumb_path(image_hash), store.image_path(image_hash))
+        self.statusBar().showMessage(f"Received images from {len(frames)} clients")  # 状态栏显示接收到的图像信息
+
+    # 双击监控墙中的图块，打开单独的客户端窗口
+    def open_client_window(self, index):
+        client_address = index.data(ClientWallModel.AddressRole)
+        client_window = self.client_windows.get(client_address)
+        if client_window is None:
+            client_window = ClientWindow(client_address, self.image_loader)
+            client_window.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+            client_window.destroyed.connect(lambda _, address=client_address: self.client_windows.pop(address, None))
+            self.client_windows[client_address] = client_window
         client_window.show()
+        client_window.raise_()
+        image_hash = index.data(ClientWallModel.HashRole)
+        client_window.display_image(self.server.store.thumb_path(image_hash), self.server.store.image_path(image_hash))
 
-    def update_user_tree(self, user_status):
-        self.user_tree.clear()
-        for (mac, ip), online in user_status.items():
-            status = '在线' if online else '离线'
-            item = QtWidgets.QTreeWidgetItem(self.user_tree, [mac, ip, status])
-            if online:
-                item.setBackground(2, QtGui.QColor('green'))
-            else:
-                item.setBackground(2, QtGui.QColor('gray'))
+    # 状态栏显示连接数、接收速率、写入队列长度和过载级别，悬停显示上一个刷新间隔内各阶段的平均耗时
+    def update_stats(self):
+        snapshot = self.server.metrics_snapshot()
+        if snapshot is None:
+            return
+        now = time.monotonic()
+        elapsed = now - self.stats_time if self.stats_time is not None else 0
+        fps, bps, averages = metrics.rates(self.stats_snapshot, snapshot, elapsed)
+        self.stats_snapshot, self.stats_time = snapshot, now
+        gauges = snapshot['gauges']
+        text = f"连接 {gauges.get('connections', 0)} | {fps:.1f} 帧/秒 | {bps / 1024 / 1024:.2f} MB/s"
+        if 'db_queue' in gauges:
+            text += f" | 写入队列 {gauges['db_queue']}"
+        if gauges.get('backpressure_level'):
+            text += f" | 过载 {gauges['backpressure_level']} 级"
+        self.stats_label.setText(text)
+        self.stats_label.setToolTip('\n'.join(f"{stage}: {averages[stage] * 1000:.2f} ms"
+                                              for stage in metrics.STAGES if stage in averages) or '暂无数据')
 
-    def resizeEvent(self, event):
-        for client_window in self.client_windows.values():
-            client_window.label.resize(client_window.size())
-        super().resizeEvent(event)
+    # 按刷新周期把合并后的状态变化应用到状态表；窗口最小化时变化继续合并，恢复后一次应用
+    def flush_status(self):
+        if self.isMinimized() or not self.isVisible():
+            return
+        changes = self.events.take_status()
+        if changes:
+            self.user_model.apply_changes(changes)
 
     def closeEvent(self, event):
+        for client_window in list(self.client_windows.values()):
+            client_window.close()
         self.server.stop()
         event.accept()
 
 def run_server_app(ServerClass):
     app = QtWidgets.QApplication(sys.argv)
     server = ServerClass()
-    threading.Thread(target=server.start).start()
+    threading.Thread(target=server.start, daemon=True).start()
     server_gui = ServerGUI(server)
     server_gui.show()
     sys.exit(app.exec_())
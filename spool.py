@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+import os
+import struct
+import threading
+
+# 客户端离线缓存
+# 与服务器断开期间，编码后的截图追加写入本地缓存分段：spool/00000001.spool，总大小超过上限时删除最旧的分段
+# 重连后按写入顺序分批读取补传，服务器确认整批后记录读取位置，整段补传完成后删除分段文件
+# 每条记录：记录头(截屏时刻 UTC 秒数, 元数据长度, 数据长度) + 元数据 + 图像数据
+# 确认前断线或进程退出时整批重新补传，服务器可能收到重复的帧，但不会丢失已缓存的帧
+SPOOL_DIR = 'spool'
+SPOOL_MAX_BYTES = 512 * 1024 * 1024  # 缓存总大小上限
+SPOOL_SEGMENT_SIZE = 16 * 1024 * 1024  # 单个分段的大小上限
+SEGMENT_SUFFIX = '.spool'
+CHECKPOINT_FILE = 'checkpoint'  # 已补传的位置：分段编号 偏移量
+
+RECORD_HEADER = struct.Struct('!dHI')
+
+class FrameSpool:
+    def __init__(self, root=SPOOL_DIR, max_bytes=SPOOL_MAX_BYTES, segment_size=SPOOL_SEGMENT_SIZE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.sizes = {}  # 分段编号 -> 文件大小，按编号递增
+        for name in sorted(os.listdir(root)):
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit():
+                number = int(name[:-len(SEGMENT_SUFFIX)])
+                self.sizes[number] = os.path.getsize(self.segment_path(number))
+        self.read_segment, self.read_offset = self.load_checkpoint()
+        for number in [n for n in self.sizes if n < self.read_segment]:
+            self.remove_segment(number)
+        self.writer = None  # 正在写入的分段，总是编号最大的分段；启动后从新分段开始，跳过上次退出时写了一半的记录
+        self.write_segment = None
+        self.evicted = 0  # 因超过上限删除的字节数
+
+    def segment_path(self, number):
+        return os.path.join(self.root, f'{number:08d}{SEGMENT_SUFFIX}')
+
+    def load_checkpoint(self):
+        try:
+            with open(os.path.join(self.root, CHECKPOINT_FILE)) as f:
+                segment, offset = f.read().split()
+                return int(segment), int(offset)
+        except (OSError, ValueError):
+            return (min(self.sizes) if self.sizes else 0), 0
+
+    def save_checkpoint(self):
+        path = os.path.join(self.root, CHECKPOINT_FILE)
+        with open(path + '.tmp', 'w') as f:
+            f.write(f'{self.read_segment} {self.read_offset}')
+        os.replace(path + '.tmp', path)
+
+    def remove_segment(self, number):
+        self.sizes.pop(number, None)
+        try:
+            os.remove(self.segment_path(number))
+        except FileNotFoundError:
+            pass
+
+    # 追加一帧，captured_at 为截屏时刻(UTC 秒数)，meta 为编码参数文本
+    def append(self, captured_at, meta, data):
+        meta = meta.encode()
+        header = RECORD_HEADER.pack(captured_at, len(meta), len(data))
+        size = len(header) + len(meta) + len(data)
+        with self.lock:
+            if self.writer is None or self.sizes[self.write_segment] + size > self.segment_size:
+                self.rotate()
+            self.writer.write(header)
+            self.writer.write(meta)
+            self.writer.write(data)
+            self.writer.flush()
+            self.sizes[self.write_segment] += size
+            self.evict()
+
+    # 开始写入新的分段
+    def rotate(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.write_segment = max(self.sizes, default=self.read_segment) + 1
+        self.writer = open(self.segment_path(self.write_segment), 'ab')
+        self.sizes[self.write_segment] = 0
+
+    # 超过总大小上限时删除最旧的分段，正在写入的分段保留
+    def evict(self):
+        total = sum(self.sizes.values())
+        while total > self.max_bytes and len(self.sizes) > 1:
+            oldest = min(self.sizes)
+            size = self.sizes[oldest]
+            self.remove_segment(oldest)
+            total -= size
+            self.evicted += size
+            if oldest >= self.read_segment:
+                self.read_segment, self.read_offset = min(self.sizes), 0
+            print(f"Spool full, dropped {size / 1024 / 1024:.1f} MB of oldest frames")
+
+    # 从已确认的位置读取一批帧，返回 ([(截屏时刻, 元数据, 数据), ...], 这批之后的位置)
+    # 末尾不完整的记录（写入时进程退出）视为分段结束
+    def read_batch(self, max_frames, max_bytes):
+        records = []
+        total = 0
+        with self.lock:
+            segment, offset = self.read_segment, self.read_offset
+            while len(records) < max_frames and total < max_bytes:
+                if segment not in self.sizes:
+                    later = [n for n in self.sizes if n > segment]
+                    if not later:
+                        break
+                    segment, offset = min(later), 0
+                with open(self.segment_path(segment), 'rb') as f:
+                    f.seek(offset)
+                    while len(records) < max_frames and total < max_bytes:
+                        header = f.read(RECORD_HEADER.size)
+                        if len(header) < RECORD_HEADER.size:
+                            break
+                        captured_at, meta_length, data_length = RECORD_HEADER.unpack(header)
+                        meta = f.read(meta_length)
+                        data = f.read(data_length)
+                        if len(meta) < meta_length or len(data) < data_length:
+                            break
+                        records.append((captured_at, meta.decode(), data))
+                        total += data_length
+                        offset = f.tell()
+                    else:
+                        break
+                if segment == self.write_segment:
+                    break
+                later = [n for n in self.sizes if n > segment]
+                segment, offset = (min(later) if later else segment + 1), 0  # 没有后续分段时跳过已经读完的旧分段
+                if not later:
+                    break
+        return records, (segment, offset)
+
+    # 服务器确认一批帧后提交读取位置，删除已经补传完的分段
+    def commit(self, position):
+        with self.lock:
+            segment, offset = position
+            if segment < self.read_segment:
+                return  # 补传期间该位置之前的分段已被删除
+            self.read_segment, self.read_offset = segment, offset
+            for number in [n for n in self.sizes if n < segment]:
+                self.remove_segment(number)
+            self.save_checkpoint()
+
+    # 尚未补传的字节数
+    def pending_bytes(self):
+        with self.lock:
+            return sum(size for number, size in self.sizes.items() if number >= self.read_segment) - self.read_offset
+
+    def empty(self):
+        return self.pending_bytes() <= 0
+
+    def close(self):
+        with self.lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
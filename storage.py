@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import uuid
+from io import BytesIO
+from PIL import Image
+
+THUMBNAIL_SIZE = (480, 360)  # 缩略图最大尺寸，实时监控墙只读取缩略图
+THUMBNAIL_QUALITY = 75
+THUMBNAIL_SUFFIX = '.thumb.jpg'
+IMAGE_SUFFIXES = ('.jpg', '.webp')  # 截图可能的格式，按文件头识别
+RELEASE_GRACE = 600  # 引用归零时，这段时间内被 put 使用过的文件保留，单位为秒
+
+# 根据文件头识别截图格式，返回文件后缀
+def image_suffix(data):
+    if bytes(data[:4]) == b'RIFF' and bytes(data[8:12]) == b'WEBP':
+        return '.webp'
+    return '.jpg'
+
+# 生成缩略图；draft模式让JPEG解码器直接按1/2、1/4、1/8缩小解码，比完整解码后再缩放快得多
+def make_thumbnail(data, size=THUMBNAIL_SIZE):
+    image = Image.open(BytesIO(data))
+    image.draft('RGB', size)
+    image = image.convert('RGB')
+    image.thumbnail(size, Image.BILINEAR)
+    buffered = BytesIO()
+    image.save(buffered, format='JPEG', quality=THUMBNAIL_QUALITY)
+    return buffered.getvalue()
+
+# 按内容寻址的截图存储
+# 文件名为图像的sha256，按前两级哈希前缀分目录：screenshots/ab/cd/abcd....jpg，缩略图保存在同一目录
+# 相同内容只保存一份，引用计数记录在数据库的 blobs 表中
+# put（接收线程或工作进程）和 release（写入线程）可能同时处理同一个哈希，不使用锁，通过文件修改时间协调：
+# put 遇到已存在的文件时刷新其修改时间再去重；release 先把文件改名，再按修改时间决定删除还是改回原名
+# put 刷新在改名之前则文件被保留，在改名之后则发现文件不存在而重新写入，新引用登记时文件总是存在
+# 因此被保留的文件和计数为0的记录由写入线程定期调用 sweep，在宽限期过后再次尝试删除
+class ContentStore:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    # 创建引用计数表
+    def create_tables(self, cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                size INTEGER,
+                refcount INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_blobs_released ON blobs (hash) WHERE refcount <= 0')
+
+    # 根据哈希得到文件路径
+    def path_for(self, img_hash, suffix='.jpg'):
+        return os.path.join(self.root, img_hash[:2], img_hash[2:4], img_hash + suffix)
+
+    # 写入图像，内容已存在时直接返回路径；先写临时文件再改名，并发写入相同内容也不会产生半个文件
+    # 不指定后缀时按文件头识别图像格式；owner 和 day 只有分段存储使用
+    def put(self, img_hash, data, suffix=None, owner=None, day=None):
+        path = self.path_for(img_hash, suffix or image_suffix(data))
+        if not self.touch(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return path
+
+    # 刷新已存在文件的修改时间，表示即将登记新的引用；文件不存在时返回 False
+    def touch(self, path):
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    # 截图文件路径，按 IMAGE_SUFFIXES 查找实际存在的格式
+    def image_path(self, img_hash):
+        for suffix in IMAGE_SUFFIXES:
+            path = self.path_for(img_hash, suffix)
+            if os.path.exists(path):
+                return path
+        return self.path_for(img_hash)
+
+    # 缩略图路径
+    def thumb_path(self, img_hash):
+        return self.path_for(img_hash, THUMBNAIL_SUFFIX)
+
+    # 为图像生成并保存缩略图，已存在时直接返回路径；thumbnail 为已经生成好的缩略图
+    def put_thumbnail(self, img_hash, data, owner=None, day=None, thumbnail=None):
+        path = self.thumb_path(img_hash)
+        if not self.touch(path):
+            self.put(img_hash, thumbnail or make_thumbnail(data), THUMBNAIL_SUFFIX)
+        return path
+
+    # 文件写入后即可读取，没有需要在进程间传递的位置，接口与分段存储相同
+    def pending_locations(self, img_hash):
+        return {}
+
+    def remember(self, locations):
+        pass
+
+    # 增加引用计数，与截图记录在同一个事务中执行
+    def add_ref(self, cursor, img_hash, size):
+        cursor.execute('''
+            INSERT INTO blobs (hash, size, refcount) VALUES (?, ?, 1)
+            ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1
+        ''', (img_hash, size))
+
+    # 减少引用计数，计数归零时删除文件，返回释放的字节数
+    # 图像文件刚被 put 使用过时保留文件和计数为0的记录，随后登记的引用会重新增加计数，否则由 sweep 删除
+    def release(self, cursor, img_hash, count=1):
+        cursor.execute('UPDATE blobs SET refcount = refcount - ? WHERE hash = ?', (count, img_hash))
+        return self.collect(cursor, img_hash)
+
+    # 删除计数已归零的图像、缩略图和记录；图像被保留时缩略图也保留，去重后的图像仍有缩略图
+    def collect(self, cursor, img_hash):
+        cursor.execute('SELECT size FROM blobs WHERE hash = ? AND refcount <= 0', (img_hash,))
+        row = cursor.fetchone()
+        if row is None:
+            return 0
+        if not all([self.remove(self.path_for(img_hash, suffix)) for suffix in IMAGE_SUFFIXES]):
+            return 0
+        self.remove(self.thumb_path(img_hash))
+        cursor.execute('DELETE FROM blobs WHERE hash = ?', (img_hash,))
+        return row[0] or 0
+
+    # 重新检查计数为0的记录，删除宽限期内没有再被 put 使用的图像，在写入线程中定期调用，返回释放的字节数
+    def sweep(self, cursor):
+        hashes = [img_hash for img_hash, in cursor.execute('SELECT hash FROM blobs WHERE refcount <= 0').fetchall()]
+        return sum(self.collect(cursor, img_hash) for img_hash in hashes)
+
+    # 删除引用归零的文件，文件在 RELEASE_GRACE 内被 put 使用过时改回原名并返回 False
+    def remove(self, path):
+        doomed = f"{path}.{uuid.uuid4().hex}.del"
+        try:
+            os.rename(path, doomed)
+        except FileNotFoundError:
+            return True
+        except OSError as e:  # Windows 下文件正被读取时不能改名
+            print(f'Error removing {path}: {e}')
+            return False
+        if os.stat(doomed).st_mtime > time.time() - RELEASE_GRACE:
+            os.replace(doomed, path)  # put 在改名后重新写入的内容相同，可以覆盖
+            return False
+        os.remove(doomed)
+        return True
+
+    def exists(self, path):
+        return bool(path) and os.path.exists(path)
+
+    # 读取图像数据，文件不存在时返回 None
+    def read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except (FileNotFoundError, TypeError):
+            return None
+
+    # 解析截图的实际路径，旧记录没有哈希时使用原来的 image_path
+    def resolve(self, img_hash, image_path=None):
+        if img_hash:
+            return self.image_path(img_hash)
+        return image_path
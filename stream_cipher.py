@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import struct
+from Crypto.Cipher import AES
+import protocol
+
+# 截图负载的分块流式加密（AES-GCM），客户端和服务端共用
+# 负载按 CHUNK_SIZE 切块，每块单独加密并附带16字节认证标签：密文块 + 标签 + 密文块 + 标签 ...
+# 每块的nonce由 (方向, 帧序号, 块序号) 组成，会话密钥在登录成功后由服务器下发，同一会话内nonce不会重复
+# 帧头字段作为附加认证数据，篡改帧头或截断、重排数据块都会导致校验失败
+# 发送和接收都逐块进行，边收边解密，不需要先把整帧密文读进内存再复制一份明文
+KEY_SIZE = 16
+CHUNK_SIZE = 64 * 1024
+TAG_SIZE = 16
+DIRECTION_UPLOAD = 0  # 客户端发往服务器的帧
+
+NONCE = struct.Struct('!III')  # 方向, 帧序号, 块序号
+AAD = struct.Struct('!BBIQI')  # 类型, 标志, 密文总长度, 客户端ID, 帧序号
+
+# 生成新的会话密钥
+def new_session_key():
+    return os.urandom(KEY_SIZE)
+
+# 明文长度对应的密文总长度；空负载也有一个只含标签的块
+def encrypted_length(length):
+    chunks = max(1, -(-length // CHUNK_SIZE))
+    return length + chunks * TAG_SIZE
+
+# 密文总长度对应的明文长度
+def plain_length(length):
+    full, rest = divmod(length, CHUNK_SIZE + TAG_SIZE)
+    if rest == 0 and full > 0:
+        return full * CHUNK_SIZE
+    if rest < TAG_SIZE:
+        raise protocol.ProtocolError(f"Bad encrypted payload length: {length}")
+    return full * CHUNK_SIZE + rest - TAG_SIZE
+
+class StreamCipher:
+    def __init__(self, key, direction=DIRECTION_UPLOAD):
+        self.key = key
+        self.direction = direction
+        self.decrypt_time = 0.0  # 累计的解密耗时(秒)，接收方用于统计，见 take_decrypt_time
+
+    # 取出上次调用以来的解密耗时
+    def take_decrypt_time(self):
+        elapsed, self.decrypt_time = self.decrypt_time, 0.0
+        return elapsed
+
+    def chunk_cipher(self, aad, seq, index):
+        cipher = AES.new(self.key, AES.MODE_GCM, nonce=NONCE.pack(self.direction, seq & 0xFFFFFFFF, index),
+                         mac_len=TAG_SIZE)
+        cipher.update(aad)
+        return cipher
+
+    # 加密并发送一帧，帧头带 FLAG_ENCRYPTED；只使用一个块大小的输出缓冲区
+    def send_frame(self, sock, msg_type, payload, client_id=0, seq=0, flags=0):
+        flags |= protocol.FLAG_ENCRYPTED
+        view = memoryview(payload)
+        length = encrypted_length(len(view))
+        aad = AAD.pack(msg_type, flags, length, client_id, seq)
+        out = bytearray(min(len(view), CHUNK_SIZE) + TAG_SIZE)
+        out_view = memoryview(out)
+        sock.sendall(protocol.pack_header(msg_type, length, client_id, seq, flags))
+        index = 0
+        offset = 0
+        while True:
+            chunk = view[offset:offset + CHUNK_SIZE]
+            n = len(chunk)
+            cipher = self.chunk_cipher(aad, seq, index)
+            if n:
+                cipher.encrypt(chunk, output=out_view[:n])
+            out_view[n:n + TAG_SIZE] = cipher.digest()
+            sock.sendall(out_view[:n + TAG_SIZE])
+            offset += n
+            index += 1
+            if offset >= len(view):
+                break
+
+    # 接收并解密一帧负载，密文直接收进明文缓冲区后原地解密；传入hasher时按明文计算摘要
+    def recv_payload(self, sock, msg_type, flags, length, client_id, seq, hasher=None):
+        buf = bytearray(plain_length(length))
+        view = memoryview(buf)
+        tag = bytearray(TAG_SIZE)
+        aad = AAD.pack(msg_type, flags, length, client_id, seq)
+        index = 0
+        offset = 0
+        while True:
+            chunk = view[offset:offset + CHUNK_SIZE]
+            recv_into_exactly(sock, chunk)
+            recv_into_exactly(sock, memoryview(tag))
+            self.open_chunk(chunk, tag, aad, seq, index, hasher)
+            offset += len(chunk)
+            index += 1
+            if offset >= len(buf):
+                return buf
+
+    # asyncio版本
+    async def read_payload(self, reader, msg_type, flags, length, client_id, seq, hasher=None):
+        buf = bytearray(plain_length(length))
+        view = memoryview(buf)
+        aad = AAD.pack(msg_type, flags, length, client_id, seq)
+        index = 0
+        offset = 0
+        while True:
+            chunk = view[offset:offset + CHUNK_SIZE]
+            data = await reader.readexactly(len(chunk) + TAG_SIZE)
+            chunk[:] = data[:len(chunk)]
+            self.open_chunk(chunk, data[len(chunk):], aad, seq, index, hasher)
+            offset += len(chunk)
+            index += 1
+            if offset >= len(buf):
+                return buf
+
+    # 原地解密一块并校验标签
+    def open_chunk(self, chunk, tag, aad, seq, index, hasher):
+        start = time.perf_counter()
+        cipher = self.chunk_cipher(aad, seq, index)
+        if len(chunk):
+            cipher.decrypt(chunk, output=chunk)
+        try:
+            cipher.verify(bytes(tag))
+        except ValueError:
+            raise protocol.ProtocolError(f"Authentication failed for frame {seq} chunk {index}")
+        self.decrypt_time += time.perf_counter() - start
+        if hasher is not None:
+            hasher.update(chunk)
+
+# 接收数据填满给定的缓冲区
+def recv_into_exactly(sock, view):
+    received = 0
+    while received < len(view):
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError("Connection closed while receiving payload")
+        received += n
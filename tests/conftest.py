@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 服务器模块导入时会在当前目录创建截图目录，测试从临时目录开始运行，不在仓库中留下文件
+def pytest_configure(config):
+    os.chdir(tempfile.mkdtemp(prefix='screen-monitor-tests-'))
+
+# 每个测试使用单独的工作目录，数据库、截图和分区都建在其中
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('screenshots', exist_ok=True)
+    return tmp_path
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+import backpressure
+import client
+import server
+
+# 积压超过水位线时直接升到对应级别
+def test_level_rises_with_backlog():
+    bp = backpressure.Backpressure()
+    assert not bp.update(0)
+    assert bp.update(1500) and bp.level == 1
+    assert bp.update(6000) and bp.level == 2
+    assert not bp.update(6000)
+    bp = backpressure.Backpressure()
+    assert bp.update(25000) and bp.level == 3
+
+# 积压低于水位线但没有低于一半时保持级别，之后每次检查最多降一级
+def test_level_recovers_one_step_at_a_time():
+    bp = backpressure.Backpressure()
+    bp.update(25000)
+    assert not bp.update(15000) and bp.level == 3
+    assert bp.update(4000) and bp.level == 2
+    assert bp.update(0) and bp.level == 1
+    assert bp.update(0) and bp.level == 0
+    assert not bp.update(0)
+
+# 处理卡住的帧按已经等待的时间计入延迟，处理完的帧按平均延迟计入
+def test_latency_raises_level():
+    bp = backpressure.Backpressure()
+    token = bp.begin()
+    bp.inflight[token] -= 3.0
+    assert bp.update(0) and bp.level == 2
+    assert bp.latency >= 3.0
+    bp.end(token)
+    assert bp.inflight_count() == 0
+    assert not bp.update(0) and bp.latency >= 3.0
+    assert bp.update(0) and bp.level == 1 and bp.latency == 0.0
+
+# 外部下发的最低级别和重要客户端的延后
+def test_floor_and_important_clients():
+    bp = backpressure.Backpressure()
+    bp.floor = 2
+    assert bp.update(0) and bp.level == 2
+    assert bp.level_for(important=True) == 0
+    assert bp.update(25000) and bp.level == 3
+    assert bp.level_for(important=True) == 1
+    bp.floor = 0
+    assert bp.update(0) and bp.level == 2
+
+@pytest.fixture
+def srv(workdir, monkeypatch):
+    srv = server.Server()
+    posted = []
+    monkeypatch.setattr(srv.control, 'post', lambda conn, message, key=None: posted.append(message))
+    yield srv, posted
+    srv.stop()
+
+def connection(username, client_protocol=0, binary=False):
+    conn = server.ClientConnection(('127.0.0.1', 50000))
+    conn.username = username
+    conn.mac_address, conn.ip_address = '00:11:22:33:44:55', '127.0.0.1'
+    conn.client_protocol = client_protocol
+    conn.binary = binary
+    return conn
+
+# 级别变化时新客户端收到延长的截屏间隔、最低编码档位和补传限制，恢复后取消限制
+def test_pressure_hints_follow_level(srv):
+    srv, posted = srv
+    conn = connection('alice', client_protocol=4, binary=True)
+    interval, min_interval = srv.screenshot_interval, srv.min_screenshot_interval
+    srv.backpressure.level = 2
+    srv.send_pressure(conn)
+    assert posted == [f'SET_FREQUENCY {interval * 3.0} {min_interval * 3.0}', 'SET_ENCODING level=3', 'THROTTLE 2']
+    posted.clear()
+    srv.send_pressure(conn)
+    assert posted == []
+    conn.encoding_hint = 'codec=webp quality=60'
+    srv.backpressure.level = 0
+    srv.send_pressure(conn)
+    assert posted == [f'SET_FREQUENCY {interval * 1.0} {min_interval * 1.0}', 'SET_ENCODING codec=webp quality=60',
+                      'THROTTLE 0']
+
+# 旧协议客户端只收到延长的截屏间隔；重要客户端晚两级受到限制
+def test_pressure_hints_for_legacy_and_important_clients(srv):
+    srv, posted = srv
+    srv.backpressure.level = 3
+    srv.send_pressure(connection('bob'))
+    assert posted == [f'SET_FREQUENCY {max(1, round(srv.screenshot_interval * 4.0))}']
+    posted.clear()
+    srv.policies.set_important('carol', True)
+    conn = connection('carol', client_protocol=4, binary=True)
+    srv.send_pressure(conn)
+    assert conn.pressure_level == 1
+    assert posted[1:] == ['SET_ENCODING auto', 'THROTTLE 1']
+
+# 客户端按提示提高最低编码档位并暂停补传，级别归零后恢复
+def test_client_applies_pressure_hints(tmp_path):
+    cl = client.Client('127.0.0.1', 1, spool_dir=str(tmp_path / 'spool'))
+    cl.handle_message('SET_FREQUENCY 45.0 6.0')
+    cl.handle_message('SET_ENCODING level=3')
+    cl.handle_message('THROTTLE 2')
+    assert (cl.capture_interval, cl.min_interval) == (45.0, 6.0)
+    assert cl.encoder.min_level == 3 and cl.throttle_level == 2
+    cl.handle_message('SET_ENCODING auto')
+    cl.handle_message('THROTTLE 0')
+    assert cl.encoder.min_level == 0 and cl.throttle_level == 0
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import threading
+import time
+import pytest
+import client
+import protocol
+from client import aes_decrypt
+
+# 已登录的客户端，连接的另一端由测试扮演服务器
+@pytest.fixture
+def logged_in(tmp_path):
+    peer, server_side = socket.socketpair()
+    cl = client.Client('127.0.0.1', 1, spool_dir=str(tmp_path / 'spool'))
+    cl.sock = peer
+    cl.username = 'alice'
+    cl.connected.set()
+    server_side.settimeout(5)
+    yield cl, server_side
+    server_side.close()
+    peer.close()
+
+# 读取到连接关闭为止收到的全部旧协议消息
+def read_messages(sock):
+    data = b''
+    chunk = sock.recv(4096)
+    while chunk:
+        data += chunk
+        chunk = sock.recv(4096)
+    return [aes_decrypt(message).decode() for message in protocol.split_legacy(data)]
+
+# 旧协议发送正在等待 ready 时停止：断开消息在长度消息之后完整发出，不会插入帧中间
+def test_stop_sends_disconnect_after_the_frame_in_progress(logged_in):
+    cl, server_side = logged_in
+    outcome = []
+
+    def send():
+        try:
+            cl.send_legacy(b'x' * 10)
+        except Exception as e:
+            outcome.append(e)
+
+    sender = threading.Thread(target=send)
+    sender.start()
+    time.sleep(0.2)
+    start = time.monotonic()
+    cl.stop()
+    sender.join(5)
+    assert time.monotonic() - start < 2
+    assert isinstance(outcome[0], ConnectionError)
+    messages = read_messages(server_side)
+    assert messages == ['10', f'DISCONNECT alice {cl.mac_address} {cl.ip_address}']
+
+# 重新连接时丢弃旧连接上没有取走的 ready/finish
+def test_reconnect_discards_stale_legacy_replies(tmp_path):
+    listener = socket.create_server(('127.0.0.1', 0))
+    try:
+        cl = client.Client('127.0.0.1', listener.getsockname()[1], spool_dir=str(tmp_path / 'spool'))
+        cl.legacy_replies.put('finish')
+        cl.connect()
+        assert cl.legacy_replies.empty()
+        cl.sock.close()
+    finally:
+        listener.close()
+
+# 吞吐量按确认估计：写进发送缓冲区很快，但确认要等 0.2 秒时，估计值反映的是送达耗时
+def test_throughput_is_estimated_from_acknowledged_bytes(logged_in):
+    cl, server_side = logged_in
+    seq = cl.send_binary(b'x' * 10000, ack_request=True)
+    assert cl.encoder.throughput is None
+    time.sleep(0.2)
+    with cl.ack_cond:
+        cl.record_delivery(seq)
+    assert 10000 / 0.5 < cl.encoder.throughput < 10000 / 0.15
+    assert not cl.in_flight
+
+# 空闲后发出的帧从开始发送算起，不把空闲时间算进送达耗时
+def test_idle_time_before_a_frame_is_not_counted(logged_in):
+    cl, server_side = logged_in
+    with cl.ack_cond:
+        cl.record_delivery(0)
+    time.sleep(0.3)
+    seq = cl.send_binary(b'x' * 10000, ack_request=True)
+    time.sleep(0.1)
+    with cl.ack_cond:
+        cl.record_delivery(seq)
+    assert cl.encoder.throughput > 10000 / 0.25
+
+# 含限速补传帧的确认不参与估计
+def test_spooled_frames_do_not_update_throughput(logged_in):
+    cl, server_side = logged_in
+    cl.send_binary(b'x' * 10000, protocol.FLAG_SPOOLED)
+    seq = cl.send_binary(b'x' * 10000, ack_request=True)
+    with cl.ack_cond:
+        cl.record_delivery(seq)
+    assert cl.encoder.throughput is None
+    assert not cl.in_flight
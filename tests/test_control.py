@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import os
+import random
+import socket
+import threading
+import time
+import types
+import pytest
+import control
+
+# 描述符编号超过 FD_SETSIZE 的连接也能判断为可写
+def test_writable_with_high_descriptor():
+    left, right = socket.socketpair()
+    try:
+        high = os.dup2(left.fileno(), 1500)
+    except OSError:
+        left.close()
+        right.close()
+        pytest.skip('descriptor limit is below 1500')
+    sock = socket.socket(fileno=high)
+    try:
+        conn = types.SimpleNamespace(writer=None, sock=sock)
+        assert control.writable(conn)
+    finally:
+        sock.close()
+        left.close()
+        right.close()
+
+# 测试用的连接：记录发出的控制消息，每次发送耗时随机，便于暴露多个发送线程交错发送
+class FakeConnection:
+    def __init__(self, sock, delay=0.0):
+        self.outbox = control.Outbox()
+        self.closed = False
+        self.writer = None
+        self.sock = sock
+        self.address = ('127.0.0.1', 0)
+        self.delay = delay
+        self.sent = []
+
+    def send_control(self, message):
+        time.sleep(random.uniform(0, self.delay))
+        self.sent.append(message)
+
+def wait_idle(conn, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with conn.outbox.lock:
+            if not conn.outbox.scheduled and not conn.outbox.messages:
+                return
+        time.sleep(0.01)
+    raise AssertionError('control messages were not flushed')
+
+# 多个线程同时放入同一类消息，最后放入的消息最后发出，旧消息不会在新消息之后到达
+def test_concurrent_posts_keep_the_latest_message_last():
+    left, right = socket.socketpair()
+    channel = control.ControlChannel()
+    conn = FakeConnection(left, delay=0.003)
+    order_lock = threading.Lock()
+    counter = itertools.count()
+    last = []
+
+    def poster():
+        for _ in range(100):
+            with order_lock:
+                message = f'SET_FREQUENCY {next(counter)}'
+                channel.post(conn, message, key='SET_FREQUENCY')
+                last[:] = [message]
+
+    try:
+        threads = [threading.Thread(target=poster) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wait_idle(conn)
+        assert conn.sent[-1] == last[0]
+        numbers = [int(message.split()[1]) for message in conn.sent]
+        assert numbers == sorted(numbers)
+    finally:
+        left.close()
+        right.close()
+
+# 不启动发送线程的控制通道，由测试逐个取出就绪的连接发送
+@pytest.fixture
+def manual():
+    left, right = socket.socketpair()
+    channel = control.ControlChannel(senders=0)
+    conn = FakeConnection(left)
+    yield channel, conn
+    left.close()
+    right.close()
+
+def flush_ready(channel):
+    while not channel.ready.empty():
+        channel.flush(channel.ready.get_nowait())
+
+# 同一类消息只发送最新的一条，并排到较早放入的其他消息之后；没有类别的消息每条都发送
+def test_messages_with_the_same_key_are_coalesced(manual):
+    channel, conn = manual
+    channel.post(conn, 'SET_FREQUENCY 15 2', key='SET_FREQUENCY')
+    channel.post(conn, 'SET_ENCODING level=1', key='SET_ENCODING')
+    channel.post(conn, 'KEYFRAME')
+    channel.post(conn, 'KEYFRAME')
+    channel.post(conn, 'SET_FREQUENCY 30 5', key='SET_FREQUENCY')
+    assert channel.ready.qsize() == 1
+    flush_ready(channel)
+    assert conn.sent == ['SET_ENCODING level=1', 'KEYFRAME', 'KEYFRAME', 'SET_FREQUENCY 30 5']
+    assert not conn.outbox.scheduled and not conn.outbox.sending
+
+# 积压超过上限时丢弃最旧的消息
+def test_oldest_messages_are_dropped_over_the_limit(manual):
+    channel, conn = manual
+    for i in range(control.CONTROL_QUEUE_SIZE + 5):
+        channel.post(conn, f'MESSAGE {i}')
+    flush_ready(channel)
+    assert conn.sent == [f'MESSAGE {i}' for i in range(5, control.CONTROL_QUEUE_SIZE + 5)]
+
+# 发送期间放入的消息在同一次发送中接着发出，排在已取出的消息之后
+def test_messages_posted_while_sending_follow_in_order(manual):
+    channel, conn = manual
+    send = conn.send_control
+
+    def send_and_post(message):
+        send(message)
+        if message == 'SET_FREQUENCY 15 2':
+            channel.post(conn, 'SET_FREQUENCY 30 5', key='SET_FREQUENCY')
+
+    conn.send_control = send_and_post
+    channel.post(conn, 'SET_FREQUENCY 15 2', key='SET_FREQUENCY')
+    channel.post(conn, 'SET_ENCODING auto', key='SET_ENCODING')
+    flush_ready(channel)
+    assert conn.sent == ['SET_FREQUENCY 15 2', 'SET_ENCODING auto', 'SET_FREQUENCY 30 5']
+    assert channel.ready.empty()
+
+# 连接不可写时消息留在待发表中，稍后重试时合并后发出
+def test_unwritable_connection_is_retried(manual, monkeypatch):
+    channel, conn = manual
+    monkeypatch.setattr(control, 'CONTROL_RETRY_DELAY', 0)
+    can_write = [False]
+    monkeypatch.setattr(control, 'writable', lambda conn: can_write[0])
+    channel.post(conn, 'SET_FREQUENCY 15 2', key='SET_FREQUENCY')
+    flush_ready(channel)
+    assert conn.sent == [] and len(channel.delayed) == 1
+    channel.post(conn, 'SET_FREQUENCY 30 5', key='SET_FREQUENCY')
+    assert channel.ready.empty()
+    can_write[0] = True
+    channel.retry_due()
+    flush_ready(channel)
+    assert conn.sent == ['SET_FREQUENCY 30 5']
+    assert not channel.delayed
+
+# 已关闭的连接丢弃待发消息，发送出错时也丢弃，之后放入的消息重新排队
+def test_closed_or_failed_connection_discards_messages(manual):
+    channel, conn = manual
+    conn.closed = True
+    channel.post(conn, 'SET_FREQUENCY 15 2', key='SET_FREQUENCY')
+    flush_ready(channel)
+    assert conn.sent == [] and not conn.outbox.messages and not conn.outbox.scheduled
+
+    conn.closed = False
+
+    def fail(message):
+        raise OSError('connection reset')
+
+    conn.send_control = fail
+    channel.post(conn, 'KEYFRAME')
+    channel.post(conn, 'SET_ENCODING auto', key='SET_ENCODING')
+    flush_ready(channel)
+    assert not conn.outbox.messages and not conn.outbox.scheduled
+    channel.post(conn, 'KEYFRAME')
+    assert channel.ready.qsize() == 1
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import pytest
+import database
+
+@pytest.fixture
+def writer(workdir):
+    conn = database.connect('screenshots.db')
+    db_writer = database.DBWriter(conn)
+    db_writer.start()
+    yield db_writer
+    db_writer.stop()
+    db_writer.join()
+    conn.close()
+
+# 在后台线程中调用 call，避免测试失败时一直等待
+def call_in_thread(db_writer, func):
+    outcome = []
+
+    def run():
+        try:
+            outcome.append(db_writer.call(func))
+        except Exception as e:
+            outcome.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(5)
+    assert outcome, 'DBWriter.call did not return'
+    return outcome[0]
+
+class CrashingParticipant:
+    def begin_item(self):
+        pass
+
+    def release_item(self):
+        pass
+
+    def rollback_item(self):
+        pass
+
+    def prepare(self, cursor):
+        raise RuntimeError('injected commit failure')
+
+    def commit(self):
+        pass
+
+    def rollback(self, cursor):
+        raise RuntimeError('injected rollback failure')
+
+def test_call_after_stop_raises(writer):
+    assert writer.call(lambda cursor: 1) == 1
+    writer.stop()
+    writer.join()
+    with pytest.raises(database.WriterStopped):
+        writer.call(lambda cursor: 1)
+
+# 写入线程异常退出时，正在写入的和之后的写操作都以 WriterStopped 结束
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_writer_crash_fails_pending_calls(writer):
+    writer.participants.append(CrashingParticipant())
+    assert isinstance(call_in_thread(writer, lambda cursor: 1), database.WriterStopped)
+    writer.join(5)
+    assert not writer.is_alive()
+    assert isinstance(call_in_thread(writer, lambda cursor: 1), database.WriterStopped)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import hashlib
+from io import BytesIO
+import pytest
+from PIL import Image
+import database
+import downsample
+import partitions
+import server
+
+# save_screenshot 用到的连接属性
+class FakeConnection:
+    mac_address = '00:11:22:33:44:55'
+    ip_address = '127.0.0.1'
+    address = ('127.0.0.1', 50000)
+    latest_frame_at = 0.0
+
+def noisy_jpeg():
+    image = Image.frombytes('RGB', (320, 240), os.urandom(320 * 240 * 3))
+    buffered = BytesIO()
+    image.save(buffered, format='JPEG', quality=95)
+    return buffered.getvalue()
+
+@pytest.fixture
+def srv(workdir):
+    srv = server.Server()
+    yield srv
+    srv.stop()
+
+# 降采样后的截图有自己的缩略图，原图和原图的缩略图被释放
+def test_downsampled_frames_get_thumbnails(srv):
+    data = noisy_jpeg()
+    img_hash = hashlib.sha256(data).hexdigest()
+    t = time.time() - 10 * 86400
+    srv.save_screenshot(FakeConnection(), data, img_hash, captured_at=t)
+    srv.db_writer.flush()
+    old_path, old_thumb = srv.store.image_path(img_hash), srv.store.thumb_path(img_hash)
+    os.utime(old_path, (t, t))
+    os.utime(old_thumb, (t, t))
+
+    downsampler = downsample.Downsampler(srv.db_path, srv.store, srv.db_writer, srv.partitions,
+                                         tiers=[(7, 'codec=jpeg quality=40 scale=0.5 gray=0', 1)], workers=1, rate=1000)
+    assert downsampler.run_once()[0] == 1
+
+    conn = database.connect_readonly(partitions.partition_path(partitions.partition_key(t), srv.db_path))
+    try:
+        new_hash, = conn.execute('SELECT image_hash FROM screenshots').fetchone()
+    finally:
+        conn.close()
+    assert new_hash != img_hash
+    thumbnail = srv.store.read(srv.store.thumb_path(new_hash))
+    assert thumbnail is not None
+    assert Image.open(BytesIO(thumbnail)).format == 'JPEG'
+    assert not os.path.exists(old_path) and not os.path.exists(old_thumb)
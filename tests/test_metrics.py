@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+import metrics
+
+class FakeConnection:
+    def __init__(self, mac_address, port):
+        self.mac_address = mac_address
+        self.address = ('127.0.0.1', port)
+        self.frames = 0
+        self.bytes_in = 0
+
+# 断线重连后每个客户端的计数继续累加，不会回到0
+def test_client_counters_survive_reconnect():
+    collector = metrics.IngestMetrics()
+    first = FakeConnection('mac', 50000)
+    first.frames, first.bytes_in = 3, 300
+    assert collector.snapshot([first])['clients'] == {'mac': [3, 300]}
+    collector.connection_closed(first)
+    assert collector.snapshot([first])['clients'] == {'mac': [3, 300]}  # 关闭时仍在连接列表中，不重复计算
+    assert collector.snapshot([])['clients'] == {'mac': [3, 300]}
+    second = FakeConnection('mac', 50001)
+    second.frames, second.bytes_in = 2, 200
+    assert collector.snapshot([second])['clients'] == {'mac': [5, 500]}
+    text = metrics.render(collector.snapshot([second]))
+    assert 'screenmon_client_frames_total{client="mac"} 5' in text
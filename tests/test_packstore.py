@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import hashlib
+import pytest
+import database
+import packstore
+from packstore import PackStore
+
+OLD_DAY = '2000-01-01'
+
+@pytest.fixture
+def store(workdir):
+    conn = database.connect('screenshots.db')
+    writer = database.DBWriter(conn)
+    writer.start()
+    pack = PackStore('packs', 'screenshots.db')
+    writer.call(pack.create_tables)
+    yield pack, writer
+    writer.stop()
+    writer.join()
+    pack.close()
+    conn.close()
+
+# 追加一条记录并登记引用
+def put(pack, writer, data, owner='client', day=None):
+    img_hash = hashlib.sha256(data).hexdigest()
+    pack.put(img_hash, data, owner=owner, day=day)
+    writer.call(lambda cursor: cursor.execute(
+        'INSERT INTO pack_objects (key, segment, offset, length, refcount) VALUES (?, ?, ?, ?, 1)',
+        (img_hash,) + tuple(pack.pending[img_hash])))
+    return img_hash
+
+def age(path, seconds):
+    stamp = time.time() - seconds
+    os.utime(path, (stamp, stamp))
+
+# 只剩少量有效数据的往日分段，空闲足够久后才会被压缩
+def test_compact_skips_recent_and_current_segments(store):
+    pack, writer = store
+    kept = put(pack, writer, b'kept' * 100, day=OLD_DAY)
+    put(pack, writer, b'today' * 100)
+    old_segment = pack.pending[kept][0]
+    today_segment = pack.writers[('client', time.strftime('%Y-%m-%d', time.gmtime()))][0]
+    pack.close()
+    assert pack.compact(writer, threshold=1.1) == 0  # 刚刚修改过
+    age(old_segment, packstore.COMPACT_MIN_AGE + 1)
+    age(today_segment, packstore.COMPACT_MIN_AGE + 1)
+    pack.compact(writer, threshold=1.1)
+    assert not os.path.exists(old_segment)
+    assert os.path.exists(today_segment)
+    assert bytes(pack.read(pack.image_path(kept))) == b'kept' * 100
+
+# 空闲过久的分段不再续写，压缩中的分段不会收到新记录
+def test_idle_segment_is_not_reused(store):
+    pack, writer = store
+    first = put(pack, writer, b'first', day=OLD_DAY)
+    segment = pack.pending[first][0]
+    age(segment, packstore.SEGMENT_REUSE_AGE + 1)
+    pack.writers[('client', OLD_DAY)][3] -= packstore.SEGMENT_REUSE_AGE + 1
+    second = put(pack, writer, b'second', day=OLD_DAY)
+    assert pack.pending[second][0] != segment
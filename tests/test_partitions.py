@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import pytest
+import database
+import partitions
+
+T = time.time()
+
+@pytest.fixture
+def writer(workdir):
+    conn = database.connect('screenshots.db')
+    conn.execute('CREATE TABLE refs (hash TEXT)')
+    partition_writer = partitions.PartitionWriter('screenshots.db')
+    db_writer = database.DBWriter(conn)
+    db_writer.add_participant(partition_writer)
+    db_writer.start()
+    db_writer.call(partition_writer.recover)
+    yield db_writer, partition_writer
+    db_writer.stop()
+    db_writer.join()
+    partition_writer.close()
+    conn.close()
+
+# 与 Server.insert_screenshot 相同：分区中插入截图记录，主库中增加引用
+def save(partition_writer, name, fail=False):
+    def op(cursor):
+        partition_writer.insert(T, 'mac', name, 'ip', name)
+        cursor.execute('INSERT INTO refs (hash) VALUES (?)', (name,))
+        if fail:
+            raise RuntimeError('injected failure')
+    return op
+
+def partition_hashes():
+    key = partitions.partition_key(T)
+    conn = database.connect_readonly(partitions.partition_path(key, 'screenshots.db'))
+    try:
+        return sorted(row[0] for row in conn.execute('SELECT image_hash FROM screenshots'))
+    finally:
+        conn.close()
+
+def main_hashes(db_writer):
+    return sorted(row[0] for row in db_writer.conn.execute('SELECT hash FROM refs'))
+
+# 同一批中间的写操作失败时，它写入分区的记录随主库的SAVEPOINT一起回滚
+def test_failed_item_rolls_back_partition_insert(workdir):
+    conn = database.connect('screenshots.db')
+    conn.execute('CREATE TABLE refs (hash TEXT)')
+    partition_writer = partitions.PartitionWriter('screenshots.db')
+    db_writer = database.DBWriter(conn, batch_interval=1.0)
+    db_writer.add_participant(partition_writer)
+    db_writer.submit(partition_writer.recover)
+    for name, fail in (('a', False), ('b', True), ('c', False)):
+        db_writer.submit(save(partition_writer, name, fail))  # 启动前放入队列，保证在同一批中执行
+    db_writer.start()
+    db_writer.flush()
+    try:
+        assert partition_hashes() == ['a', 'c']
+        assert main_hashes(db_writer) == ['a', 'c']
+    finally:
+        db_writer.stop()
+        db_writer.join()
+        partition_writer.close()
+        conn.close()
+
+class FailingParticipant:
+    def begin_item(self):
+        pass
+
+    def release_item(self):
+        pass
+
+    def rollback_item(self):
+        pass
+
+    def prepare(self, cursor):
+        raise RuntimeError('injected commit failure')
+
+    def commit(self):
+        pass
+
+    def rollback(self, cursor):
+        pass
+
+# 分区已经提交而主库提交失败时，删除分区中多出的记录
+def test_main_commit_failure_trims_partitions(writer):
+    db_writer, partition_writer = writer
+    db_writer.call(save(partition_writer, 'a'))
+    db_writer.participants.append(FailingParticipant())
+    with pytest.raises(RuntimeError):
+        db_writer.call(save(partition_writer, 'b'))
+    db_writer.participants.pop()
+    assert partition_hashes() == ['a']
+    assert main_hashes(db_writer) == ['a']
+
+# 进程在分区提交之后、主库提交之前退出，重新启动时删除多出的记录
+def test_recover_removes_uncommitted_rows(writer):
+    db_writer, partition_writer = writer
+    db_writer.call(save(partition_writer, 'a'))
+    key = partitions.partition_key(T)
+    conn = database.connect(partitions.partition_path(key, 'screenshots.db'))
+    conn.execute("INSERT INTO screenshots (id, image_hash) VALUES ((SELECT MAX(id) + 1 FROM screenshots), 'lost')")
+    conn.close()
+    db_writer.call(partition_writer.recover)
+    assert partition_hashes() == ['a']
+
+# 与 Server.expire_partitions 相同：释放主库中的引用后删除分区
+def expire(partition_writer):
+    def op(cursor):
+        key = partitions.partition_key(T)
+        cursor.execute('DELETE FROM refs')
+        partition_writer.drop(key, cursor)
+    return op
+
+# 删除分区的批次在主库提交时失败，引用计数恢复，分区文件也保留
+def test_failed_expiry_keeps_partition_files(writer):
+    db_writer, partition_writer = writer
+    db_writer.call(save(partition_writer, 'a'))
+    db_writer.participants.append(FailingParticipant())
+    with pytest.raises(RuntimeError):
+        db_writer.call(expire(partition_writer))
+    db_writer.participants.pop()
+    assert partition_hashes() == ['a']
+    assert main_hashes(db_writer) == ['a']
+    db_writer.call(expire(partition_writer))
+    assert partitions.list_partitions('screenshots.db') == []
+    assert os.listdir(partitions.partition_dir('screenshots.db')) == []
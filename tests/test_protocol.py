@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import os
+import socket
+import threading
+import hashlib
+from io import BytesIO
+import pytest
+from PIL import Image
+import protocol
+import server
+from server import aes_decrypt, aes_encrypt
+
+# 登录成功后的连接：服务器一端是 ClientConnection，另一端模拟客户端
+@pytest.fixture
+def session(workdir):
+    srv = server.Server()
+    server_sock, client_sock = socket.socketpair()
+    conn = server.ClientConnection(('127.0.0.1', 50000), sock=server_sock)
+    conn.username = 'alice'
+    conn.mac_address, conn.ip_address = '00:11:22:33:44:55', '127.0.0.1'
+    client_sock.settimeout(1.0)
+    try:
+        yield srv, conn, client_sock
+    finally:
+        server_sock.close()
+        client_sock.close()
+        srv.stop()
+
+# 旧客户端的 receive_updates：每次 recv 解密一条消息，SET_FREQUENCY 只有一个整数参数，出错时线程退出
+def baseline_receive_updates(sock):
+    intervals = []
+    while True:
+        try:
+            data = aes_decrypt(sock.recv(1024)).decode()
+            if data.startswith('SET_FREQUENCY'):
+                _, new_frequency = data.split()
+                intervals.append(int(new_frequency))
+        except socket.timeout:
+            return intervals
+        except Exception as e:
+            raise AssertionError(f'baseline client receive thread died: {e!r}')
+
+def test_welcome_is_readable_by_baseline_client(session):
+    srv, conn, client_sock = session
+    srv.send_welcome(conn)
+    assert baseline_receive_updates(client_sock) == [srv.screenshot_interval]
+    assert conn.session_cipher is None
+
+def test_welcome_advertises_protocol_after_client_opts_in(session):
+    srv, conn, client_sock = session
+    conn.client_protocol = protocol.PROTOCOL_VERSION
+    srv.send_welcome(conn)
+    data = b''
+    while data.count(b':') < 3:
+        data += client_sock.recv(1024)
+    messages = [aes_decrypt(message).decode() for message in protocol.split_legacy(data)]
+    assert messages[0].startswith('SET_FREQUENCY')
+    assert messages[1] == f'PROTOCOL {protocol.PROTOCOL_VERSION}'
+    assert messages[2].startswith('SESSION_KEY ')
+    assert conn.session_cipher is not None
+
+def small_jpeg():
+    image = Image.frombytes('RGB', (64, 48), os.urandom(64 * 48 * 3))
+    buffered = BytesIO()
+    image.save(buffered, format='JPEG')
+    return buffered.getvalue()
+
+# 超过内联上限的负载分两次写出，接收端拆出截屏时刻、元数据和图像，asyncio 使用的 pack_frame 字节相同
+def test_frame_round_trip():
+    left, right = socket.socketpair()
+    image = os.urandom(protocol.INLINE_PAYLOAD_LIMIT * 3)
+    payload = protocol.pack_timestamp(1700000000.5) + protocol.pack_meta('codec=jpeg quality=70') + image
+    flags = protocol.FLAG_TIMESTAMP | protocol.FLAG_META | protocol.FLAG_ACK_REQUEST
+    sender = threading.Thread(target=protocol.send_frame, args=(left, protocol.FRAME, payload, 42, 7, flags))
+    sender.start()
+    try:
+        header = protocol.recv_exactly(right, protocol.HEADER_SIZE)
+        assert header == protocol.pack_frame(protocol.FRAME, payload, 42, 7, flags)[:protocol.HEADER_SIZE]
+        assert header[1] == 4
+        msg_type, got_flags, length, client_id, seq = protocol.unpack_header(header)
+        assert (msg_type, got_flags, length, client_id, seq) == (protocol.FRAME, flags, len(payload), 42, 7)
+        received = protocol.recv_payload(right, length)
+        captured_at, rest = protocol.split_timestamp(received)
+        meta, rest = protocol.split_meta(rest)
+        assert captured_at == 1700000000.5
+        assert meta == 'codec=jpeg quality=70'
+        assert bytes(rest) == image
+    finally:
+        sender.join()
+        left.close()
+        right.close()
+
+# 帧头只用到旧标志时版本号保持为1，新版本的帧和魔数不对的数据被拒绝
+def test_frame_header_versions():
+    assert protocol.pack_header(protocol.FRAME, 0, flags=protocol.FLAG_DELTA)[1] == 1
+    assert protocol.pack_header(protocol.FRAME, 0, flags=protocol.FLAG_ENCRYPTED)[1] == 3
+    header = bytearray(protocol.pack_header(protocol.ACK, 0, seq=3))
+    header[1] = protocol.PROTOCOL_VERSION + 1
+    with pytest.raises(protocol.ProtocolError):
+        protocol.unpack_header(bytes(header))
+    with pytest.raises(protocol.ProtocolError):
+        protocol.unpack_header(b'\x00' * protocol.HEADER_SIZE)
+    assert not protocol.is_binary(aes_encrypt(b'LOGIN alice pw'))
+
+# 粘连的旧协议消息能拆开
+def test_split_legacy_messages():
+    messages = [aes_encrypt(text) for text in (b'ready', b'finish', b'SET_FREQUENCY 15')]
+    assert protocol.split_legacy(b''.join(messages)) == messages
+
+# 测试中扮演客户端：读取服务器发来的旧协议消息和二进制帧
+class Peer:
+    def __init__(self, sock):
+        self.sock = sock
+        self.messages = []
+
+    def login(self, *version):
+        self.sock.sendall(aes_encrypt(' '.join(('LOGIN', 'alice', 'pw') + version).encode()))
+        assert self.next_message() == 'LOGGEDIN'
+
+    # 下一条消息：旧协议消息为解密后的文本，二进制帧为 (type, seq, 解密后的控制消息)
+    def next_message(self):
+        if self.messages:
+            return self.messages.pop(0)
+        if protocol.peek_is_binary(self.sock):
+            msg_type, flags, client_id, seq, payload = protocol.recv_frame(self.sock)
+            text = aes_decrypt(payload).decode() if msg_type == protocol.CONTROL else None
+            return msg_type, seq, text
+        messages = [aes_decrypt(message).decode() for message in protocol.split_legacy(self.sock.recv(1024))]
+        self.messages.extend(messages[1:])
+        return messages[0]
+
+    def wait_for(self, expected):
+        received = []
+        while True:
+            message = self.next_message()
+            received.append(message)
+            if expected(message):
+                return received
+
+# 线程模式的连接处理：用户已注册，测试结束时断开并等待处理线程退出
+@pytest.fixture
+def connection(workdir):
+    srv = server.Server()
+    srv.add_user('alice', 'pw', '00:11:22:33:44:55', '127.0.0.1')
+    server_sock, client_sock = socket.socketpair()
+    client_sock.settimeout(5)
+    handler = threading.Thread(target=srv.handle_client, args=(server_sock, ('127.0.0.1', 50000)))
+    handler.start()
+    try:
+        yield srv, Peer(client_sock)
+    finally:
+        client_sock.close()
+        handler.join(5)
+        srv.stop()
+
+# 登录时不声明协议版本的客户端使用 length/ready/finish 文本握手上传
+def test_legacy_client_uploads_with_text_handshake(connection):
+    srv, peer = connection
+    peer.login()
+    image = small_jpeg()
+    peer.sock.sendall(aes_encrypt(str(len(image)).encode()))
+    received = peer.wait_for(lambda message: message == 'ready')
+    assert not any(isinstance(message, tuple) or message.startswith('PROTOCOL') for message in received)
+    peer.sock.sendall(image)
+    peer.wait_for(lambda message: message == 'finish')
+    peer.sock.sendall(aes_encrypt(b'DISCONNECT alice 00:11:22:33:44:55 127.0.0.1'))
+    with pytest.raises(ConnectionError):
+        peer.wait_for(lambda message: False)
+    srv.db_writer.flush()
+    assert os.path.exists(srv.store.image_path(hashlib.sha256(image).hexdigest()))
+
+# 声明协议版本的客户端收到 PROTOCOL 后发送二进制帧，请求确认的帧在保存后得到累积确认
+def test_binary_frames_are_acknowledged(connection):
+    srv, peer = connection
+    peer.login(str(protocol.PROTOCOL_VERSION))
+    peer.wait_for(lambda message: message == f'PROTOCOL {protocol.PROTOCOL_VERSION}')
+    images = [small_jpeg() for _ in range(3)]
+    for seq, image in enumerate(images, 1):
+        flags = protocol.FLAG_ACK_REQUEST if seq == len(images) else 0
+        protocol.send_frame(peer.sock, protocol.FRAME, image, 42, seq, flags)
+    received = peer.wait_for(lambda message: isinstance(message, tuple) and message[0] == protocol.ACK)
+    assert received[-1][1] == len(images)
+    assert (protocol.CONTROL, 0, f'SET_FREQUENCY {srv.screenshot_interval} {srv.min_screenshot_interval}') in received
+    for image in images:
+        assert os.path.exists(srv.store.image_path(hashlib.sha256(image).hexdigest()))
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+import downsample
+import server
+
+def test_server_starts_with_downsampling(workdir):
+    srv = server.Server(enable_downsample=True)
+    try:
+        assert isinstance(srv.downsampler, downsample.Downsampler)
+    finally:
+        srv.stop()
+
+def test_status_snapshot_is_a_copy(workdir):
+    srv = server.Server()
+    try:
+        srv.update_client_status(("mac", "ip"), {"online": True})
+        snapshot = srv.status_snapshot()
+        srv.update_client_status(("mac", "ip"), {"online": False})
+        assert snapshot == [(("mac", "ip"), dict(server.new_status(), online=True))]
+    finally:
+        srv.stop()
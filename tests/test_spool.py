@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import threading
+import time
+import pytest
+import client
+import protocol
+import spool
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not reached')
+        time.sleep(0.01)
+
+# 按写入顺序读出，确认前重新打开缓存会从同一位置重新读取，提交后不再读出
+def test_uncommitted_batch_is_read_again_after_restart(tmp_path):
+    frames = spool.FrameSpool(str(tmp_path))
+    for i in range(5):
+        frames.append(1000.0 + i, f'codec=jpeg index={i}', b'frame%d' % i)
+    records, position = frames.read_batch(3, 1 << 20)
+    assert [data for _, _, data in records] == [b'frame0', b'frame1', b'frame2']
+    frames.close()
+
+    frames = spool.FrameSpool(str(tmp_path))
+    again, position = frames.read_batch(3, 1 << 20)
+    assert again == records
+    frames.commit(position)
+    frames.close()
+
+    frames = spool.FrameSpool(str(tmp_path))
+    rest, position = frames.read_batch(10, 1 << 20)
+    assert rest == [(1003.0, 'codec=jpeg index=3', b'frame3'), (1004.0, 'codec=jpeg index=4', b'frame4')]
+    frames.commit(position)
+    assert frames.empty()
+    frames.close()
+
+# 超过总大小上限时删除最旧的分段，剩下的帧仍按顺序读出
+def test_oldest_segments_are_evicted(tmp_path):
+    frames = spool.FrameSpool(str(tmp_path), max_bytes=400, segment_size=100)
+    for i in range(10):
+        frames.append(float(i), '', bytes(50))
+    records, _ = frames.read_batch(100, 1 << 20)
+    assert frames.evicted > 0
+    assert [t for t, _, _ in records] == sorted(t for t, _, _ in records)
+    assert records[-1][0] == 9.0
+    assert len(records) < 10
+    frames.close()
+
+# 与服务器断开的客户端，离线缓存中已有截图
+@pytest.fixture
+def offline(tmp_path, monkeypatch):
+    monkeypatch.setattr(client, 'SPOOL_POLL', 0.05)
+    cl = client.Client('127.0.0.1', 1, spool_dir=str(tmp_path / 'spool'))
+    cl.spool = spool.FrameSpool(cl.spool_dir)
+    cl.spool_rate = 1 << 30
+    threads = []
+    yield cl, threads
+    cl.is_running = False
+    cl.pipeline_stop.set()
+    cl.connection_lost(cl.sock)
+    for thread in threads:
+        thread.join(5)
+    cl.spool.close()
+
+# 模拟重新登录：换上新连接，序号从头开始，并启动接收线程
+def attach(cl, threads):
+    peer, server_side = socket.socketpair()
+    server_side.settimeout(5)
+    with cl.ack_cond:
+        cl.sock = peer
+        cl.seq = cl.acked_seq = 0
+        cl.in_flight.clear()
+        cl.protocol_version = protocol.PROTOCOL_VERSION
+        cl.connected.set()
+    receiver = threading.Thread(target=cl.receive_updates, args=(peer,))
+    receiver.start()
+    threads.append(receiver)
+    return server_side
+
+# 发送失败的关键帧进入离线缓存，差分帧直接丢弃
+def test_failed_keyframes_are_spooled(offline):
+    cl, threads = offline
+    cl.send_queue.put_latest((time.monotonic(), True, True, b'delta', 'codec=jpeg'))
+    cl.send_queue.put_latest((time.monotonic(), True, False, b'keyframe', 'codec=jpeg'))
+    sender = threading.Thread(target=cl.send_loop)
+    sender.start()
+    threads.append(sender)
+    wait_until(lambda: not cl.spool.empty() and not cl.send_queue.queue)
+    cl.pipeline_stop.set()
+    sender.join(5)
+    records, _ = cl.spool.read_batch(10, 1 << 20)
+    assert [(meta, data) for _, meta, data in records] == [('codec=jpeg', b'keyframe')]
+
+# 补传途中断线、整批没有得到确认时，重连后从同一位置重新补传，确认后缓存清空
+def test_spool_is_replayed_after_reconnect(offline):
+    cl, threads = offline
+    for i in range(3):
+        cl.spool.append(1000.0 + i, 'codec=jpeg', b'frame%d' % i)
+    drainer = threading.Thread(target=cl.drain_loop)
+    drainer.start()
+    threads.append(drainer)
+
+    server_side = attach(cl, threads)
+    first = [protocol.recv_frame(server_side) for _ in range(3)]
+    server_side.close()
+    wait_until(lambda: not cl.connected.is_set())
+    time.sleep(0.2)  # 重连前有退避延迟，补传线程先发现断线
+    assert not cl.spool.empty()
+
+    server_side = attach(cl, threads)
+    second = [protocol.recv_frame(server_side) for _ in range(3)]
+    msg_type, flags, client_id, seq, payload = second[-1]
+    assert flags & protocol.FLAG_ACK_REQUEST
+    protocol.send_frame(server_side, protocol.ACK, client_id=client_id, seq=seq)
+    wait_until(cl.spool.empty)
+    server_side.close()
+
+    assert [payload for *_, payload in first] == [payload for *_, payload in second]
+    for i, (msg_type, flags, client_id, seq, payload) in enumerate(second):
+        assert flags & protocol.FLAG_SPOOLED
+        captured_at, rest = protocol.split_timestamp(payload)
+        meta, image = protocol.split_meta(rest)
+        assert (captured_at, meta, bytes(image)) == (1000.0 + i, 'codec=jpeg', b'frame%d' % i)
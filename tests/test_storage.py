@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import hashlib
+import sqlite3
+import pytest
+import storage
+from storage import ContentStore
+
+DATA = b'\xff\xd8 screenshot'
+HASH = hashlib.sha256(DATA).hexdigest()
+
+@pytest.fixture
+def store(workdir):
+    content = ContentStore('screenshots')
+    conn = sqlite3.connect('screenshots.db', isolation_level=None)
+    content.create_tables(conn.cursor())
+    yield content, conn.cursor()
+    conn.close()
+
+def age(path, seconds):
+    stamp = time.time() - seconds
+    os.utime(path, (stamp, stamp))
+
+# 引用归零且近期没有被 put 使用的文件被删除
+def test_release_removes_idle_file(store):
+    content, cursor = store
+    path = content.put(HASH, DATA)
+    content.add_ref(cursor, HASH, len(DATA))
+    age(path, storage.RELEASE_GRACE + 1)
+    assert content.release(cursor, HASH) == len(DATA)
+    assert not os.path.exists(path)
+    assert cursor.execute('SELECT COUNT(*) FROM blobs').fetchone()[0] == 0
+
+# put 按已存在的文件去重后、登记引用前，旧引用归零也不会删除文件
+def test_release_keeps_file_deduplicated_by_pending_put(store):
+    content, cursor = store
+    path = content.put(HASH, DATA)
+    content.add_ref(cursor, HASH, len(DATA))
+    age(path, storage.RELEASE_GRACE + 1)
+    assert content.put(HASH, DATA) == path  # 去重，尚未登记引用
+    assert content.release(cursor, HASH) == 0
+    content.add_ref(cursor, HASH, len(DATA))
+    assert content.read(path) == DATA
+    assert cursor.execute('SELECT refcount FROM blobs WHERE hash = ?', (HASH,)).fetchone()[0] == 1
+
+# 图像因宽限期被保留时缩略图也保留；宽限期过后由 sweep 删除图像、缩略图和计数为0的记录
+def test_sweep_removes_images_kept_during_grace(store):
+    content, cursor = store
+    path = content.put(HASH, DATA)
+    thumb = content.thumb_path(HASH)
+    content.put(HASH, DATA, storage.THUMBNAIL_SUFFIX)  # 测试数据不是真正的JPEG，直接写入缩略图文件
+    content.add_ref(cursor, HASH, len(DATA))
+    assert content.release(cursor, HASH) == 0
+    assert os.path.exists(path) and os.path.exists(thumb)
+    assert content.sweep(cursor) == 0
+    assert os.path.exists(path)
+    age(path, storage.RELEASE_GRACE + 1)
+    age(thumb, storage.RELEASE_GRACE + 1)
+    assert content.sweep(cursor) == len(DATA)
+    assert not os.path.exists(path) and not os.path.exists(thumb)
+    assert cursor.execute('SELECT COUNT(*) FROM blobs').fetchone()[0] == 0
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import pytest
+import protocol
+import stream_cipher
+from stream_cipher import CHUNK_SIZE, TAG_SIZE
+
+# 内存中的连接：发送的数据依次追加，接收时从头读出
+class BufferSocket:
+    def __init__(self, data=b''):
+        self.data = bytearray(data)
+        self.offset = 0
+
+    def sendall(self, data):
+        self.data += data
+
+    def recv_into(self, view, nbytes=0):
+        n = min(nbytes or len(view), len(self.data) - self.offset)
+        view[:n] = self.data[self.offset:self.offset + n]
+        self.offset += n
+        return n
+
+# 加密一帧，返回 (帧头字段, 密文负载)
+def seal(key, payload, seq=1, flags=0, client_id=42):
+    sock = BufferSocket()
+    stream_cipher.StreamCipher(key).send_frame(sock, protocol.FRAME, payload, client_id, seq, flags)
+    header = protocol.unpack_header(bytes(sock.data[:protocol.HEADER_SIZE]))
+    return header, bytes(sock.data[protocol.HEADER_SIZE:])
+
+def open_frame(key, header, body):
+    msg_type, flags, length, client_id, seq = header
+    cipher = stream_cipher.StreamCipher(key)
+    return bytes(cipher.recv_payload(BufferSocket(body), msg_type, flags, length, client_id, seq))
+
+@pytest.fixture
+def key():
+    return stream_cipher.new_session_key()
+
+# 多块、恰好整块和空负载都能还原，密文长度与帧头一致
+@pytest.mark.parametrize('size', [0, 1, CHUNK_SIZE, CHUNK_SIZE * 2 + 5])
+def test_round_trip(key, size):
+    payload = os.urandom(size)
+    header, body = seal(key, payload)
+    assert header[1] & protocol.FLAG_ENCRYPTED
+    assert header[2] == len(body) == stream_cipher.encrypted_length(size)
+    assert stream_cipher.plain_length(len(body)) == size
+    assert open_frame(key, header, body) == payload
+
+# asyncio 模式边读边解密，结果相同
+def test_async_round_trip(key):
+    payload = os.urandom(CHUNK_SIZE + 100)
+    (msg_type, flags, length, client_id, seq), body = seal(key, payload)
+
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(body)
+        reader.feed_eof()
+        cipher = stream_cipher.StreamCipher(key)
+        return await cipher.read_payload(reader, msg_type, flags, length, client_id, seq)
+
+    assert bytes(asyncio.run(read())) == payload
+
+# nonce 由帧序号和块序号组成：同一负载换一个帧序号得到不同的密文，各块的密文也互不相同
+def test_nonce_depends_on_sequence_and_chunk(key):
+    payload = bytes(CHUNK_SIZE * 2)
+    _, first = seal(key, payload, seq=1)
+    _, second = seal(key, payload, seq=2)
+    assert first != second
+    assert first[:CHUNK_SIZE] != first[CHUNK_SIZE + TAG_SIZE:2 * CHUNK_SIZE + TAG_SIZE]
+
+# 重放到另一个帧序号的密文无法通过校验
+def test_replayed_frame_is_rejected(key):
+    header, body = seal(key, os.urandom(1000), seq=1)
+    msg_type, flags, length, client_id, seq = header
+    with pytest.raises(protocol.ProtocolError):
+        open_frame(key, (msg_type, flags, length, client_id, 2), body)
+
+# 篡改密文、标签、帧头字段，或者交换数据块，都无法通过校验
+@pytest.mark.parametrize('tamper', ['ciphertext', 'tag', 'flags', 'client_id', 'swap'])
+def test_tampered_frame_is_rejected(key, tamper):
+    header, body = seal(key, os.urandom(CHUNK_SIZE * 2))
+    msg_type, flags, length, client_id, seq = header
+    body = bytearray(body)
+    if tamper == 'ciphertext':
+        body[10] ^= 1
+    elif tamper == 'tag':
+        body[CHUNK_SIZE] ^= 1
+    elif tamper == 'flags':
+        flags |= protocol.FLAG_DELTA
+    elif tamper == 'client_id':
+        client_id += 1
+    else:
+        block = CHUNK_SIZE + TAG_SIZE
+        body[:block], body[block:] = body[block:], body[:block]
+    with pytest.raises(protocol.ProtocolError):
+        open_frame(key, (msg_type, flags, length, client_id, seq), bytes(body))
+
+# 截断到最后一块之前的密文长度和帧头不符，或者用错误的密钥解密，都被拒绝
+def test_truncated_or_wrong_key_is_rejected(key):
+    header, body = seal(key, os.urandom(CHUNK_SIZE + 100))
+    msg_type, flags, length, client_id, seq = header
+    short = body[:CHUNK_SIZE + TAG_SIZE]
+    with pytest.raises(protocol.ProtocolError):
+        open_frame(key, (msg_type, flags, len(short), client_id, seq), short)
+    with pytest.raises(protocol.ProtocolError):
+        open_frame(stream_cipher.new_session_key(), header, body)
+    with pytest.raises(protocol.ProtocolError):
+        stream_cipher.plain_length(TAG_SIZE - 1)